@@ -0,0 +1,61 @@
+""" Per call overhead of resolving the album of every task of `upload_album`/`download_album` against `mock_server.py`:
+an album_path fetching `fullTree` on every call like before `AlbumRef` (`album_index_ttl=0`), an album_path looked up in the cached
+album index, an album_id and an `AlbumRef` returned by `resolve`
+
+    python benchmark/album_ref.py [--calls 20000] [--albums 10] [--depth 3] [--latency 0]
+"""
+import argparse
+import time
+import sys
+import os
+
+BENCHMARK = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK, "..", "src"))
+from pychee6 import LycheeClient
+from mock_server import MockLychee, serve
+
+UNCACHED_CALLS = 200    # calls fetching `fullTree`, they are slower by orders of magnitude
+
+def per_call(client:LycheeClient, album, calls:int):
+    """ :return: `float`, microseconds of one `album_path2id_assert(album)`, best of 3 runs
+    """
+    client.album_path2id_assert(album)  # fetches the album tree for the cached cases
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(calls):
+            client.album_path2id_assert(album)
+        elapsed = (time.perf_counter() - start) / calls * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Album resolution overhead per call")
+    parser.add_argument("--calls", type=int, default=20_000)
+    parser.add_argument("--albums", type=int, default=10, help="top level albums, each level below has a third as many per parent")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every request by the server")
+    args = parser.parse_args()
+
+    mock = MockLychee(args.latency)
+    mock.populate(args.albums, 0, args.depth)
+    server, base_url = serve(mock)
+    album_id = list(mock.albums)[-1]    # one of the deepest albums
+    album_path = f"/{mock.path_title(album_id)}"
+    try:
+        uncached = LycheeClient(base_url, album_index_ttl=0)
+        client = LycheeClient(base_url)
+        for c in [uncached, client]:
+            c.login_by_passwd("bench", "bench")
+        album_ref = client.resolve(album_path)
+        cases = [
+            ("album_path, fullTree per call", uncached, album_path, UNCACHED_CALLS),
+            ("album_path, cached index", client, album_path, args.calls),
+            ("album_id", client, album_id, args.calls),
+            ("AlbumRef", client, album_ref, args.calls),
+        ]
+        print(f"{len(mock.albums)} albums, {album_path}")
+        for name, c, album, calls in cases:
+            print(f"{name:<32} {per_call(c, album, calls):>12.2f} us/call")
+    finally:
+        server.shutdown()
@@ -0,0 +1,91 @@
+""" Download throughput of many small thumbnails and of a few large originals against `mock_server.py`:
+a `requests.get` per photo read in 10240 bytes like before the pooled session, against `download_photo` on the keep-alive
+connections of `LycheeSession` with `download_buffer_size`. Every case runs on `--workers` threads, best of `--repeat` runs
+
+    python benchmark/downloads.py [--workers 8] [--thumbs 1000] [--originals 4] [--original_size 33554432] [--latency 0]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+import requests
+
+BENCHMARK = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK, "..", "src"))
+from pychee6 import LycheeClient
+from mock_server import MockLychee, serve
+
+THUMB_SOURCE_SIZE = 64 * 1024   # the thumbnail is a seventh of it, about 9 KB
+
+def unpooled_download(url:str, save_full_name:str):
+    """ The download of `download_photo` before it used the session: a new connection for every photo
+    """
+    r = requests.get(url, stream=True)
+    r.raise_for_status()
+    with open(save_full_name, "wb") as f:
+        for item in r.iter_content(10240):
+            f.write(item)
+
+def run(download, photos:list, workers:int):
+    """ :return: `tuple`, `(seconds, bytes)` of downloading `photos` with `download(photo, file_name)`
+    """
+    save_path = tempfile.mkdtemp(prefix="pychee6_bench_")
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda photo: download(photo, os.path.join(save_path, photo["id"])), photos))
+        seconds = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(save_path, name)) for name in os.listdir(save_path))
+    finally:
+        shutil.rmtree(save_path)
+    return seconds, size
+
+def album_photos(client:LycheeClient, album_path:str, variant:str):
+    """ :return: `list` of `dict`, `{'id', 'url'}` of the `variant` of every photo in the album
+    """
+    photos = client.get_album(album_path)["resource"]["photos"]
+    return [{"id": photo["id"], "url": client.select_size_variant(photo, variant)[1]["url"]} for photo in photos]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download benchmark against a local mock Lychee server")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--thumbs", type=int, default=1000, help="photos downloaded as thumbnails")
+    parser.add_argument("--originals", type=int, default=4, help="photos downloaded as originals")
+    parser.add_argument("--original_size", type=int, default=32 * 2**20)
+    parser.add_argument("--buffer_sizes", type=int, nargs="+", default=[10240, 256 * 1024, 2**20], help="download_buffer_size of the pooled runs")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every request by the server")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    mock = MockLychee(args.latency)
+    thumbs_id, originals_id = mock.new_id(), mock.new_id()
+    mock.albums[thumbs_id] = {"id": thumbs_id, "title": "thumbs", "parent_id": None}
+    mock.albums[originals_id] = {"id": originals_id, "title": "originals", "parent_id": None}
+    for i in range(args.thumbs):
+        mock.add_photo(thumbs_id, f"thumb_{i}.jpg", os.urandom(THUMB_SOURCE_SIZE))
+    for i in range(args.originals):
+        mock.add_photo(originals_id, f"original_{i}.jpg", os.urandom(args.original_size))
+    server, base_url = serve(mock)
+
+    try:
+        clients = {size: LycheeClient(base_url, max_workers=args.workers, download_buffer_size=size) for size in args.buffer_sizes}
+        for client in clients.values():
+            client.login_by_passwd("bench", "bench")
+        client = clients[args.buffer_sizes[0]]
+        sets = [("thumbs", album_photos(client, "/thumbs", "thumb")), ("originals", album_photos(client, "/originals", "original"))]
+
+        downloaders = [("requests.get", lambda photo, file_name: unpooled_download(photo["url"], file_name))]
+        for size, c in clients.items():
+            downloaders.append((f"session, {size // 1024} KiB", lambda photo, file_name, c=c: c.download_photo(photo["url"], file_name)))
+
+        print(f"{'case':<12} {'download':<20} {'photos/s':>10} {'MiB/s':>10}")
+        for set_name, photos in sets:
+            for name, download in downloaders:
+                seconds, size = min((run(download, photos, args.workers) for _ in range(args.repeat)), key=lambda res: res[0])
+                print(f"{set_name:<12} {name:<20} {len(photos) / seconds:>10.1f} {size / 2**20 / seconds:>10.1f}")
+    finally:
+        server.shutdown()
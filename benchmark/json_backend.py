@@ -0,0 +1,47 @@
+""" Decoding time of a `get_album` response with each installed json backend of `JSON_BACKENDS`.
+The payload repeats the photos of `api_demo/get_album.json` with unique ids and titles
+
+    python benchmark/json_backend.py [photo_count ...]
+"""
+import sys
+import os
+import json
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+from pychee6 import JSON_BACKENDS
+
+REPEAT = 5
+
+def synthetic_album(count:int):
+    """ :return: `bytes`, the response of an album holding `count` photos
+    """
+    with open(os.path.join(ROOT, "api_demo", "get_album.json"), encoding="utf-8") as f:
+        album = json.load(f)
+    samples = album["resource"]["photos"]
+    photos = []
+    for i in range(count):
+        photo = json.loads(json.dumps(samples[i % len(samples)]))
+        photo["id"] = f"{i:024d}"
+        photo["title"] = f"IMG_{i:07d}.jpg"
+        photos.append(photo)
+    album["resource"]["photos"] = photos
+    return json.dumps(album, ensure_ascii=False, separators=(",", ":")).encode()
+
+def measure(loads, payload:bytes):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        loads(payload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == "__main__":
+    counts = [int(count) for count in sys.argv[1:]] or [1_000, 10_000, 50_000]
+    print(f"{'photos':>8} {'MiB':>7} " + " ".join(f"{name:>10}" for name in JSON_BACKENDS))
+    for count in counts:
+        payload = synthetic_album(count)
+        times = [measure(loads, payload) for loads in JSON_BACKENDS.values()]
+        print(f"{count:>8} {len(payload) / 2**20:>7.1f} " + " ".join(f"{t * 1000:>7.1f} ms" for t in times))
@@ -0,0 +1,425 @@
+""" A local stand-in for the Lychee v2 api used by the benchmarks. The responses are the shapes of `api_demo/get_album.json`
+and `api_demo/get_albums.json` with synthetic albums and photos, uploads are assembled from their chunks like Lychee does.
+`latency`, `max_chunk_size`, `capacity` and `fail` simulate a slow or overloaded server
+
+    python benchmark/mock_server.py [--port 8802] [--albums 10] [--photos 10] [--depth 2] [--photo_size 1024] [--latency 0]
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from email.parser import BytesParser
+import threading
+import argparse
+import hashlib
+import random
+import string
+import json
+import time
+import zipfile
+import copy
+import io
+import os
+
+API_DEMO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api_demo")
+VARIANTS = ["original", "medium2x", "medium", "small2x", "small", "thumb2x", "thumb"]
+ID_CHARS = string.ascii_letters + string.digits + "-_"
+
+def load_demo(name:str):
+    with open(os.path.join(API_DEMO, name), encoding="utf-8") as f:
+        return json.load(f)
+
+def format_size(size:float):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.2f} {unit}"
+        size /= 1024
+
+class MockLychee():
+    """ State of the server: albums, photos and the uploads in progress. Change the attributes while it runs,
+    eg. `capacity` to see how the client copes with an exhausted php-fpm pool
+    """
+    def __init__(self, latency:float=0.0, root:bool=True, max_chunk_size:int=None, capacity:int=None, seed:int=1):
+        """
+            :param latency: seconds every request waits before it is handled
+            :param root: `False` answers `Maintenance::fullTree` with 403 like for a user who is not admin
+            :param max_chunk_size: bodies of uploaded chunks above this size get 413, like `post_max_size` of php
+            :param capacity: requests handled at the same time, the others get 503
+            :param seed: of the ids and the photo data
+        """
+        album_demo = load_demo("get_album.json")
+        self._photo_template = album_demo["resource"]["photos"][0]
+        self._album_template = {key: value for key, value in album_demo["resource"].items() if key not in ["albums", "photos"]}
+        albums_demo = load_demo("get_albums.json")
+        self._child_template = albums_demo["albums"][0]
+        self._albums_template = {key: value for key, value in albums_demo.items() if key != "albums"}
+        self._random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.albums = {}    # id -> {'id', 'title', 'parent_id'}
+        self.photos = {}    # id -> {'id', 'title', 'album_id', 'data', 'checksum'}
+        self.uploads = {}   # uuid_name -> bytearray of the chunks received
+        self.latency = latency
+        self.root = root
+        self.max_chunk_size = max_chunk_size
+        self.capacity = capacity
+        self.fail = {}      # path -> number of 503 answers before it works again
+        self.counts = {}    # (method, path) -> requests
+        self.active = 0
+        self.base_url = ""
+
+    def new_id(self):
+        return "".join(self._random.choice(ID_CHARS) for _ in range(24))
+
+    def populate(self, albums:int=10, photos:int=10, depth:int=2, photo_size:int=1024):
+        """ Create `albums` top level albums, each level below has a third as many per parent, and `photos` photos in every album
+        """
+        parents = [None]
+        for level in range(depth):
+            children = []
+            for parent_id in parents:
+                for i in range(albums if level == 0 else max(1, albums // 3)):
+                    album_id = self.new_id()
+                    self.albums[album_id] = {"id": album_id, "title": f"album_{level}_{i}", "parent_id": parent_id}
+                    children.append(album_id)
+            parents = children
+        for album_id in list(self.albums):
+            for i in range(photos):
+                self.add_photo(album_id, f"photo_{i}.jpg", self._random.randbytes(photo_size))
+
+    def add_photo(self, album_id:str, title:str, data:bytes):
+        photo_id = self.new_id()
+        self.photos[photo_id] = {"id": photo_id, "title": title, "album_id": album_id, "data": bytes(data), "checksum": hashlib.sha1(data).hexdigest()}
+        return photo_id
+
+    def variant_data(self, photo:dict, variant:str):
+        """ The smaller variants are a prefix of the data
+        """
+        if variant == "original":
+            return photo["data"]
+        return photo["data"][:max(1, len(photo["data"]) // (VARIANTS.index(variant) + 1))]
+
+    def photo_json(self, photo:dict):
+        res = copy.deepcopy(self._photo_template)
+        extension = photo["title"].rsplit(".", 1)[-1] if "." in photo["title"] else "jpg"
+        for variant in VARIANTS:
+            if res["size_variants"].get(variant) is None:
+                continue
+            res["size_variants"][variant].update({
+                "filesize": format_size(len(self.variant_data(photo, variant))),
+                "url": f"{self.base_url}uploads/{variant}/{photo['id']}.{extension}",
+            })
+        res.update({"id": photo["id"], "album_id": photo["album_id"], "title": photo["title"], "checksum": photo["checksum"],
+                    "original_checksum": photo["checksum"], "is_starred": photo.get("is_starred", False)})
+        return res
+
+    def child_json(self, album:dict):
+        """ An album as listed by `Albums` and in `albums` of its parent
+        """
+        res = copy.deepcopy(self._child_template)
+        children = self.children(album["id"])
+        res.update({"id": album["id"], "title": album["title"], "has_subalbum": len(children) > 0, "num_subalbums": len(children),
+                    "num_photos": sum(1 for photo in self.photos.values() if photo["album_id"] == album["id"])})
+        return res
+
+    def albums_json(self):
+        """ :return: `dict`, the response of `Albums`, the smart albums are the ones of the demo
+        """
+        return {**copy.deepcopy(self._albums_template), "albums": [self.child_json(album) for album in self.children(None)]}
+
+    def album_json(self, album_id:str):
+        """ :return: `dict`, the resource of `Album`, `None` if the album does not exist
+        """
+        if album_id == "unsorted":
+            album = {"id": "unsorted", "title": "Unsorted", "parent_id": None}
+            photos, children = [photo for photo in self.photos.values() if photo["album_id"] is None], []
+        elif album_id in self.albums:
+            album = self.albums[album_id]
+            photos = [photo for photo in self.photos.values() if photo["album_id"] == album_id]
+            children = self.children(album_id)
+        else:
+            return None
+        res = copy.deepcopy(self._album_template)
+        res.update({"id": album["id"], "title": album["title"], "parent_id": album["parent_id"], "has_albums": len(children) > 0,
+                    "albums": [self.child_json(child) for child in children], "photos": [self.photo_json(photo) for photo in photos]})
+        return res
+
+    def children(self, parent_id:str):
+        return [album for album in self.albums.values() if album["parent_id"] == parent_id]
+
+    def full_tree(self):
+        """ :return: `list`, the nested set of `Maintenance::fullTree`
+        """
+        res = []
+        counter = 0
+
+        def walk(parent_id):
+            nonlocal counter
+            for album in self.children(parent_id):
+                counter += 1
+                node = {"id": album["id"], "title": album["title"], "parent_id": album["parent_id"], "_lft": counter}
+                res.append(node)
+                walk(album["id"])
+                counter += 1
+                node["_rgt"] = counter
+        walk(None)
+        return res
+
+    def path_title(self, album_id:str):
+        titles = []
+        while album_id:
+            album = self.albums[album_id]
+            titles.insert(0, album["title"])
+            album_id = album["parent_id"]
+        return "/".join(titles)
+
+    def remove_album(self, album_id:str):
+        for child in self.children(album_id):
+            self.remove_album(child["id"])
+        for photo_id in [photo["id"] for photo in self.photos.values() if photo["album_id"] == album_id]:
+            del self.photos[photo_id]
+        self.albums.pop(album_id, None)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "MockLychee/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:     # the client closed a kept-alive connection
+            pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, code:int, payload=None, content_type:str="application/json", headers:dict=None):
+        if payload is None:
+            data = b""
+        elif isinstance(payload, (bytes, bytearray)):
+            data = bytes(payload)
+        elif isinstance(payload, str) and content_type != "application/json":
+            data = payload.encode()
+        else:
+            data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self):
+        mock = self.mock
+        url = urlparse(self.path)
+        with mock.lock:
+            mock.active += 1
+            mock.counts[(self.command, url.path)] = mock.counts.get((self.command, url.path), 0) + 1
+            overloaded = mock.capacity is not None and mock.active > mock.capacity
+            failing = mock.fail.get(url.path, 0)
+            if failing:
+                mock.fail[url.path] = failing - 1
+        try:
+            body = self._read_body()
+            if mock.latency:
+                time.sleep(mock.latency)
+            if overloaded or failing:
+                return self._send(503, {"message": "Service Unavailable"})
+            self._route(url, body)
+        finally:
+            with mock.lock:
+                mock.active -= 1
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _dispatch
+
+    def _route(self, url, body:bytes):
+        if url.path in ["", "/"]:
+            return self._send(200, "<html></html>", "text/html", {"Set-Cookie": "XSRF-TOKEN=mock%3D; Path=/"})
+        if url.path.startswith("/uploads/"):
+            return self._file(url.path)
+        if not url.path.startswith("/api/v2/"):
+            return self._send(404, {"message": "Not Found"})
+        endpoint = url.path[len("/api/v2/"):]
+        if endpoint == "Zip":
+            return self._zip(parse_qs(url.query))
+        if "multipart/form-data" in (self.headers.get("Content-Type") or ""):
+            return self._upload(body)
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        with self.mock.lock:
+            self._api(endpoint, data)
+
+    def _api(self, endpoint:str, data:dict):
+        mock, method = self.mock, self.command
+        if endpoint in ["Auth::login", "Auth::logout"]:
+            return self._send(204)
+        if endpoint == "Albums":
+            return self._send(200, mock.albums_json())
+        if endpoint == "Album" and method == "GET":
+            res = mock.album_json(data.get("album_id"))
+            if res is None:
+                return self._send(404, {"message": f"No query results for model [App\\Models\\BaseAlbumImpl] {data.get('album_id')}",
+                                        "exception": "NotFoundHttpException"})
+            return self._send(200, {"config": {"is_accessible": True}, "resource": res})
+        if endpoint == "Album" and method == "POST":
+            album_id = mock.new_id()
+            mock.albums[album_id] = {"id": album_id, "title": data["title"], "parent_id": data.get("parent_id")}
+            return self._send(201, album_id, "text/plain")
+        if endpoint == "Album" and method == "DELETE":
+            for album_id in data.get("album_ids", []):
+                mock.remove_album(album_id)
+            return self._send(204)
+        if endpoint == "Album::move":
+            for album_id in data.get("album_ids", []):
+                mock.albums[album_id]["parent_id"] = data.get("album_id")
+            return self._send(204)
+        if endpoint == "Maintenance::fullTree":
+            if not mock.root:
+                return self._send(403, {"message": "Insufficient privileges", "exception": "UnauthorizedException"})
+            return self._send(200, mock.full_tree())
+        if endpoint == "Album::getTargetListAlbums":
+            return self._send(200, [{"id": album["id"], "title": mock.path_title(album["id"]), "original": album["title"],
+                                     "short_title": mock.path_title(album["id"]), "thumb": ""} for album in mock.albums.values()])
+        if endpoint in ["Photo::move", "Photo::copy", "Photo::star"] or (endpoint == "Photo" and method == "DELETE"):
+            missing = [photo_id for photo_id in data.get("photo_ids", []) if photo_id not in mock.photos]
+            if missing:     # Lychee rejects the whole request
+                return self._send(404, {"message": f"No query results for model [App\\Models\\Photo] {missing[0]}"})
+            for photo_id in data.get("photo_ids", []):
+                photo = mock.photos[photo_id]
+                if endpoint == "Photo::move":
+                    photo["album_id"] = data.get("album_id")
+                elif endpoint == "Photo::copy":
+                    mock.add_photo(data.get("album_id"), photo["title"], photo["data"])
+                elif endpoint == "Photo::star":
+                    photo["is_starred"] = data.get("is_starred", True)
+                else:
+                    del mock.photos[photo_id]
+            return self._send(204)
+        if endpoint == "Photo::rename":
+            if data.get("photo_id") not in mock.photos:
+                return self._send(404, {"message": f"No query results for model [App\\Models\\Photo] {data.get('photo_id')}"})
+            mock.photos[data["photo_id"]]["title"] = data["title"]
+            return self._send(204)
+        if endpoint == "Search":
+            return self._send(200, {"albums": [], "photos": []})
+        if endpoint == "UserManagement":
+            return self._send(200, [{"id": 1, "username": "root"}])
+        return self._send(404, {"message": f"Unknown endpoint {method} {endpoint}"})
+
+    def _upload(self, body:bytes):
+        """ One chunk of `POST Photo`, the photo is created with the last one
+        """
+        mock = self.mock
+        if mock.max_chunk_size is not None and len(body) > mock.max_chunk_size:
+            return self._send(413, "<html>413 Request Entity Too Large</html>", "text/html")
+        message = BytesParser().parsebytes(b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+        fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True) for part in message.get_payload()}
+        file_name = fields["file_name"].decode()
+        uuid_name = (fields.get("uuid_name") or b"").decode()
+        chunk_number, total_chunks = int(fields["chunk_number"]), int(fields["total_chunks"])
+        album_id = fields["album_id"].decode()
+        extension = "." + file_name.rsplit(".", 1)[-1] if "." in file_name else ""
+        with mock.lock:
+            if not uuid_name:
+                uuid_name = mock.new_id()[:16] + extension
+            mock.uploads.setdefault(uuid_name, bytearray()).extend(fields["file"] or b"")
+            res = {"file_name": file_name, "extension": extension, "uuid_name": uuid_name, "stage": "uploading",
+                   "chunk_number": chunk_number, "total_chunks": total_chunks}
+            if chunk_number == total_chunks:
+                data = mock.uploads.pop(uuid_name)
+                if album_id != "unsorted" and album_id not in mock.albums:
+                    return self._send(500, {"message": "Creating photo failed", "exception": "ModelDBException"})
+                mock.add_photo(None if album_id == "unsorted" else album_id, file_name, data)
+                res["stage"] = "done"
+        return self._send(200, res)
+
+    def _file(self, path:str):
+        """ `uploads/<variant>/<photo_id>.<extension>`, answers `Range` requests like a web server
+        """
+        _, _, variant, name = path.split("/", 3)
+        photo = self.mock.photos.get(name.rsplit(".", 1)[0])
+        if photo is None or variant not in VARIANTS:
+            return self._send(404, b"", "text/plain")
+        data = self.mock.variant_data(photo, variant)
+        byte_range = self.headers.get("Range")
+        if byte_range and byte_range.startswith("bytes="):
+            start = int(byte_range[len("bytes="):].split("-")[0])
+            if start >= len(data):
+                return self._send(416, b"", "text/plain", {"Content-Range": f"bytes */{len(data)}"})
+            return self._send(206, data[start:], "application/octet-stream", {"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"})
+        return self._send(200, data, "application/octet-stream", {"ETag": f'"{photo["checksum"]}"'})
+
+    def _zip(self, query:dict):
+        """ `Zip?photo_ids=...&variant=...`, a streamed archive with chunked encoding or the photo itself if there is only one
+        """
+        variant = query.get("variant", ["ORIGINAL"])[0].lower()
+        photos = [self.mock.photos[photo_id] for photo_id in query.get("photo_ids", [""])[0].split(",") if photo_id in self.mock.photos]
+        if len(photos) == 1:
+            return self._send(200, self.mock.variant_data(photos[0], variant), "application/octet-stream")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-zip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        names = set()
+        with zipfile.ZipFile(ChunkedWriter(self.wfile), "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for photo in photos:
+                name = photo["title"]
+                while name in names:
+                    name = f"_{name}"
+                names.add(name)
+                zf.writestr(name, self.mock.variant_data(photo, variant))
+        self.wfile.write(b"0\r\n\r\n")
+
+class ChunkedWriter(io.RawIOBase):
+    """ Unseekable file writing http chunks, the zip is sent while it is written
+    """
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if len(data):
+            self._wfile.write(f"{len(data):x}\r\n".encode() + bytes(data) + b"\r\n")
+        return len(data)
+
+def serve(mock:MockLychee, port:int=0):
+    """ Serve `mock` on 127.0.0.1 in a daemon thread
+        :param port: `0` picks a free port
+        :return: `tuple`, `(server, base_url)`, stop it with `server.shutdown()`
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.mock = mock
+    mock.base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, mock.base_url
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Lychee v2 server, log in with any user and password")
+    parser.add_argument("--port", type=int, default=8802)
+    parser.add_argument("--albums", type=int, default=10)
+    parser.add_argument("--photos", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--photo_size", type=int, default=1024)
+    parser.add_argument("--latency", type=float, default=0)
+    args = parser.parse_args()
+    mock = MockLychee(args.latency)
+    mock.populate(args.albums, args.photos, args.depth, args.photo_size)
+    server, base_url = serve(mock, args.port)
+    print(f"{base_url} {len(mock.albums)} albums {len(mock.photos)} photos, Ctrl+C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,36 @@
+""" Memory held by the photos of a large album as the `dict` of the api against `Photo` (`LycheeClient(use_models=True)`)
+
+    python benchmark/models.py [photo_count ...]
+"""
+import sys
+import os
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from pychee6 import Photo, get_json_backend
+from json_backend import synthetic_album
+
+def decode(payload:bytes, convert):
+    return [convert(photo) for photo in get_json_backend()(payload)["resource"]["photos"]]
+
+def measure(payload:bytes, convert):
+    """ :return: `tuple`, `(bytes held, seconds)`, the time is taken without `tracemalloc`
+    """
+    start = time.perf_counter()
+    decode(payload, convert)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    photos = decode(payload, convert)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del photos
+    return size, elapsed
+
+if __name__ == "__main__":
+    counts = [int(count) for count in sys.argv[1:]] or [10_000, 50_000]
+    print(f"{'photos':>8} {'dict':>20} {'Photo':>20}")
+    for count in counts:
+        payload = synthetic_album(count)
+        results = [measure(payload, convert) for convert in [lambda photo: photo, Photo]]
+        print(f"{count:>8} " + " ".join(f"{size / 2**20:>8.1f} MiB {elapsed:>6.2f} s" for size, elapsed in results))
@@ -0,0 +1,52 @@
+""" Scaling of the duplicate file name check of `download_album`:
+the old list lookup (`full_name in _file_name_list`) against `NameRegistry`
+
+    python benchmark/name_registry.py [count ...]
+"""
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from pychee6 import NameRegistry
+
+LIST_LIMIT = 20_000     # the list lookup is quadratic, larger runs are estimated from this many photos
+
+def synthetic_titles(count:int):
+    """ Titles like a camera produces, every 50th one is a duplicate
+    """
+    return [f"IMG_{i - (i % 50 == 49):07d}.jpg" for i in range(count)]
+
+def run_list(titles:list, save_path:str):
+    file_name_list = []
+    for i, file_name in enumerate(titles):
+        full_name = os.path.join(save_path, file_name)
+        if full_name in file_name_list:
+            tmp = file_name.split(".")
+            tmp.insert(-1, f"[{i}]")
+            file_name = ".".join(tmp)
+        else:
+            file_name_list.append(full_name)
+
+def run_registry(titles:list, save_path:str):
+    names = NameRegistry(case_insensitive=True)
+    for i, title in enumerate(titles):
+        os.path.join(save_path, names.claim(title, i))
+
+def measure(func, titles:list):
+    start = time.perf_counter()
+    func(titles, "/tmp/lychee_root/album")
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    counts = [int(count) for count in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f"{'photos':>10} {'list':>12} {'NameRegistry':>14}")
+    for count in counts:
+        titles = synthetic_titles(count)
+        registry_time = measure(run_registry, titles)
+        if count <= LIST_LIMIT:
+            list_time = f"{measure(run_list, titles):.3f} s"
+        else:   # O(n^2): scale a measured run
+            sample = LIST_LIMIT
+            list_time = f"~{measure(run_list, titles[:sample]) * (count / sample) ** 2:.0f} s"
+        print(f"{count:>10} {list_time:>12} {registry_time:>12.3f} s")
@@ -0,0 +1,54 @@
+""" Cold start of the cli: import time of its modules and wall time of short commands, best of `REPEAT` runs.
+With `LYCHEE_HOST` and the login variables set, `conv` and `ls` are timed against that server as well
+
+    python benchmark/startup.py [album_path]
+"""
+import sys
+import os
+import time
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+CLI = os.path.join(SRC, "cli.py")
+ENV = {**os.environ, "PYTHONPATH": SRC}
+REPEAT = 10
+MODULES = ["pychee6", "requests", "termcolor", "tqdm", "context_menu", "gettext"]
+
+def wall_time(command:list):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        subprocess.run(command, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def import_times():
+    """ :return: `dict`, cumulative import time in seconds of the `MODULES` imported by `cli`
+    """
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", "import cli"], env=ENV, capture_output=True, text=True)
+    times = {}
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() in MODULES and cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+if __name__ == "__main__":
+    album = sys.argv[1] if len(sys.argv) > 1 else "/"
+    for name, seconds in import_times().items():
+        print(f"import {name:<22} {seconds * 1000:>8.1f} ms")
+
+    commands = {
+        "python": [sys.executable, "-c", "pass"],
+        "import cli": [sys.executable, "-c", "import cli"],
+        "cli h": [sys.executable, CLI, "h"],
+    }
+    if os.getenv("LYCHEE_HOST"):
+        commands["cli conv"] = [sys.executable, CLI, "conv", album]
+        commands["cli ls"] = [sys.executable, CLI, "ls", album]
+        commands["cli -c ls"] = [sys.executable, CLI, "-c", "ls", album]
+    for name, command in commands.items():
+        print(f"{name:<29} {wall_time(command) * 1000:>8.1f} ms")
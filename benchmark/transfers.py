@@ -0,0 +1,191 @@
+""" Throughput and latency of `download_album`, `upload_album`, `album_path2id` and `get_album_tree` against `mock_server.py`
+for each worker count, best of `--repeat` runs. The transfers use `max_workers` threads, the album lookups are called from as many threads at once.
+Every run is saved in `benchmark/results` and compared with the last saved run of the same parameters
+
+    python benchmark/transfers.py [--workers 1 4 8] [--albums 3] [--photos 40] [--photo_size 262144] [--latency 0.01] [--compare FILE] [--no_save]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import argparse
+import tempfile
+import platform
+import shutil
+import json
+import time
+import sys
+import os
+
+BENCHMARK = os.path.dirname(os.path.abspath(__file__))
+RESULTS = os.path.join(BENCHMARK, "results")
+sys.path.insert(0, os.path.join(BENCHMARK, "..", "src"))
+from pychee6 import LycheeClient
+from mock_server import MockLychee, serve
+
+LOOKUPS = 200   # album_path2id/get_album_tree calls per run
+REGRESSION = 0.15   # drop of the throughput marked in the comparison, runs on the same machine differ by about 10%
+
+def percentile(values:list, fraction:float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+class TransferTimes():
+    """ Request hook collecting the seconds of each upload/download task
+    """
+    def __init__(self):
+        self.seconds = []
+
+    def __call__(self, event:str, record:dict):
+        if event == "transfer":
+            self.seconds.append(record["seconds"])
+
+def new_client(base_url:str, workers:int):
+    client = LycheeClient(base_url, max_workers=workers)
+    client.login_by_passwd("bench", "bench")
+    return client
+
+def result(seconds:float, items:int, latencies:list, size:int=0):
+    return {"seconds": seconds, "items": items, "items_per_second": items / seconds, "mib_per_second": size / 2**20 / seconds,
+            "p50_ms": percentile(latencies, 0.5) * 1000, "p95_ms": percentile(latencies, 0.95) * 1000}
+
+def run_download(mock:MockLychee, workers:int):
+    """ Download the first top level album with its sub albums
+    """
+    client = new_client(mock.base_url, workers)
+    times = TransferTimes()
+    client.add_request_hook(times)
+    save_path = tempfile.mkdtemp(prefix="pychee6_bench_")
+    try:
+        start = time.perf_counter()
+        client.download_album("/album_0_0", save_path)
+        client.wait_tasks()
+        seconds = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(save_path) for name in names)
+    finally:
+        client.threadpool_shutdown()
+        shutil.rmtree(save_path)
+    return result(seconds, len(times.seconds), times.seconds, size)
+
+def run_upload(mock:MockLychee, workers:int, local_dir:str):
+    """ Upload `local_dir` to a new album
+    """
+    client = new_client(mock.base_url, workers)
+    times = TransferTimes()
+    client.add_request_hook(times)
+    album_id = client.create_album("/", f"upload_{len(mock.albums)}")
+    size = sum(os.path.getsize(os.path.join(local_dir, name)) for name in os.listdir(local_dir))
+    try:
+        start = time.perf_counter()
+        client.upload_album(album_id, local_dir)
+        client.wait_tasks()
+        seconds = time.perf_counter() - start
+    finally:
+        client.threadpool_shutdown()
+    return result(seconds, len(times.seconds), times.seconds, size)
+
+def run_lookups(mock:MockLychee, workers:int, call):
+    """ `LOOKUPS` calls of `call(client, i)` from `workers` threads sharing one client, the first call fetches the album tree
+    """
+    client = new_client(mock.base_url, workers)
+
+    def timed(i):
+        start = time.perf_counter()
+        call(client, i)
+        return time.perf_counter() - start
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            latencies = list(pool.map(timed, range(LOOKUPS)))
+        seconds = time.perf_counter() - start
+    finally:
+        client.threadpool_shutdown()
+    return result(seconds, LOOKUPS, latencies)
+
+def run(args):
+    """ :return: `list` of `dict`, eg. {'case': 'download_album', 'workers': 4, 'seconds': 0.8, 'items': 120, 'items_per_second': 150, ...}
+    """
+    mock = MockLychee(args.latency)
+    mock.populate(args.albums, args.photos, 2, args.photo_size)
+    server, _ = serve(mock)
+    paths = [f"/{mock.path_title(album_id)}" for album_id in mock.albums]
+    local_dir = tempfile.mkdtemp(prefix="pychee6_bench_")
+    for i in range(args.photos):
+        with open(os.path.join(local_dir, f"IMG_{i:05d}.jpg"), "wb") as f:
+            f.write(os.urandom(args.photo_size))
+
+    cases = {
+        "download_album": lambda workers: run_download(mock, workers),
+        "upload_album": lambda workers: run_upload(mock, workers, local_dir),
+        "album_path2id": lambda workers: run_lookups(mock, workers, lambda client, i: client.album_path2id(paths[i % len(paths)])),
+        "get_album_tree": lambda workers: run_lookups(mock, workers, lambda client, i: client.get_album_tree()),
+    }
+    results = []
+    try:
+        for name, case in cases.items():
+            for workers in args.workers:
+                best = min((case(workers) for _ in range(args.repeat)), key=lambda res: res["seconds"])
+                results.append({"case": name, "workers": workers, **best})
+                print(f"{name:<16} {workers:>3} workers {best['items_per_second']:>9.1f} /s {best['mib_per_second']:>8.1f} MiB/s "
+                      f"p50 {best['p50_ms']:>8.2f} ms p95 {best['p95_ms']:>8.2f} ms")
+    finally:
+        server.shutdown()
+        shutil.rmtree(local_dir)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def last_run(parameters:dict):
+    """ :return: `str`, the newest file in `RESULTS` run with the same parameters, `None` if there is none
+    """
+    if not os.path.isdir(RESULTS):
+        return None
+    for name in sorted(os.listdir(RESULTS), reverse=True):
+        with open(os.path.join(RESULTS, name), encoding="utf-8") as f:
+            if json.load(f)["parameters"] == parameters:
+                return os.path.join(RESULTS, name)
+    return None
+
+def compare(results:list, previous_file:str):
+    """ Print the change of the throughput and of the p95 latency against a saved run, a drop of more than `REGRESSION` is marked
+    """
+    with open(previous_file, encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"\ncompared with {os.path.basename(previous_file)} ({previous['commit'] or 'unknown commit'})")
+    before = {(res["case"], res["workers"]): res for res in previous["results"]}
+    for res in results:
+        old = before.get((res["case"], res["workers"]))
+        if old is None:
+            continue
+        throughput = res["items_per_second"] / old["items_per_second"] - 1
+        latency = res["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0
+        mark = "  regression" if throughput < -REGRESSION else ""
+        print(f"{res['case']:<16} {res['workers']:>3} workers throughput {throughput:>+7.1%} p95 {latency:>+7.1%}{mark}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transfer benchmark against a local mock Lychee server")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--albums", type=int, default=3, help="top level albums, each has one sub album")
+    parser.add_argument("--photos", type=int, default=40, help="photos per album")
+    parser.add_argument("--photo_size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every request by the server")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--compare", help="saved run to compare with, default is the last one with the same parameters")
+    parser.add_argument("--no_save", action="store_true")
+    args = parser.parse_args()
+
+    parameters = {key: getattr(args, key) for key in ["workers", "albums", "photos", "photo_size", "latency", "repeat"]}
+    previous_file = args.compare or last_run(parameters)
+    results = run(args)
+    if previous_file:
+        compare(results, previous_file)
+    if not args.no_save:
+        os.makedirs(RESULTS, exist_ok=True)
+        file_name = os.path.join(RESULTS, f"transfers-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(file_name, "w", encoding="utf-8") as f:
+            json.dump({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(), "python": platform.python_version(),
+                       "parameters": parameters, "results": results}, f, indent=2)
+        print(f"\nsaved {file_name}")
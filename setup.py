@@ -15,6 +15,11 @@ setup(
     package_dir={"pychee6": "src"},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        "async": ["aiohttp"],
+        "json": ["orjson"],
+        "exif": ["pyexiv2"],
+    },
     package_data={
         'pychee6': ['locales/**/*'],
     },
@@ -1 +1,9 @@
-from .pychee6 import LycheeClient
\ No newline at end of file
+__all__ = ["LycheeClient", "AlbumRef", "Album", "Photo", "SizeVariant", "SIZE_VARIANTS", "JSON_BACKENDS", "get_json_backend", "NameRegistry", "RequestMetrics",
+           "format_filesize", "is_case_insensitive"]
+
+def __getattr__(name):
+    # imported on first use, `python -m pychee6.cli -d` does not need requests
+    if name in __all__:
+        from . import pychee6
+        return getattr(pychee6, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
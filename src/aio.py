@@ -0,0 +1,658 @@
+""" asyncio version of `LycheeClient`, built on `aiohttp`: `pip install pychee6[async]`
+
+    async with AsyncLycheeClient("http://127.0.0.1:8802/") as client:
+        await client.login_by_passwd("root", "123456")
+        results = await client.download_album("/album", "./tmp/")
+"""
+from .pychee6 import (AlbumIndex, AlbumRef, NameRegistry, UploadJournal, API_VERSION, API_HEADER, api_headers, csrf_header,
+                      download_headers, select_size_variant, parse_filesize, file_sha1, is_case_insensitive, get_json_backend,
+                      import_rm_title_des, new_process_pool)
+from functools import partial
+import aiohttp
+import asyncio
+import base64
+import time
+import math
+import os
+
+def _read_chunk(file_name:str, offset:int, size:int):
+    """ :return: `bytes`, `size` bytes of the file from `offset`, run in a thread so reading a cold file does not block the loop
+    """
+    with open(file_name, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+def _file_size(file_name:str):
+    """ :return: `int`, size of the file, `0` if it does not exist
+    """
+    return os.path.getsize(file_name) if os.path.isfile(file_name) else 0
+
+def _is_downloaded(file_name:str, checksum:str=None, filesize=None):
+    """ see `LycheeClient._is_downloaded`, run in a thread
+    """
+    if not (checksum or filesize) or not os.path.isfile(file_name):
+        return False
+    if filesize is not None:
+        try:
+            size, tolerance = parse_filesize(filesize)
+            if abs(os.path.getsize(file_name) - size) > tolerance:
+                return False
+        except ValueError:
+            if checksum is None:
+                return False
+    if checksum:
+        return file_sha1(file_name) == checksum
+    return True
+
+def _scan_dir(path:str):
+    """ :return: `list` of `(path, name, is_dir)` of the directories and files in `path`, run in a thread
+    """
+    with os.scandir(path) as entries:
+        return [(entry.path, entry.name, entry.is_dir()) for entry in entries if entry.is_dir() or entry.is_file()]
+
+class AsyncResponse():
+    """ A read api response, with the part of the `requests.Response` interface used by the client
+    """
+    __slots__ = ("status_code", "headers", "content")
+
+    def __init__(self, status_code:int, headers, content:bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return get_json_backend()(self.content)
+
+class AsyncLycheeSession():
+    """ The `aiohttp` counterpart of `LycheeSession`, the csrf and auth headers are handled the same way.
+    `download` returns the streamed `aiohttp` response, use it with `async with`
+    """
+    def __init__(self, base_url:str, pool_size:int=100):
+        """
+            :param base_url: [required] Lychee address
+            :param pool_size: Maximum number of open connections
+        """
+        self._base_url = base_url
+        self._api_version = API_VERSION
+        self._header = API_HEADER.copy()
+        self._pool_size = pool_size
+        self._session = None
+
+    async def open(self):
+        """ Create the connection pool and get the csrf cookie, called by the first request
+        """
+        if self._session is not None:
+            return
+        # unsafe: also keep cookies of servers addressed by ip, eg. 127.0.0.1
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self._pool_size),
+                                              cookie_jar=aiohttp.CookieJar(unsafe=True))
+        async with self._session.get(self._base_url) as r:
+            await r.read()
+        self._set_csrf_header()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _set_csrf_header(self):
+        csrf_token = self._session.cookie_jar.filter_cookies(self._base_url).get("XSRF-TOKEN")
+        if csrf_token is not None:
+            self._header["X-XSRF-TOKEN"] = csrf_header(csrf_token.value)
+
+    async def request(self, method:str, url:str, headers:dict=None, delete_headers:list=None, **kwargs):
+        """ Send an api request, the body is read before returning
+            :return: `AsyncResponse`
+        """
+        await self.open()
+        self._set_csrf_header()
+        async with self._session.request(method, self._base_url + self._api_version + url,
+                                         headers=api_headers(self._header, headers, delete_headers), **kwargs) as r:
+            return AsyncResponse(r.status, r.headers, await r.read())
+
+    async def download(self, url:str, headers:dict=None, **kwargs):
+        """ GET an absolute url such as a photo file. The auth header is only sent to urls of the Lychee server
+            :return: `aiohttp.ClientResponse`, not read yet, it must be released
+        """
+        await self.open()
+        self._set_csrf_header()
+        return await self._session.get(url, headers={**download_headers(self._header, self._base_url, url), **(headers or {})}, **kwargs)
+
+class AsyncLycheeClient():
+    """ The `LycheeClient` api as coroutines. Instead of a thread pool, the number of transfers and album requests in flight
+    is limited by semaphores, `download_album`/`upload_album` return the results of all their transfers.
+    Albums are walked by `max_transfers` workers taking photos and sub albums from a queue
+    """
+    def __init__(self, base_url:str, verbose:bool=False, max_transfers:int=64, max_requests:int=16, album_index_ttl:float=60,
+                 chunk_size:int=1024*1024*25, retries:int=3, retry_backoff:float=1, upload_journal:str=None,
+                 download_buffer_size:int=1024*256, strip_metadata:bool=False):
+        """
+            :param base_url: Lychee API address 如 `http://127.0.0.1:5000/`
+            :param max_transfers: Maximum number of uploads/downloads in flight
+            :param max_requests: Maximum number of other api requests in flight, eg. `get_album`
+            :param album_index_ttl: Seconds the cached album tree stays valid, `0` means always fetch `fullTree` again
+            :param chunk_size: Upload chunk size in bytes, default is 25M
+            :param retries: How many times a failed request (connection error or 5xx) is sent again
+            :param retry_backoff: Seconds to wait before the first retry, doubled after each retry
+            :param upload_journal: Json file recording unfinished uploads, so they can be resumed. Disabled by default
+            :param download_buffer_size: Bytes read from the response at a time when downloading, default is 256K
+            :param strip_metadata: Remove the title and description of the photos while uploading them, see `LycheeClient.upload_photo`. Needs pyexiv2
+        """
+        self._sess = AsyncLycheeSession(base_url, max_transfers + max_requests)
+        self._verbose = verbose
+        self._max_transfers = max_transfers
+        self._transfer_limit = asyncio.Semaphore(max_transfers)
+        self._request_limit = asyncio.Semaphore(max_requests)
+
+        self._album_index = None
+        self._album_index_time = None
+        self._album_index_ttl = album_index_ttl
+        self._album_index_lock = asyncio.Lock()
+
+        self._chunk_size = chunk_size
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._upload_journal = UploadJournal(upload_journal) if upload_journal else None
+        self._download_buffer_size = download_buffer_size
+        self._strip_metadata = strip_metadata
+        self._process_pool = None
+        if strip_metadata:
+            import_rm_title_des()
+
+    async def __aenter__(self):
+        await self._sess.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._sess.close()
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+
+    async def _api(self, method:str, url:str, **kwargs):
+        async with self._request_limit:
+            return await self._sess.request(method, url, **kwargs)
+
+    async def _json(self, method:str, url:str, **kwargs):
+        r = await self._api(method, url, **kwargs)
+        return r.json() if len(r.content) else {}
+
+    async def _request_with_retry(self, method:str, url:str, data_factory=None, **kwargs):
+        """ see `LycheeClient._request_with_retry`
+            :param data_factory: called for the `data` of every attempt, an `aiohttp.FormData` can only be sent once
+        """
+        for attempt in range(self._retries + 1):
+            try:
+                if data_factory is not None:
+                    kwargs["data"] = data_factory()
+                r = await self._sess.request(method, url, **kwargs)
+                if r.status_code < 500 or attempt == self._retries:
+                    return r
+            except aiohttp.ClientError as e:
+                if attempt == self._retries:
+                    raise e
+            await asyncio.sleep(self._retry_backoff * 2 ** attempt)
+
+    def invalidate_album_index(self):
+        """ Drop the cached album tree, the next path lookup fetches `fullTree` again
+        """
+        self._album_index = None
+        self._album_index_time = None
+
+    async def _load_album_index(self):
+        """ see `LycheeClient._load_album_index`, must be called with `_album_index_lock` held
+        """
+        if self._album_index_time is not None and time.monotonic() - self._album_index_time < self._album_index_ttl:
+            return self._album_index
+
+        tree_data = await self.get_full_tree()
+        if isinstance(tree_data, dict):
+            if tree_data.get('message') != "Insufficient privileges":
+                raise RuntimeError(f"{str(tree_data)}")
+            self._album_index = None
+        else:
+            self._album_index = AlbumIndex(tree_data)
+        self._album_index_time = time.monotonic()
+        return self._album_index
+
+    def _update_album_index(self, update):
+        if self._album_index is not None:
+            update(self._album_index)
+
+    async def login_by_passwd(self, username:str, password:str):
+        """ see `LycheeClient.login_by_passwd`
+        :return: `tuple`: (res:bool, reason:dict)
+        """
+        r = await self._api("POST", "Auth::login", json={
+            "username": username,
+            "password": password
+        })
+        if r.status_code == 204:
+            return True, {}
+        return False, r.json()
+
+    async def login_by_token(self, token:str):
+        """ see `LycheeClient.login_by_token`
+        """
+        self._sess._header["Authorization"] = token
+        return True
+
+    async def get_all_user(self):
+        return await self._json("GET", "UserManagement")
+
+    async def get_album(self, album:str):
+        """ :return: `dict`, see `./api_demo/get_album.json`
+        """
+        album_id = await self.album_path2id_assert(album)
+        return await self._json("GET", "Album", json={"album_id": album_id})
+
+    async def get_albums(self):
+        """ :return: `dict`, see `./api_demo/get_albums.json`
+        """
+        return await self._json("GET", "Albums")
+
+    async def create_album(self, parent_album:str, album_name:str):
+        """ :return: `str`, album_id
+        """
+        album_id = await self.album_path2id_assert(parent_album)
+        r = await self._api("POST", "Album", json={
+            "parent_id": album_id,
+            "title": album_name
+        })
+        if r.ok:
+            self._update_album_index(lambda index: index.add(r.text, album_name, album_id))
+        return r.text
+
+    async def delete_albums(self, albums:list):
+        """ :return: `int`, is http status code
+        """
+        id_list = []
+        for album in albums:
+            album_id = await self.album_path2id_assert(album)
+            if album_id is None:
+                continue
+            id_list.append(album_id)
+
+        r = await self._api("DELETE", "Album", json={"album_ids": id_list})
+        if r.ok:
+            def update(index):
+                for album_id in id_list:
+                    index.remove(album_id)
+            self._update_album_index(update)
+        return r.status_code
+
+    async def search(self, album:str, terms:str):
+        album_id = await self.album_path2id_assert(album)
+        terms = base64.b64encode(terms.encode(encoding="utf-8"))
+        return await self._json("GET", "Search", json={
+            "terms": terms.decode(),
+            "album_id": album_id
+        })
+
+    async def get_target_list_albums(self, album_ids:list=[]):
+        data = {}
+        if len(album_ids) > 0:
+            data["album_ids"] = album_ids
+        return await self._json("GET", "Album::getTargetListAlbums", json=data)
+
+    async def move_album(self, target_album:str, albums=[]):
+        target_album_id = await self.album_path2id_assert(target_album)
+        album_ids = [await self.album_path2id_assert(album) for album in albums]
+        r = await self._api("POST", "Album::move", json={
+            "album_id": target_album_id,
+            "album_ids": album_ids
+        })
+        if r.ok:
+            def update(index):
+                for album_id in album_ids:
+                    index.move(album_id, target_album_id)
+            self._update_album_index(update)
+        return r.json() if len(r.content) else {}
+
+    async def move_photo(self, target_album:str, photo_ids=[]):
+        target_album_id = await self.album_path2id_assert(target_album)
+        return await self._json("POST", "Photo::move", json={"album_id": target_album_id, "photo_ids": photo_ids})
+
+    async def copy_photo(self, target_album:str, photo_ids=[]):
+        target_album_id = await self.album_path2id_assert(target_album)
+        return await self._json("POST", "Photo::copy", json={"album_id": target_album_id, "photo_ids": photo_ids})
+
+    async def star_photo(self, photo_ids:list, is_star:bool):
+        return await self._json("POST", "Photo::star", json={"is_starred": is_star, "photo_ids": photo_ids})
+
+    async def rename_photo(self, photo_id:str, title:str):
+        return await self._json("PATCH", "Photo::rename", json={"photo_id": photo_id, "title": title})
+
+    async def delete_photo(self, photo_ids=[]):
+        return await self._json("DELETE", "Photo", json={"photo_ids": photo_ids})
+
+    async def get_full_tree(self):
+        """ :return: `dict`, see `./api_demo/get_full_tree.json`
+        """
+        return await self._json("GET", "Maintenance::fullTree")
+
+    async def upload_photo(self, album, upload_filename, chunk_size:int=None, strip_metadata:bool=None):
+        """ see `LycheeClient.upload_photo`. Each chunk is read in a thread, one chunk in flight per upload.
+        With `strip_metadata` the photo is stripped in a process pool and sent from memory
+            :return: `dict`, eg. {'file_name': '4.jpg', 'extension': '.jpg', 'uuid_name': 'gAA7GDjP-ru1FRsm.jpg', 'stage': 'uploading', 'chunk_number': 1, 'total_chunks': 7}
+        """
+        album_id = await self.album_path2id_assert(album)
+        if album_id == None:
+            album_id = "unsorted"
+        if chunk_size is None:
+            chunk_size = self._chunk_size
+
+        file_name = os.path.basename(upload_filename)
+        file_stat = await asyncio.to_thread(os.stat, upload_filename)
+        content = None
+        if self._strip_metadata if strip_metadata is None else strip_metadata:
+            if self._process_pool is None:
+                self._process_pool = new_process_pool()
+            try:
+                content = await asyncio.get_running_loop().run_in_executor(self._process_pool, import_rm_title_des().read_without_title, upload_filename)
+            except Exception as e:
+                return {"message": f"Error upload {e}", "upload_filename": f"{upload_filename}", "album": f"{album}", "raw": ""}
+        file_size = file_stat.st_size if content is None else len(content)
+        chunk_count = max(1, math.ceil(file_size / chunk_size))
+
+        uuid_name = ''
+        extension = ''
+        start_chunk = 0
+        journal = self._upload_journal
+        if journal is not None:
+            entry = journal.get(upload_filename)
+            if entry and (entry["album_id"], entry["size"], entry["mtime"], entry["chunk_size"]) == (album_id, file_size, file_stat.st_mtime, chunk_size):
+                uuid_name = entry["uuid_name"]
+                extension = entry["extension"]
+                start_chunk = entry["chunk"]
+
+        r = None
+        res = None
+        async with self._transfer_limit:
+            try:
+                for i in range(start_chunk, chunk_count):
+                    if content is not None:
+                        chunk_data = content[i*chunk_size:(i+1)*chunk_size]
+                    else:
+                        chunk_data = await asyncio.to_thread(_read_chunk, upload_filename, i*chunk_size, chunk_size)
+
+                    def chunk_form():
+                        form = aiohttp.FormData()
+                        form.add_field('album_id', album_id)
+                        form.add_field('file', chunk_data, filename='chunk', content_type='application/octet-stream')
+                        form.add_field('file_name', file_name)
+                        form.add_field('uuid_name', uuid_name)
+                        form.add_field('extension', extension)
+                        form.add_field('chunk_number', f'{i+1}')
+                        form.add_field('total_chunks', f'{chunk_count}')
+                        return form
+                    # aiohttp sets the multipart content type with the boundary
+                    r = await self._request_with_retry("POST", "Photo", chunk_form, delete_headers=["Content-Type"])
+                    if r.status_code >= 500:
+                        raise RuntimeError(f"chunk {i+1}/{chunk_count} failed with status {r.status_code}")
+                    res = r.json()
+                    uuid_name = res['uuid_name']
+                    extension = res['extension']
+                    if journal is not None and i+1 < chunk_count:
+                        await asyncio.to_thread(journal.update, upload_filename, {"album_id": album_id, "uuid_name": uuid_name, "extension": extension, "chunk": i+1,
+                                                                                  "size": file_size, "mtime": file_stat.st_mtime, "chunk_size": chunk_size})
+            except KeyError as e:
+                if journal is not None:
+                    await asyncio.to_thread(journal.remove, upload_filename)
+                return {"message": f"upload_filename: {upload_filename}, album: {album}", "raw": res}
+            except Exception as e:
+                return {"message": f"Error upload {e}", "upload_filename": f"{upload_filename}", "album": f"{album}", "raw": r.text if r is not None else ""}
+        if journal is not None:
+            await asyncio.to_thread(journal.remove, upload_filename)
+        return res
+
+    async def _is_downloaded(self, file_name:str, checksum:str=None, filesize=None):
+        """ see `LycheeClient._is_downloaded`, the file is checked in a thread
+        """
+        return await asyncio.to_thread(_is_downloaded, file_name, checksum, filesize)
+
+    async def download_photo(self, url, save_full_name:str, checksum:str=None, filesize=None, variant="original"):
+        """ see `LycheeClient.download_photo`
+            :return: `dict`, eg. {'url': ..., 'file_name': ..., 'skipped': False}
+        """
+        if isinstance(url, dict):
+            variant, size_variant = select_size_variant(url, variant)
+            checksum = url["checksum"] if variant == "original" else None
+            url, filesize = size_variant["url"], size_variant["filesize"]
+
+        save_ext = save_full_name.split('.')[-1]
+        url_ext = url.split('.')[-1]
+        if save_ext != url_ext:
+            save_full_name = f"{save_full_name}.{url_ext}"
+
+        async with self._transfer_limit:
+            try:
+                if await self._is_downloaded(save_full_name, checksum, filesize):
+                    return {"url":f"{url}", "file_name":f"{save_full_name}", "skipped": True}
+
+                part_name = f"{save_full_name}.part"
+                offset = await asyncio.to_thread(_file_size, part_name)
+                headers = {"Range": f"bytes={offset}-"} if offset else {}
+                r = await self._sess.download(url, headers=headers)
+                if r.status == 416 and not await self._is_downloaded(part_name, checksum, filesize):
+                    r.release()     # the part file is not the photo, start again
+                    r = await self._sess.download(url)
+                async with r:
+                    if r.status != 416:    # 416: the part file is already complete
+                        r.raise_for_status()
+                        f = await asyncio.to_thread(open, part_name, "ab" if r.status == 206 else "wb")
+                        try:
+                            async for item in r.content.iter_chunked(self._download_buffer_size):
+                                await asyncio.to_thread(f.write, item)
+                        finally:
+                            await asyncio.to_thread(f.close)
+                await asyncio.to_thread(os.replace, part_name, save_full_name)
+                return {"url":f"{url}", "file_name":f"{save_full_name}", "skipped": False}
+            except Exception as e:
+                return {"message":f"Error download {e}", "url":f"{url}", "file_name":f"{save_full_name}"}
+
+    async def _walk(self, job):
+        """ Run `job` and the jobs it schedules on `max_transfers` workers, only the jobs being run are coroutines,
+        so a large tree does not hold a coroutine per photo
+            :param job: [required] called with `schedule`, returns a coroutine of a `list` of results. `schedule(job)` queues another job
+            :return: `list`, results of all the jobs. **:raise Exception:** the first error a job raised, after the others are done
+        """
+        queue = asyncio.Queue()
+        results = []
+        errors = []
+
+        async def worker():
+            while True:
+                job = await queue.get()
+                try:
+                    results.extend(await job(queue.put_nowait))
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    queue.task_done()
+
+        queue.put_nowait(job)
+        workers = [asyncio.create_task(worker()) for _ in range(self._max_transfers)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        if errors:
+            raise errors[0]
+        return results
+
+    def _photo_job(self, coro_func):
+        """ A job of `_walk` awaiting `coro_func()`, `None` is left out of the results
+        """
+        async def job(schedule):
+            result = await coro_func()
+            return [] if result is None else [result]
+        return job
+
+    def _album_job(self, coro_func, album, path):
+        """ A job of `_walk` awaiting `coro_func(schedule)`, an error is reported as {'message': ..., 'album': ...}
+        """
+        async def job(schedule):
+            try:
+                return await coro_func(schedule)
+            except Exception as e:
+                return [{"message": f"Error album {e}", "album": f"{album}", "file_name": f"{path}"}]
+        return job
+
+    async def download_album(self, album:str, save_path="./", variant="original"):
+        """ Recursively download an album, sub albums are walked concurrently
+            :param album: [required] album_id/album_path
+            :param save_path: [required] target path
+            :param variant: size variant to download, see `select_size_variant`
+            :return: `list`, results of `download_photo`, a failed sub album is reported as {'message': ..., 'album': ...}
+        """
+        album_id = await self.album_path2id_assert(album)
+        return await self._walk(partial(self._download_album, album_id, save_path, variant))
+
+    async def _download_album(self, album_id:str, save_path:str, variant, schedule):
+        await asyncio.to_thread(os.makedirs, save_path, exist_ok=True)
+        album_info = await self.get_album(album_id)
+        names = NameRegistry(await asyncio.to_thread(is_case_insensitive, save_path))
+        for sub_album in album_info["resource"].get("albums", []):
+            album_title = names.claim(sub_album["title"], sub_album["id"], keep_extension=False)
+            schedule(self._album_job(partial(self._download_album, sub_album["id"], os.path.join(save_path, album_title), variant),
+                                     sub_album["id"], save_path))
+
+        for photo in album_info["resource"]["photos"]:
+            file_name = names.claim(photo["title"], photo["id"])
+            schedule(self._photo_job(partial(self.download_photo, photo, os.path.join(save_path, file_name), variant=variant)))
+        return []
+
+    async def upload_album(self, album:str, path:str, skip_exist_photo=False, skip_same_checksum=False):
+        """ Upload a folder to the album, sub directories are walked concurrently
+            :param album: album
+            :param path: [required] directory to upload
+            :param skip_exist_photo: skip photos with the same title, default is False
+            :param skip_same_checksum: skip files whose SHA-1 matches a photo in the album, default is False
+            :return: `list`, results of `upload_photo`, a failed sub album is reported as {'message': ..., 'album': ...}
+        """
+        return await self._walk(partial(self._upload_album, album, path, skip_exist_photo, skip_same_checksum))
+
+    async def _upload_album(self, album, path:str, skip_exist_photo:bool, skip_same_checksum:bool, schedule):
+        album_ref = await self.resolve(album)
+        res = await self.get_album(album_ref)
+        if self._verbose:
+            print (f"album_id: {album_ref.id}, album: {album}")
+            print (res)
+        if not res["config"]["is_accessible"]:
+            raise RuntimeError(f"{album_ref.id} Not accessible")
+        title_id_map = {}
+        for sub_album in res["resource"]["albums"]:
+            title_id_map.setdefault(sub_album["title"], sub_album["id"])
+
+        photo_titles = {photo["title"] for photo in res["resource"]["photos"]} if skip_exist_photo else set()
+        photo_checksums = set()
+        if skip_same_checksum:
+            for photo in res["resource"]["photos"]:
+                photo_checksums.add(photo["checksum"])
+                photo_checksums.add(photo.get("original_checksum"))
+            photo_checksums.discard(None)
+
+        for entry_path, entry_name, is_dir in await asyncio.to_thread(_scan_dir, path):
+            if is_dir:
+                schedule(self._album_job(partial(self._upload_sub_album, album_ref, entry_path, title_id_map.get(entry_name), skip_exist_photo, skip_same_checksum),
+                                         entry_name, entry_path))
+            elif entry_name not in photo_titles:
+                schedule(self._photo_job(partial(self._upload_new_photo, album_ref, entry_path, photo_checksums)))
+        return []
+
+    async def _upload_sub_album(self, parent_album:AlbumRef, path:str, album_id:str, skip_exist_photo:bool, skip_same_checksum:bool, schedule):
+        if not album_id:
+            album_id = await self.create_album(parent_album, os.path.basename(path))
+        return await self._upload_album(album_id, path, skip_exist_photo, skip_same_checksum, schedule)
+
+    async def _upload_new_photo(self, album_ref:AlbumRef, file_name:str, photo_checksums:set):
+        if len(photo_checksums) > 0 and await asyncio.to_thread(file_sha1, file_name) in photo_checksums:
+            return None
+        return await self.upload_photo(album_ref, file_name)
+
+    async def album_path2id(self, album_path:str):
+        """ see `LycheeClient.album_path2id`
+            :return: Returns a `list` containing all matching `album_id`
+        """
+        if isinstance(album_path, AlbumRef):
+            return [album_path.id]
+
+        if album_path in ["/", None, ""]:
+            return [None]
+
+        if album_path[0] != "/":
+            return [album_path]
+
+        path_titles = album_path.strip('/').split('/')
+
+        async with self._album_index_lock:
+            index = await self._load_album_index()
+            if index is not None:
+                return index.find(path_titles)
+
+        async def find_id(album_id, path_titles_part):
+            if len(path_titles_part) == 0:
+                return [album_id]
+            for sub_album in (await self.get_album(album_id))["resource"]["albums"]:
+                if sub_album['title'] == path_titles_part[0]:
+                    return await find_id(sub_album['id'], path_titles_part[1:])
+            return []
+
+        res_list = []
+        for sub_album in (await self.get_albums())["albums"]:
+            if sub_album['title'] == path_titles[0]:
+                res_list += await find_id(sub_album['id'], path_titles[1:])
+        return res_list
+
+    async def album_path2id_assert(self, title_path:str):
+        """ see `LycheeClient.album_path2id_assert`
+        """
+        res = await self.album_path2id(title_path)
+        if len(res) != 1:
+            raise RuntimeError(f"{title_path} There are multiple matching results or no matching results {str(res)}If multiple matches are allowed, use album_path2id")
+        return res[0]
+
+    async def resolve(self, album):
+        """ see `LycheeClient.resolve`
+            :return: `AlbumRef`
+        """
+        if isinstance(album, AlbumRef):
+            return album
+        return AlbumRef(await self.album_path2id_assert(album), album)
+
+    async def album_id2path(self, album_id):
+        """ see `LycheeClient.album_id2path`
+        """
+        if isinstance(album_id, AlbumRef):
+            if album_id.id is None:
+                return "/"
+            album_id = album_id.id
+        if album_id[0] == '/':
+            return album_id
+
+        async with self._album_index_lock:
+            index = await self._load_album_index()
+            if index is not None:
+                return index.path(album_id)
+
+        path = []
+        while True:
+            album_info = await self.get_album(album_id)
+            path.insert(0, album_info["resource"]["title"])
+            if album_info["resource"]["parent_id"] == None:
+                break
+            album_id = album_info["resource"]["parent_id"]
+        return "/"+"/".join(path)
@@ -1,21 +1,120 @@
-from pychee6 import LycheeClient
-from termcolor import colored
 from pathlib import Path
-from concurrent.futures import as_completed
-from context_menu import menus
-from tqdm import tqdm
 import argparse
+import atexit
+import contextlib
+import threading
+import traceback
+import tempfile
+import getpass
+import stat
+import shlex
 import os
+import io
 import sys
 import json
 import gettext
 import locale
 
+# pychee6 (requests) and termcolor/tqdm/context_menu are imported when they are used, the cli is often run from scripts
+def colored(*args, **kwargs):
+    from termcolor import colored
+    return colored(*args, **kwargs)
+
+# login options of the command line, the daemon keeps the login it was started with
+LOGIN_OPTIONS = ["-t", "--token", "-u", "--user", "-p", "--passwd", "-H", "--host"]
+
+def daemon_dir():
+    """ Directory of the socket and key of `serve`: XDG_RUNTIME_DIR, or a directory only the user can enter in the temp directory.
+    The temp directory of Windows is private already
+        :return: `str`, **:raise RuntimeError:** if the directory in the temp directory belongs to someone else or others can enter it
+    """
+    if sys.platform == "win32":
+        return tempfile.gettempdir()
+    if os.getenv("XDG_RUNTIME_DIR"):
+        return os.getenv("XDG_RUNTIME_DIR")
+    path = os.path.join(tempfile.gettempdir(), f"pychee6-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) & 0o077:
+        raise RuntimeError(f"{path} is not a private directory of the user")
+    return path
+
+def daemon_address():
+    """ Where `serve` listens: a unix socket in `daemon_dir()`, a named pipe on Windows
+    """
+    if sys.platform == "win32":
+        return rf"\\.\pipe\pychee6-{getpass.getuser()}"
+    return os.path.join(daemon_dir(), f"pychee6-{getpass.getuser()}.sock")
+
+def daemon_key_file():
+    """ Secret written by `serve`, only the user running it can read it and connect
+    """
+    return os.path.join(daemon_dir(), f"pychee6-{getpass.getuser()}.key")
+
+def check_private(st:os.stat_result, name:str, is_type=stat.S_ISREG):
+    """ The key file and the socket must be of the user and only readable by them (mode 0600), nothing is checked on Windows
+        :param st: [required] `os.fstat`/`os.lstat` of the file
+        **:raise RuntimeError:** if they are not
+    """
+    if sys.platform == "win32":
+        return
+    if not is_type(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) != 0o600:
+        raise RuntimeError(f"{name} must be owned by the user with mode 0600")
+
+def read_daemon_key():
+    """ :return: `bytes`, the key written by `serve`. **:raise OSError:** if there is none, **:raise RuntimeError:** if it is not private
+    """
+    key_file = daemon_key_file()
+    fd = os.open(key_file, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    with os.fdopen(fd, "rb") as f:
+        check_private(os.fstat(f.fileno()), key_file)
+        return f.read()
+
+def write_daemon_key(key:bytes):
+    """ Replace the key file, it is created anew so a file or link left by someone else is never written through
+    """
+    key_file = daemon_key_file()
+    try:
+        os.unlink(key_file)
+    except FileNotFoundError:
+        pass
+    fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    with os.fdopen(fd, "wb") as f:
+        if sys.platform != "win32":
+            os.fchmod(f.fileno(), 0o600)    # the umask may have removed bits
+        check_private(os.fstat(f.fileno()), key_file)
+        f.write(key)
+
+def daemon_request(argv:list):
+    """ Run a command in the daemon started by `serve`
+        :return: `str`, output of the command, `None` if no daemon is running. **:raise RuntimeError:** if the key file or the socket is not private
+    """
+    from multiprocessing.connection import Client
+    from multiprocessing import AuthenticationError
+    try:
+        key = read_daemon_key()
+        address = daemon_address()
+        if sys.platform != "win32":
+            check_private(os.lstat(address), address, stat.S_ISSOCK)
+        conn = Client(address, authkey=key)
+    except (OSError, AuthenticationError):
+        return None
+    with conn:
+        conn.send((argv, os.getcwd()))
+        return conn.recv()
+
 # 这个类用来封装一些常用操作
 class lychee_cli:
-    def __init__(self, host:str, verbose:bool, max_thread):
-        self.client = LycheeClient(host, verbose, max_thread)
+    def __init__(self, host:str, verbose:bool, max_thread, **client_options):
+        from pychee6 import LycheeClient
+        self.client = LycheeClient(host, verbose, max_thread, **client_options)
         self.verbose = verbose
+        # in `batch`, consecutive u_p commands share the worker pool and are waited for together
+        self.background_uploads = False
+        self._uploads_pending = False
 
     def login(self, token:str=None, username:str=None, password:str=None):
         ret = True
@@ -45,43 +144,39 @@ class lychee_cli:
                 print (colored(f"+ {album["title"]}\t{album["id"]}\t{album["created_at"]}", "blue"))
 
             if not only_album:
-                res = self.client.get_album("unsorted")
-                for photo in res["resource"]["photos"]:
+                for photo in self.client.iter_photos("/", recursive=False):
                     print (colored(f"  {photo["title"]}\t{photo["id"]}\t{photo["created_at"]}", "green"))
         else:
-            res = self.client.get_album(album_id)
-            if "message" in res.keys():
-                print (res)
-                return 
-            id = res["resource"]["id"]
-            # title = res["resource"]["title"]
-            cur_path = self.client.album_id2path(album_id)
-            print (f"--------- {colored(cur_path, "cyan")} [{id}]")
-            for album in res["resource"]["albums"]:
-                print (colored(f"+ {album["title"]}\t{album["id"]}\t{album["created_at"]}", "blue"))
-            
-            if not only_album:
-                for photo in res["resource"]["photos"]:
-                    print (colored(f"  {photo["title"]}\t{photo["id"]}\t{photo["created_at"]}", "green"))
+            # photos are printed while the album is read, a large album is not loaded at once
+            try:
+                id = self.client.album_path2id_assert(album_id)
+                cur_path = self.client.album_id2path(id)
+                print (f"--------- {colored(cur_path, "cyan")} [{id}]")
+                for key, item in self.client.iter_album(id):
+                    if key == "albums":
+                        print (colored(f"+ {item["title"]}\t{item["id"]}\t{item["created_at"]}", "blue"))
+                    elif only_album:
+                        break
+                    else:
+                        print (colored(f"  {item["title"]}\t{item["id"]}\t{item["created_at"]}", "green"))
+            except RuntimeError as e:
+                print (e)
     
     def wait_task(self):
+        from tqdm import tqdm
         try:
-            futures = self.client.threadpool_get_futures()
-            with tqdm(total=len(futures)) as pbar:
-                for i, future in enumerate(as_completed(futures)):
-                    result = future.result()
+            # results are shown while the albums are still walked, the total is unknown
+            with tqdm() as pbar:
+                for result in self.client.iter_results():
                     if result.get("message", None) != None:
                         print(f"{colored(str(result), "red")}")
                     pbar.update(1)
         except KeyboardInterrupt:
-            futures = self.client.threadpool_get_futures()
-            for future in futures:
-                if not future.running():
-                    future.cancel()
+            self.client.cancel_tasks()
         except Exception as e:
             raise e
 
-    def upload_album(self, album_id, files_path, skip_exist_photo=False):
+    def upload_album(self, album_id, files_path, skip_exist_photo=False, skip_same_checksum=False):
         # print (f"upload_album {album_id} {files_path} {skip_exist_photo}")
         files_path = os.path.abspath(files_path)
         if os.path.isdir(files_path):
@@ -102,7 +197,7 @@ class lychee_cli:
             if parent_album_id == "":
                 parent_album_id = self.client.create_album(album_id, base_name)
 
-            self.client.upload_album(parent_album_id, files_path, skip_exist_photo)
+            self.client.upload_album(parent_album_id, files_path, skip_exist_photo, skip_same_checksum)
             self.wait_task()
         else:
             print (_("'{path}' is not a valid directory or it does not exist").format(path=files_path))
@@ -110,24 +205,31 @@ class lychee_cli:
     
     def upload_photo(self, album:str, file_path:str):
         if os.path.isfile(file_path):
-            print (self.client.upload_photo(album, file_path))
+            if self.background_uploads:
+                self.client.upload_photos(album, [file_path])
+                self._uploads_pending = True
+            else:
+                print (self.client.upload_photo(album, file_path))
+
+    def wait_uploads(self):
+        if self._uploads_pending:
+            self._uploads_pending = False
+            self.wait_task()
     
-    def download_album(self, album:str, save_path:str):
+    def download_album(self, album:str, save_path:str, zip_batch_size:int=0, variant="original"):
+        from pychee6 import NameRegistry, format_filesize, is_case_insensitive
+        self.client.reset_download_stats()
         if album in ["/", ""]:
-            downloaded_title = []
             save_path = os.path.join(save_path,"lychee_root")
             os.makedirs(save_path, exist_ok=True)
+            names = NameRegistry(is_case_insensitive(save_path))
             res = self.client.get_albums()
             all_albums = res["albums"] + res["shared_albums"]
             for album in all_albums:
                 album_id = album["id"]
-                album_title = album["title"]
-                if album_title in downloaded_title:
-                    album_title += f".[{album_id}]"
-                else:
-                    downloaded_title.append(album_title)
-                self.client.download_album(album_id, os.path.join(save_path, album_title))
-            self.client.download_album("unsorted", save_path)
+                album_title = names.claim(album["title"], album_id, keep_extension=False)
+                self.client.download_album(album_id, os.path.join(save_path, album_title), zip_batch_size, variant)
+            self.client.download_album("unsorted", save_path, zip_batch_size, variant)
         else:
 
             if album[0] == "/":
@@ -136,10 +238,19 @@ class lychee_cli:
                 album_title = self.client.get_album(album)["resource"]["title"]
             save_path = os.path.join(save_path, album_title)
 
-            self.client.download_album(album, save_path)
+            self.client.download_album(album, save_path, zip_batch_size, variant)
         
         self.wait_task()
+        stats = self.client.get_download_stats()
+        if stats["original_bytes"] > 0:
+            print (f"{stats["photos"]} photos, {format_filesize(stats["bytes"])} of {format_filesize(stats["original_bytes"])} original, "
+                   f"saved {format_filesize(stats["saved_bytes"])} ({stats["saved_bytes"] * 100 / stats["original_bytes"]:.1f}%)")
     
+    def sync(self, album:str, path:str, state_file:str=None, mirror_deletes=False):
+        summary = self.client.sync(album, path, state_file, mirror_deletes)
+        self.wait_task()
+        print (summary)
+
     def create_album(self, album:str, album_name:str):
         return self.client.create_album(album, album_name)
 
@@ -161,12 +272,13 @@ class lychee_cli:
             self.unreg_context()
         except:
             pass
+        from context_menu import menus
         # python_path = sys.executable
         root = menus.ContextMenu(_('Upload to Lychee'), type='FILES')
         root.add_items([
                 menus.ContextCommand(_('✨Refresh (if album modified)'), command=f"? -m pychee6.cli reg_context", command_vars=["PYTHONLOC"]),
                 menus.ContextCommand(_('❌Unregister'), command=f"? -m pychee6.cli unreg_context", command_vars=["PYTHONLOC"]),
-                menus.ContextCommand(_('🔻Upload here'), command=f"? -m pychee6.cli u_p / ?", command_vars=["PYTHONLOC",'FILENAME']),
+                menus.ContextCommand(_('🔻Upload here'), command=f"? -m pychee6.cli -d u_p / ?", command_vars=["PYTHONLOC",'FILENAME']),
             ])
         
         def get_items(parent, album_id):
@@ -174,7 +286,7 @@ class lychee_cli:
             for album in res["resource"]["albums"]:
                 tmp = menus.ContextMenu(album["title"])
                 tmp.add_items([
-                    menus.ContextCommand(f'🔻Upload to here', command=f"? -m pychee6.cli u_p -- {album['id']} ?", command_vars=["PYTHONLOC",'FILENAME'])
+                    menus.ContextCommand(f'🔻Upload to here', command=f"? -m pychee6.cli -d u_p -- {album['id']} ?", command_vars=["PYTHONLOC",'FILENAME'])
                 ])
                 get_items(tmp, album["id"])
                 parent.add_items([tmp])
@@ -184,7 +296,7 @@ class lychee_cli:
         for album in res["albums"]:
             tmp = menus.ContextMenu(album["title"])
             tmp.add_items([
-                menus.ContextCommand(f'🔻Upload to here', command=f"? -m pychee6.cli u_p -- {album['id']} ?", command_vars=["PYTHONLOC",'FILENAME'])
+                menus.ContextCommand(f'🔻Upload to here', command=f"? -m pychee6.cli -d u_p -- {album['id']} ?", command_vars=["PYTHONLOC",'FILENAME'])
             ])
             get_items(tmp, album["id"])
             root.add_items([tmp])
@@ -202,6 +314,7 @@ class lychee_cli:
         root.compile()
     
     def unreg_context(self):
+        from context_menu import menus
         menus.removeMenu("Upload to Lychee", type='FILES')
 
 def main():
@@ -218,6 +331,34 @@ def main():
     except Exception as e:
         print(f"{e}\nUsing default language - English(en_US.UTF-8)")
 
+    # sent to the daemon before anything else is imported
+    daemon_arg = argparse.ArgumentParser(add_help=False)
+    daemon_arg.add_argument("-d", "--daemon", action='store_true')
+    for short, option in zip(LOGIN_OPTIONS[::2], LOGIN_OPTIONS[1::2]):
+        daemon_arg.add_argument(short, option, action='append')
+    daemon_args = daemon_arg.parse_known_args()[0]
+    if daemon_args.daemon:
+        if any(getattr(daemon_args, option.lstrip("-")) for option in LOGIN_OPTIONS[1::2]):
+            print (_("-t/-u/-p/-H can not be used with -d, the daemon uses the login it was started with"))
+            sys.exit(2)
+        try:
+            output = daemon_request(sys.argv[1:])
+        except RuntimeError as e:
+            print (colored(f"{e}", "red"))
+            sys.exit(1)
+        if output is not None:
+            print (output, end="")
+            return
+
+    def size_variants(value):
+        # only imported when --variant is given, -h and the other commands do not load pychee6 before they need it
+        from pychee6 import SIZE_VARIANTS
+        variants = [variant.strip() for variant in value.split(",")]
+        for variant in variants:
+            if variant not in SIZE_VARIANTS:
+                raise argparse.ArgumentTypeError(_("unknown size variant {variant}").format(variant=variant))
+        return variants[0] if len(variants) == 1 else variants
+
     parser = argparse.ArgumentParser(description=_(
         "This is the CLI version of LycheeClient, which can be used as an example of library usage.\n"
         "In most cases, you can use album_id or album path as parameters.\n"
@@ -231,7 +372,18 @@ def main():
     parser.add_argument("-p", "--passwd", help=_("Password. Can be provided via LYCHEE_PASSWORD environment variable"))
     parser.add_argument("-H", "--host", help=_("Server address, like: http://exp.com:8808/. Can be provided via LYCHEE_HOST environment variable"))
     parser.add_argument("-m", "--max_thread", default=5, help=_("Thread pool size affecting upload/download count, default is 5"))
+    parser.add_argument("-a", "--adaptive", action='store_true', help=_("Adjust the number of parallel uploads/downloads (at most --max_thread) "
+                                                                     "and album requests to the errors and latency of the server"))
     parser.add_argument("-v", "--verbose", action='store_true', help=_("Output debug information"))
+    parser.add_argument("-c", "--cache", action='store_true', help=_("Keep album information on disk (under XDG_CACHE_HOME) so repeated commands are fast, "
+                                                                  "it is refreshed after --cache_ttl seconds or when pychee6 changes something"))
+    parser.add_argument("--cache_ttl", type=float, default=300, help=_("Seconds the cached album information is used, default is 300"))
+    parser.add_argument("--strip_metadata", action='store_true', help=_("Remove the title and description of the photos while uploading them, "
+                                                                      "the files are not changed. Needs pyexiv2"))
+    parser.add_argument("--metrics", help=_("Write latency, status codes, bytes and retries of the requests to this file at exit, "
+                                            "prometheus text format if it ends with .prom, json otherwise"))
+    parser.add_argument("-d", "--daemon", action='store_true', help=_("Run the command in the daemon started by serve if it is running, "
+                                                                   "it keeps the login, album tree and connections between commands"))
 
     subargs = parser.add_subparsers(dest='command')
 
@@ -243,6 +395,14 @@ def main():
         help=_("Path to upload directory"))
     upload_album_arg.add_argument("--skip_exist_photo", action='store_true', 
         help=_("Based on title name skip existing photos"))
+    upload_album_arg.add_argument("--skip_same_checksum", action='store_true', 
+        help=_("Based on SHA-1 checksum skip existing photos, renamed files are skipped as well"))
+    upload_album_arg.add_argument("--checksum_cache", 
+        help=_("Cache file of local checksums, only new or modified files are hashed again"))
+    upload_album_arg.add_argument("--chunk_size", type=int, default=25, 
+        help=_("Upload chunk size in MB, default is 25"))
+    upload_album_arg.add_argument("--journal", 
+        help=_("Journal file of unfinished uploads, an interrupted upload continues from the last uploaded chunk"))
 
     upload_photo_arg = subargs.add_parser("upload_photo", aliases=["u_p"], 
         help=_("Upload photo to album, album_id as '/' then upload to unsorted"))
@@ -250,6 +410,10 @@ def main():
         help=_("Album id, can be '/' leading album path"))
     upload_photo_arg.add_argument("path", 
         help=_("Path to upload photo"))
+    upload_photo_arg.add_argument("--chunk_size", type=int, default=25, 
+        help=_("Upload chunk size in MB, default is 25"))
+    upload_photo_arg.add_argument("--journal", 
+        help=_("Journal file of unfinished uploads, an interrupted upload continues from the last uploaded chunk"))
 
     download_album_arg = subargs.add_parser("download_album", aliases=["d_a"], 
         help=_("Download album, album_id as '/' then download all"))
@@ -257,6 +421,26 @@ def main():
         help=_("Album id, can be '/' leading album path"))
     download_album_arg.add_argument("path", 
         help=_("Download target directory"))
+    download_album_arg.add_argument("--zip_batch_size", type=int, default=0, 
+        help=_("Download photos in batches of this size through the server side zip, faster for many small photos, default is 0 (disabled)"))
+    download_album_arg.add_argument("--variant", default="original", type=size_variants, 
+        help=_("Size variant to download: {variants}. A missing variant falls back to the next larger one, "
+               "a comma separated list like small,medium,original is tried in order. Default is original").format(variants="original/medium2x/medium/small2x/small/thumb2x/thumb"))
+    download_album_arg.add_argument("--checksum_cache", 
+        help=_("Cache file of local checksums, files already downloaded are not hashed again"))
+
+    sync_arg = subargs.add_parser("sync", 
+        help=_("Two-way sync between an album and a directory, only changes since the last run are transferred"))
+    sync_arg.add_argument("album_id", 
+        help=_("Album id, can be '/' leading album path"))
+    sync_arg.add_argument("path", 
+        help=_("Local directory"))
+    sync_arg.add_argument("--state", 
+        help=_("Sync state file, default is .pychee6_sync.db in the local directory"))
+    sync_arg.add_argument("--mirror_deletes", action='store_true', 
+        help=_("Delete remote photos deleted locally and local files deleted remotely"))
+    sync_arg.add_argument("--checksum_cache", 
+        help=_("Cache file of local checksums, only new or modified files are hashed again"))
 
     create_album_arg = subargs.add_parser("create_album", aliases=["c_a"], 
         help=_("Create album, album_id as '/' then create album in root"))
@@ -292,6 +476,19 @@ def main():
     unreg_context_arg = subargs.add_parser("unreg_context", 
         help=_("Unregister mouse context menu"))
 
+    batch_arg = subargs.add_parser("batch", 
+        help=_("Run commands read from stdin, one per line like: u_p /album \"a photo.jpg\". They share one login, album tree and worker pool, "
+               "consecutive u_p commands upload in parallel"))
+    serve_arg = subargs.add_parser("serve", 
+        help=_("Start a daemon on a local socket (named pipe on Windows), commands run with -d are sent to it"))
+    for arg in [batch_arg, serve_arg]:
+        arg.add_argument("--chunk_size", type=int, default=25, 
+            help=_("Upload chunk size in MB, default is 25"))
+        arg.add_argument("--journal", 
+            help=_("Journal file of unfinished uploads, an interrupted upload continues from the last uploaded chunk"))
+        arg.add_argument("--checksum_cache", 
+            help=_("Cache file of local checksums, only new or modified files are hashed again"))
+
     args = parser.parse_args()
     # print (args)
 
@@ -319,34 +516,167 @@ def main():
         parser.print_help()
         return 
     
-    cli = lychee_cli(lychee_host, args.verbose, int(args.max_thread))
+    client_options = {}
+    if args.cache:
+        client_options["metadata_cache"] = True
+        client_options["metadata_cache_ttl"] = args.cache_ttl
+    if getattr(args, "chunk_size", None):
+        client_options["chunk_size"] = args.chunk_size * 1024 * 1024
+    # absolute like --metrics, serve changes the working directory for every command
+    if getattr(args, "journal", None):
+        client_options["upload_journal"] = os.path.abspath(args.journal)
+    if getattr(args, "checksum_cache", None):
+        client_options["checksum_cache"] = os.path.abspath(args.checksum_cache)
+    if args.metrics:
+        client_options["metrics"] = True
+    if args.adaptive:
+        client_options["adaptive_concurrency"] = True
+    if args.strip_metadata:
+        client_options["strip_metadata"] = True
+
+    cli = lychee_cli(lychee_host, args.verbose, int(args.max_thread), **client_options)
+    if args.metrics:
+        metrics_file = os.path.abspath(args.metrics)    # serve changes the working directory
+
+        def write_metrics():
+            with open(metrics_file, "w", encoding="utf-8") as f:
+                f.write(cli.client.export_metrics("prometheus" if metrics_file.endswith(".prom") else "json"))
+        atexit.register(write_metrics)
     if not cli.login(lychee_token, lychee_username, lychee_password):
         return
 
-    if args.command in ["list", "ls"]:
-        cli.list_album(args.target)
-    elif args.command in ["list_album", "la"]:
-        cli.list_album(args.target, True)
-    elif args.command in ["upload_album", "u_a"]:
-        cli.upload_album(args.album_id, args.path, args.skip_exist_photo)
-    elif args.command in ["upload_photo", "u_p"]:
-        cli.upload_photo(args.album_id, args.path)
-    elif args.command in ["download_album", "d_a"]:
-        cli.download_album(args.album_id, args.path)
-    elif args.command in ["create_album", "c_a"]:
-        new_album_id = cli.create_album(args.album_id, args.album_name)
-        print (_("New album id: {id}").format(id=new_album_id))
-    elif args.command in ["delete_album", "del_a"]:
-        print (cli.delete_album(args.album_id))
-    elif args.command in ["conv", "c_v"]:
-        if args.album_id:
-            cli.conv_album_id(args.album_id)
-    elif args.command in ["reg_context"]:
-        cli.reg_context()
-    elif args.command in ["unreg_context"]:
-        cli.unreg_context()
+    def run_command(cli, args):
+        if args.command in ["list", "ls"]:
+            cli.list_album(args.target)
+        elif args.command in ["list_album", "la"]:
+            cli.list_album(args.target, True)
+        elif args.command in ["upload_album", "u_a"]:
+            cli.upload_album(args.album_id, args.path, args.skip_exist_photo, args.skip_same_checksum)
+        elif args.command in ["upload_photo", "u_p"]:
+            cli.upload_photo(args.album_id, args.path)
+        elif args.command in ["download_album", "d_a"]:
+            cli.download_album(args.album_id, args.path, args.zip_batch_size, args.variant)
+        elif args.command in ["sync"]:
+            cli.sync(args.album_id, args.path, args.state, args.mirror_deletes)
+        elif args.command in ["create_album", "c_a"]:
+            new_album_id = cli.create_album(args.album_id, args.album_name)
+            print (_("New album id: {id}").format(id=new_album_id))
+        elif args.command in ["delete_album", "del_a"]:
+            print (cli.delete_album(args.album_id))
+        elif args.command in ["conv", "c_v"]:
+            if args.album_id:
+                cli.conv_album_id(args.album_id)
+        elif args.command in ["reg_context"]:
+            cli.reg_context()
+        elif args.command in ["unreg_context"]:
+            cli.unreg_context()
+        else:
+            parser.print_help()
+
+    # options of the client set up when batch/serve starts, a command can not change them
+    startup_options = {"token": "-t", "user": "-u", "passwd": "-p", "host": "-H", "max_thread": "-m", "adaptive": "-a", "verbose": "-v",
+                       "cache": "-c", "cache_ttl": "--cache_ttl", "strip_metadata": "--strip_metadata", "metrics": "--metrics",
+                       "chunk_size": "--chunk_size", "journal": "--journal", "checksum_cache": "--checksum_cache"}
+
+    def parse_command(argv:list):
+        """ :return: `Namespace`, `None` if it is not valid, is batch/serve or has options of the client
+        """
+        try:
+            command_args = parser.parse_args(argv)
+        except SystemExit:  # the error or help is printed by argparse
+            return None
+        if command_args.command in ["batch", "serve"]:
+            print (_("{command} can not be nested").format(command=command_args.command))
+            return None
+        command_parser = subargs.choices.get(command_args.command)
+        given = []
+        for dest, option in startup_options.items():
+            default = parser.get_default(dest)
+            if default is None and command_parser is not None:
+                default = command_parser.get_default(dest)
+            if getattr(command_args, dest, None) != default:
+                given.append(option)
+        if len(given) > 0:
+            print (_("{options} can not be given to a command of batch or serve (-d), they are set when it starts").format(options="/".join(given)))
+            return None
+        return command_args
+
+    if args.command in ["batch"]:
+        cli.background_uploads = True
+        for line in sys.stdin:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            command_args = parse_command(shlex.split(line))
+            if command_args is None:
+                continue
+            if command_args.command not in ["upload_photo", "u_p"]:
+                cli.wait_uploads()
+            try:
+                run_command(cli, command_args)
+            except Exception as e:
+                print (colored(f"{line}: {e}", "red"))
+        cli.wait_uploads()
+    elif args.command in ["serve"]:
+        from multiprocessing.connection import Listener
+        from multiprocessing import AuthenticationError
+        try:
+            address = daemon_address()
+            if sys.platform != "win32" and os.path.lexists(address):
+                if daemon_request(["-h"]) is not None:
+                    print (_("The daemon is already running on {address}").format(address=address))
+                    return
+                os.remove(address)  # left by a daemon that was killed
+            key = os.urandom(32)
+            write_daemon_key(key)
+        except (OSError, RuntimeError) as e:
+            print (colored(f"{e}", "red"))
+            return
+        # commands share the results of the client and the working directory, they run one at a time
+        command_lock = threading.Lock()
+
+        def handle(conn):
+            with conn:
+                try:
+                    argv, cwd = conn.recv()
+                except (EOFError, OSError):
+                    return
+                output = io.StringIO()
+                with command_lock, contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                    try:
+                        os.chdir(cwd)
+                        command_args = parse_command(argv)
+                        if command_args is not None:
+                            run_command(cli, command_args)
+                    except Exception:
+                        traceback.print_exc()
+                try:
+                    conn.send(output.getvalue())
+                except OSError:
+                    pass
+
+        old_umask = os.umask(0o077) if sys.platform != "win32" else None   # nobody else can connect before the socket is checked
+        try:
+            listener = Listener(address, authkey=key)
+        finally:
+            if old_umask is not None:
+                os.umask(old_umask)
+        if sys.platform != "win32":
+            os.chmod(address, 0o600)
+            check_private(os.lstat(address), address, stat.S_ISSOCK)
+        with listener:
+            print (_("Listening on {address}, run commands with -d, Ctrl+C to stop").format(address=address))
+            try:
+                while True:
+                    try:
+                        conn = listener.accept()
+                    except (OSError, EOFError, AuthenticationError):
+                        continue
+                    threading.Thread(target=handle, args=(conn,), daemon=True).start()
+            except KeyboardInterrupt:
+                pass
     else:
-        parser.print_help()
+        run_command(cli, args)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,78 +1,1466 @@
 from requests import Session
+from requests.adapters import HTTPAdapter
 from urllib.parse import unquote
-from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError, wait, FIRST_COMPLETED
+from zipfile import BadZipFile
 import requests
+import multiprocessing
+import threading
+import queue
+import hashlib
+import sqlite3
+import sys
+import tempfile
 import base64
+import codecs
+import json
+import mmap
+import time
 import os
 import math
+import re
+import zlib
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+API_VERSION = "/api/v2/"
+API_HEADER = {"Accept": "application/json", "Content-Type": "application/json"}
+SYNC_STATE_NAME = ".pychee6_sync.db"
+# GET responses kept by `MetadataCache`, any request changing something (not a GET) except logging in/out invalidates them
+CACHED_ENDPOINTS = ["Albums", "Album", "Maintenance::fullTree", "Album::getTargetListAlbums"]
+_TASKS_DONE = object()
+ZIP_LOCAL_FILE_HEADER = b"PK\x03\x04"
+ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+ZIP_CENTRAL_DIRECTORY_HEADERS = [b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06", b"PK\x06\x07"]
+FILESIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+# from the largest to the smallest, a missing variant falls back to the next larger one
+SIZE_VARIANTS = ["original", "medium2x", "medium", "small2x", "small", "thumb2x", "thumb"]
+# `bytes` -> python objects, the first installed one is used by default
+JSON_BACKENDS = {name: loads for name, loads in [("orjson", orjson and orjson.loads), ("ujson", ujson and ujson.loads), ("json", json.loads)] if loads}
+
+def get_json_backend(backend=None):
+    """ :param backend: name in `JSON_BACKENDS`, or a callable decoding `bytes`. Default is the fastest installed one
+        :return: callable. **:raise ValueError:** unknown or not installed backend
+    """
+    if callable(backend):
+        return backend
+    if backend is None:
+        return next(iter(JSON_BACKENDS.values()))
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f"json backend {backend} is not installed, available: {list(JSON_BACKENDS)}")
+    return JSON_BACKENDS[backend]
+
+def parse_filesize(filesize):
+    """ Parse the formatted `filesize` of a size variant, eg. `352.75 KB`
+        :param filesize: [required] `str`, an `int` is returned as it is
+        :return: `tuple`, `(size, tolerance)` in bytes, the formatted value is rounded so the real size is within `size ± tolerance`. **:raise ValueError:** unknown format
+    """
+    if isinstance(filesize, int):
+        return filesize, 0
+    number, unit = filesize.replace(",", "").split()
+    if unit.upper() not in FILESIZE_UNITS:
+        raise ValueError(f"unknown filesize {filesize}")
+    unit_size = FILESIZE_UNITS[unit.upper()]
+    decimals = len(number.split(".")[1]) if "." in number else 0
+    return round(float(number) * unit_size), math.ceil(unit_size * 0.5 / 10**decimals)
+
+def format_filesize(size:int):
+    """ Format bytes like Lychee does, eg. `352.75 KB`
+    """
+    for unit, unit_size in reversed(FILESIZE_UNITS.items()):
+        if abs(size) >= unit_size or unit == "B":
+            return f"{size / unit_size:.2f} {unit}" if unit != "B" else f"{size} B"
+
+def csrf_header(csrf_cookie:str):
+    """ Value of the `X-XSRF-TOKEN` header built from the `XSRF-TOKEN` cookie Lychee sets
+    """
+    return unquote(csrf_cookie).replace('=', '')
+
+def api_headers(header:dict, headers:dict=None, delete_headers:list=None):
+    """ Headers of an api request, shared by `LycheeSession` and `AsyncLycheeSession`
+        :param header: [required] headers of the session, eg. auth and csrf
+        :param headers: extra headers of this request
+        :param delete_headers: names of headers not to be sent
+        :return: `dict`
+    """
+    headers = {**header, **(headers or {})}
+    for del_head in delete_headers or []:
+        headers.pop(del_head, None)
+    return headers
+
+def download_headers(header:dict, base_url:str, url:str):
+    """ Headers of a file download, the auth header is only sent to urls of the Lychee server
+        :return: `dict`
+    """
+    if not url.startswith(base_url):
+        return {}
+    return api_headers(header, delete_headers=["Accept", "Content-Type"])
+
+def select_size_variant(photo:dict, variant="original"):
+    """ Pick the size variant of a photo to download. A variant can be null, eg. `medium2x` of a small photo,
+    then the next larger variant is used, up to `original`
+        :param photo: [required] photo returned by `get_album`
+        :param variant: one of `SIZE_VARIANTS`, or a list of them tried in order
+        :return: `tuple`, `(variant_name, size_variant)`. **:raise KeyError:** none of the variants exists. **:raise ValueError:** unknown variant
+    """
+    if isinstance(variant, str):
+        if variant not in SIZE_VARIANTS:
+            raise ValueError(f"unknown size variant {variant}")
+        variant = SIZE_VARIANTS[SIZE_VARIANTS.index(variant)::-1]
+    for name in variant:
+        size_variant = photo["size_variants"].get(name)
+        if size_variant is not None:
+            return name, size_variant
+    raise KeyError(f"photo {photo["id"]} has none of the size variants {variant}")
+
+class _ZipStreamBuffer():
+    """ Read exact amounts from an iterator of data blocks, with push back """
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._data = b""
+
+    def fill(self, size:int):
+        """ Make sure at least `size` bytes are buffered, fewer only at the end of the stream
+            :return: `bytes`, the buffered data
+        """
+        while len(self._data) < size:
+            data = next(self._blocks, b"")
+            if not data:
+                break
+            self._data += data
+        return self._data
+
+    def read(self, size:int):
+        data = self.fill(size)
+        if len(data) < size:
+            raise BadZipFile("Unexpected end of zip stream")
+        self._data = data[size:]
+        return data[:size]
+
+    def read_some(self):
+        """ :return: `bytes`, buffered data or the next block of the stream, empty at the end of the stream
+        """
+        data = self._data if self._data else next(self._blocks, b"")
+        self._data = b""
+        return data
+
+    def unread(self, data:bytes):
+        self._data = data + self._data
+
+def iter_zip_stream(blocks, buffer_size:int=1024*256):
+    """ Read a zip archive from a stream (eg. `Response.iter_content`) without buffering the whole archive,
+    entries written with a data descriptor (unknown size) are supported for both deflated and stored data
+        :param blocks: [required] iterable of `bytes`, any block size
+        :param buffer_size: maximum bytes of compressed data handled at a time
+        :return: generator of `(name, chunks)`, `chunks` yields the uncompressed data of the entry, the unread part is skipped when the next entry is requested.
+        **:raise BadZipFile:** broken archive or CRC mismatch
+    """
+    buf = _ZipStreamBuffer(blocks)
+    while True:
+        signature = buf.fill(4)[:4]
+        if signature != ZIP_LOCAL_FILE_HEADER:
+            if signature in ZIP_CENTRAL_DIRECTORY_HEADERS or len(signature) == 0:
+                return
+            raise BadZipFile(f"Bad zip signature {signature!r}")
+        buf.read(4)
+        (_, flags, method, _, _, crc, compress_size, file_size,
+            name_len, extra_len) = struct.unpack("<HHHHHIIIHH", buf.read(26))
+        raw_name = buf.read(name_len)
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+        extra = buf.read(extra_len)
+
+        zip64 = False
+        while len(extra) >= 4:
+            field_id, field_len = struct.unpack("<HH", extra[:4])
+            if field_id == 0x0001:
+                zip64 = True
+                values = list(struct.unpack(f"<{field_len // 8}Q", extra[4:4 + field_len // 8 * 8]))
+                if file_size == 0xFFFFFFFF and values:
+                    file_size = values.pop(0)
+                if compress_size == 0xFFFFFFFF and values:
+                    compress_size = values.pop(0)
+            extra = extra[4 + field_len:]
+
+        if method not in [0, 8]:
+            raise BadZipFile(f"{name}: unsupported compression method {method}")
+        has_descriptor = bool(flags & 0x08)
+        chunks = _iter_zip_entry(buf, name, method, has_descriptor, zip64, crc, compress_size, buffer_size)
+        if name.endswith("/"):  # directory
+            for _ in chunks:
+                pass
+            continue
+        yield name, chunks
+        for _ in chunks:    # skip what the caller did not read
+            pass
+
+def _iter_zip_entry(buf, name, method, has_descriptor, zip64, crc, compress_size, buffer_size):
+    cur_crc = 0
+    size = 0
+    if not has_descriptor:
+        decompressor = zlib.decompressobj(-15) if method == 8 else None
+        remaining = compress_size
+        while remaining > 0:
+            data = buf.read(min(remaining, buffer_size))
+            remaining -= len(data)
+            if decompressor is not None:
+                data = decompressor.decompress(data)
+            cur_crc = zlib.crc32(data, cur_crc)
+            yield data
+        if decompressor is not None:
+            data = decompressor.flush()
+            cur_crc = zlib.crc32(data, cur_crc)
+            yield data
+    elif method == 8:
+        decompressor = zlib.decompressobj(-15)
+        while not decompressor.eof:
+            data = buf.read_some()
+            if not data:
+                raise BadZipFile(f"{name}: unexpected end of zip stream")
+            data = decompressor.decompress(data)
+            cur_crc = zlib.crc32(data, cur_crc)
+            yield data
+        buf.unread(decompressor.unused_data)
+        crc = _read_zip_descriptor(buf, zip64)[0]
+    else:
+        # stored with unknown size: the entry ends at a descriptor whose crc and size match the data before it
+        size_len = 8 if zip64 else 4
+        descriptor_len = 4 + 4 + size_len * 2
+        while True:
+            data = buf.fill(descriptor_len)
+            if len(data) < descriptor_len:
+                raise BadZipFile(f"{name}: unexpected end of zip stream")
+            index = data.find(ZIP_DATA_DESCRIPTOR)
+            if index != 0:
+                end = index if index > 0 else len(data) - 3
+                data = buf.read(end)
+                cur_crc = zlib.crc32(data, cur_crc)
+                size += len(data)
+                yield data
+                continue
+            desc_crc, desc_compress_size, desc_size = struct.unpack(f"<I{'QQ' if zip64 else 'II'}", data[4:descriptor_len])
+            if (desc_crc, desc_compress_size, desc_size) == (cur_crc, size, size):
+                buf.read(descriptor_len)
+                crc = desc_crc
+                break
+            data = buf.read(4)  # the signature is part of the data
+            cur_crc = zlib.crc32(data, cur_crc)
+            size += len(data)
+            yield data
+    if cur_crc != crc:
+        raise BadZipFile(f"{name}: CRC mismatch")
+
+def _read_zip_descriptor(buf, zip64):
+    if buf.fill(4)[:4] == ZIP_DATA_DESCRIPTOR:
+        buf.read(4)
+    return struct.unpack(f"<I{'QQ' if zip64 else 'II'}", buf.read(20 if zip64 else 12))
+
+def iter_json_arrays(chunks, keys:list):
+    """ Read the items of the arrays named `keys` from a JSON document streamed in blocks (eg. `Response.iter_content`),
+        only the current item is held in memory. The rest of the document is skipped
+        :param chunks: [required] iterable of `bytes`
+        :param keys: [required] array names, eg. ['albums', 'photos']
+        :return: generator of `(key, item)` in document order, **:raise ValueError:** broken document
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    pattern = re.compile('"(' + "|".join(re.escape(key) for key in keys) + r')"\s*:\s*\[')
+    chunks = iter(chunks)
+    buf, pos, key, eof = "", 0, None, False
+    while True:
+        if key is None:
+            match = pattern.search(buf, pos)
+            if match:
+                key, pos = match.group(1), match.end()
+                continue
+            # the tail may hold the beginning of a name
+            pos = max(pos, len(buf) - 256)
+        else:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                key, pos = None, pos + 1
+                continue
+            if pos < len(buf):
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # a number may go on in the next block
+                    if end < len(buf) or eof:
+                        yield key, item
+                        pos = end
+                        continue
+        if eof:
+            if key is not None:
+                raise ValueError(f"unexpected end of the {key} array")
+            return
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buf = buf[pos:] + text.decode(b"", final=True)
+        else:
+            buf = buf[pos:] + text.decode(chunk)
+        pos = 0
 
 class LycheeSession(Session):
-    def __init__(self, base_url):
+    def __init__(self, base_url, pool_size:int=10, cache=None):
+        """
+            :param base_url: [required] Lychee address
+            :param pool_size: Maximum number of kept-alive connections per host, should not be less than the number of threads using the session
+            :param cache: `MetadataCache` of the responses of `CACHED_ENDPOINTS`
+        """
         super().__init__()
+        adapter = HTTPAdapter(pool_maxsize=max(pool_size, 10))
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
         # api v2
         self._base_url = base_url
         self._is_login = False
-        self._api_version = "/api/v2/"
-        self._header = {"Accept": "application/json", "Content-Type": "application/json"}
+        self._api_version = API_VERSION
+        self._header = API_HEADER.copy()
+        self._cache = cache
+        self._cache_user = ""   # set by the login methods of `LycheeClient`, responses differ by user
+        self._opened = False
+        self._open_lock = threading.Lock()
+        self._hooks = []
+        self.limiter = None     # `AdaptiveLimiter` of the requests sent outside of upload/download tasks
+        self._transfer = threading.local()  # bytes and errors of the transfer task running in this thread
 
-        super().request('GET', self._base_url)
-        self._set_csrf_header()
+    def add_hook(self, hook):
+        """ Call `hook(event, record)` around every request, eg. `RequestMetrics`. Hooks run in the requesting thread and must be thread-safe
+        + 'start': {'method': 'GET', 'endpoint': 'Album'}, photo files have the endpoint 'download'
+        + 'end': the same record with 'status' (`None` if it raised), 'seconds' until the headers were received, 'bytes_sent',
+            'bytes_received' (`Content-Length` if streamed) and 'cached' (answered by `MetadataCache`)
+        + 'retry' and 'transfer' are sent by `LycheeClient`, see `_request_with_retry` and `_run_transfer`
+        """
+        self._hooks.append(hook)
+
+    def emit(self, event:str, record:dict):
+        for hook in self._hooks:
+            hook(event, record)
+
+    def _send(self, method, url, endpoint, *args, **kwargs):
+        """ `Session.request`, reported to the hooks. Outside of upload/download tasks it waits for a slot of `limiter`
+        """
+        in_transfer = getattr(self._transfer, "bytes", None) is not None
+        limiter = None if in_transfer else self.limiter
+        if not self._hooks and not in_transfer and limiter is None:
+            return super().request(method, url, *args, **kwargs)
+        if limiter is not None:
+            limiter.acquire()
+        record = {"method": method.upper(), "endpoint": endpoint, "cached": False}
+        self.emit("start", record)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            return response
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["status"] = None if response is None else response.status_code
+            body = response.request.body if response is not None else None
+            record["bytes_sent"] = len(body) if isinstance(body, (bytes, str)) else 0
+            if response is None:
+                record["bytes_received"] = 0
+            elif kwargs.get("stream"):
+                record["bytes_received"] = int(response.headers.get("Content-Length") or 0)
+            else:
+                record["bytes_received"] = len(response.content)
+            ok = record["status"] is not None and record["status"] < 500 and record["status"] != 429
+            if in_transfer:
+                self._transfer.bytes += record["bytes_sent"] + record["bytes_received"]
+                self._transfer.errors += 0 if ok else 1
+            if limiter is not None:
+                limiter.release(start, ok, key=endpoint)
+            self.emit("end", record)
+
+    def open(self):
+        """ Get the csrf cookie, called by the first request sent to the server, a command answered by the cache does not connect at all
+        """
+        if self._opened:
+            return
+        with self._open_lock:
+            if not self._opened:
+                super().request('GET', self._base_url)
+                self._opened = True
     
     def _set_csrf_header(self):
         csrf_token = self.cookies.get("XSRF-TOKEN")
         if csrf_token is not None:
-            if csrf_token != self._header.get("X-XSRF-TOKEN"):
-                self._header["X-XSRF-TOKEN"] = unquote(
-                    csrf_token
-                ).replace('=', '')
+            self._header["X-XSRF-TOKEN"] = csrf_header(csrf_token)
     
     def request(self, method, url, *args, **kwargs):
+        endpoint = url
         url = self._base_url + self._api_version + url
-        self._set_csrf_header()
 
         # print (f"{method} {url}")
 
-        if "headers" in kwargs:
-            headers = self._header.copy()
-            headers.update(kwargs["headers"])
-        else:
-            headers = self._header.copy()
-        kwargs["headers"] = headers
+        if self._cache is not None:
+            if method.upper() == "GET" and endpoint in CACHED_ENDPOINTS:
+                return self._cached_request(method, url, endpoint, *args, **kwargs)
+            if method.upper() != "GET" and not endpoint.startswith("Auth::"):
+                self._cache.invalidate(self._cache_scope())
+
+        self._set_request_headers(kwargs)
+        response = self._send(method, url, endpoint, *args, **kwargs)
+        return response
+
+    def _set_request_headers(self, kwargs:dict):
+        self.open()
+        self._set_csrf_header()
+        kwargs["headers"] = api_headers(self._header, kwargs.get("headers"), kwargs.pop("delete_headers", None))
 
-        if "delete_headers" in kwargs:
-            for del_head in kwargs["delete_headers"]:
-                kwargs["headers"].pop(del_head, None)
-            del kwargs["delete_headers"]
+    def _cache_scope(self):
+        return f"{self._base_url}|{self._cache_user}"
 
-        response = super().request(method, url, *args, **kwargs)
+    def _cached_request(self, method, url, endpoint, *args, **kwargs):
+        """ Answer from `_cache` while the entry is fresh, then revalidate it with its `ETag`/`Last-Modified` if the server sent one.
+        The response is read whole to be stored, even with `stream=True`
+        """
+        scope = self._cache_scope()
+        params = json.dumps([kwargs.get("params"), kwargs.get("json")], sort_keys=True, ensure_ascii=False)
+        key = f"{scope}|{endpoint}|{params}"
+        entry = self._cache.get(key)
+        if entry is not None and entry["fresh"]:
+            if self._hooks:
+                record = {"method": method.upper(), "endpoint": endpoint, "cached": True}
+                self.emit("start", record)
+                self.emit("end", {**record, "status": 200, "seconds": 0, "bytes_sent": 0, "bytes_received": len(entry["response"].content)})
+            return entry["response"]
+        self._set_request_headers(kwargs)
+        if entry is not None:
+            if entry["etag"]:
+                kwargs["headers"]["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                kwargs["headers"]["If-Modified-Since"] = entry["last_modified"]
+        kwargs.pop("stream", None)
+        response = self._send(method, url, endpoint, *args, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self._cache.touch(key)
+            return entry["response"]
+        if response.status_code == 200:
+            self._cache.set(key, scope, response)
         return response
 
+    def download(self, url, *args, **kwargs):
+        """ GET an absolute url such as a photo file, with the pooled connections and cookies of the session.
+        The auth header is only sent to urls of the Lychee server
+        """
+        self.open()
+        self._set_csrf_header()
+        headers = download_headers(self._header, self._base_url, url)
+        headers.update(kwargs.pop("headers", {}))
+        return self._send("GET", url, "download", *args, headers=headers, **kwargs)
+
+class RequestMetrics():
+    """ Hook of `LycheeSession.add_hook` counting requests and transfers per endpoint: latency histograms, status codes, bytes, retries
+    and requests in flight. Read it with `snapshot`, export it with `to_json` or `to_prometheus`
+    """
+    # upper bounds in seconds, like the default buckets of the prometheus clients with longer ones for transfers
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+    def __init__(self, buckets:tuple=None):
+        self._buckets = tuple(buckets or self.BUCKETS)
+        self._lock = threading.Lock()
+        self._requests = {}     # (method, endpoint) -> stats
+        self._transfers = {}    # kind -> stats
+        self._in_flight = 0
+        self._max_in_flight = 0
+
+    def _observe(self, stats:dict, seconds:float):
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        for i, bound in enumerate(self._buckets):
+            if seconds <= bound:
+                stats["buckets"][i] += 1
+                break
+
+    def _new_stats(self, **counters):
+        return {"count": 0, "seconds": 0.0, "buckets": [0] * len(self._buckets), **counters}
+
+    def __call__(self, event:str, record:dict):
+        with self._lock:
+            if event == "start":
+                self._in_flight += 1
+                self._max_in_flight = max(self._max_in_flight, self._in_flight)
+                return
+            if event == "transfer":
+                stats = self._transfers.setdefault(record["kind"], self._new_stats(bytes=0, failed=0))
+                self._observe(stats, record["seconds"])
+                stats["bytes"] += record["bytes"]
+                stats["failed"] += 0 if record["ok"] else 1
+                return
+            stats = self._requests.setdefault((record["method"], record["endpoint"]),
+                                              self._new_stats(status={}, bytes_sent=0, bytes_received=0, retries=0, cached=0))
+            if event == "retry":
+                stats["retries"] += 1
+                return
+            self._in_flight -= 1
+            status = str(record["status"]) if record["status"] is not None else "error"
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+            stats["bytes_sent"] += record["bytes_sent"]
+            stats["bytes_received"] += record["bytes_received"]
+            if record["cached"]:
+                stats["cached"] += 1    # not part of the latency
+            else:
+                self._observe(stats, record["seconds"])
+
+    def _export_stats(self, stats:dict):
+        buckets, total = {}, 0
+        for bound, count in zip(self._buckets, stats["buckets"]):
+            total += count
+            buckets[str(bound)] = total
+        return {**stats, "buckets": {**buckets, "+Inf": stats["count"]}}
+
+    def snapshot(self):
+        """ :return: `dict`, eg. {'requests': [{'method': 'GET', 'endpoint': 'Album', 'count': 3, 'seconds': 0.4, 'buckets': {'0.005': 0, ..., '+Inf': 3},
+            'status': {'200': 3}, 'bytes_sent': 0, 'bytes_received': 5120, 'retries': 0, 'cached': 0}], 'transfers': [{'kind': 'download_photo', ...}],
+            'in_flight': 0, 'max_in_flight': 4}. The buckets are cumulative
+        """
+        with self._lock:
+            return {
+                "requests": [{"method": method, "endpoint": endpoint, **self._export_stats(stats)}
+                             for (method, endpoint), stats in sorted(self._requests.items())],
+                "transfers": [{"kind": kind, **self._export_stats(stats)} for kind, stats in sorted(self._transfers.items())],
+                "in_flight": self._in_flight,
+                "max_in_flight": self._max_in_flight,
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """ :return: `str`, prometheus text exposition format
+        """
+        def labels(**values):
+            escaped = [f'{name}="{str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")}"' for name, value in values.items()]
+            return "{" + ",".join(escaped) + "}"
+
+        def histogram(name:str, help_text:str, items:list, keys:list):
+            lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for item in items:
+                item_labels = {key: item[key] for key in keys}
+                for bound, count in item["buckets"].items():
+                    lines.append(f"{name}_bucket{labels(**item_labels, le=bound)} {count}")
+                lines.append(f"{name}_sum{labels(**item_labels)} {item["seconds"]}")
+                lines.append(f"{name}_count{labels(**item_labels)} {item["count"]}")
+            return lines
+
+        def counter(name:str, help_text:str, samples:list, metric_type:str="counter"):
+            return [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"] + [f"{name}{labels(**values)} {value}" for values, value in samples]
+
+        snapshot = self.snapshot()
+        requests_, transfers = snapshot["requests"], snapshot["transfers"]
+        lines = histogram("pychee6_request_duration_seconds", "Time until the response headers were received", requests_, ["method", "endpoint"])
+        lines += counter("pychee6_requests_total", "Requests by status, error if no response was received",
+                         [({"method": r["method"], "endpoint": r["endpoint"], "status": status}, count) for r in requests_ for status, count in r["status"].items()])
+        for key, help_text in [("bytes_sent", "Bytes of the request bodies"), ("bytes_received", "Bytes of the response bodies"),
+                               ("retries", "Requests sent again after a connection error or 5xx"), ("cached", "Requests answered by the metadata cache")]:
+            lines += counter(f"pychee6_request_{key}_total", help_text, [({"method": r["method"], "endpoint": r["endpoint"]}, r[key]) for r in requests_])
+        lines += counter("pychee6_requests_in_flight", "Requests sent and not answered yet", [({}, snapshot["in_flight"])], "gauge")
+        lines += counter("pychee6_requests_in_flight_max", "Most requests in flight at the same time", [({}, snapshot["max_in_flight"])], "gauge")
+        lines += histogram("pychee6_transfer_duration_seconds", "Duration of the upload/download tasks", transfers, ["kind"])
+        lines += counter("pychee6_transfer_bytes_total", "Bytes sent and received by the upload/download tasks", [({"kind": t["kind"]}, t["bytes"]) for t in transfers])
+        lines += counter("pychee6_transfer_failed_total", "Upload/download tasks that failed", [({"kind": t["kind"]}, t["failed"]) for t in transfers])
+        return "\n".join(lines) + "\n"
+
+class AdaptiveLimiter():
+    """ Number of concurrent requests/transfers adjusted at runtime by AIMD: each success without congestion adds `1/limit` (one slot per round),
+    an error (5xx, 429, no response) or a latency above `tolerance` times the lowest one seen multiplies the limit by `backoff`.
+    Requests started before the last decrease do not decrease it again, a burst of errors counts once
+    """
+    def __init__(self, max_limit:int, min_limit:int=1, initial:int=2, backoff:float=0.5, tolerance:float=2.5):
+        """
+            :param max_limit: [required] upper bound, eg. the number of threads sending
+            :param initial: slots at the start, the limit grows from there
+            :param tolerance: latency compared to the lowest one of the same key that counts as congestion
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._backoff = backoff
+        self._tolerance = tolerance
+        self._in_use = 0
+        self._baselines = {}    # key -> lowest latency, slowly drifting up so a slower network is learnt again
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        """ Wait for a free slot
+        """
+        with self._cond:
+            while self._in_use >= int(self._limit):
+                self._cond.wait()
+            self._in_use += 1
+
+    def release(self, started:float, ok:bool=True, latency:float=None, key=None):
+        """ Free the slot and adjust the limit
+            :param started: [required] `time.perf_counter()` when the slot was acquired
+            :param ok: `False` if the server was overloaded or did not answer
+            :param latency: compared to the lowest latency of `key`, default is the time since `started`. `None` with `started=None` does not adjust the limit
+        """
+        now = time.perf_counter()
+        if latency is None and started is not None:
+            latency = now - started
+        with self._cond:
+            used = self._in_use >= int(self._limit)
+            self._in_use -= 1
+            congested = not ok
+            if ok and latency is not None:
+                baseline = self._baselines.get(key)
+                if baseline is None or latency < baseline:
+                    self._baselines[key] = latency
+                else:
+                    self._baselines[key] = baseline + (latency - baseline) * 0.01
+                    congested = latency > baseline * self._tolerance
+            if congested:
+                if started is None or started >= self._last_decrease:
+                    self._limit = max(self.min_limit, self._limit * self._backoff)
+                    self._last_decrease = now
+            elif latency is not None and used:   # only grow while the slots are all taken
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+class AlbumIndex():
+    """ Client-side index of the album tree returned by `Maintenance::fullTree`
+    + `(parent_id, title) -> [album_id]`: used by `find`, a path lookup costs O(depth)
+    + `album_id -> node`: used by `path`, walks the `parent_id` chain
+    """
+    def __init__(self, tree_data:list=[]):
+        """
+            :param tree_data: album list, see `./api_demo/get_full_tree.json`
+        """
+        self._nodes = {}
+        self._children = {}     # parent_id -> {title: [album_id]}
+        for album in tree_data:
+            self.add(album["id"], album["title"], album["parent_id"])
+
+    def __contains__(self, album_id):
+        return album_id in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add(self, album_id:str, title:str, parent_id:str=None):
+        """ Add an album to the index, an existing album with the same id is replaced
+            :param album_id: [required] album_id
+            :param title: [required] album title
+            :param parent_id: parent album_id, `None` is the root album
+        """
+        if album_id in self._nodes:
+            self._unlink(album_id)
+        self._nodes[album_id] = {"id": album_id, "title": title, "parent_id": parent_id}
+        self._children.setdefault(parent_id, {}).setdefault(title, []).append(album_id)
+
+    def remove(self, album_id:str):
+        """ Remove an album and all of its sub albums from the index
+            :param album_id: [required] album_id
+        """
+        if album_id not in self._nodes:
+            return
+        stack = [album_id]
+        removed = []
+        while stack:
+            cur_id = stack.pop()
+            removed.append(cur_id)
+            for ids in self._children.get(cur_id, {}).values():
+                stack.extend(ids)
+        self._unlink(album_id)
+        for cur_id in removed:
+            self._nodes.pop(cur_id, None)
+            self._children.pop(cur_id, None)
+
+    def move(self, album_id:str, parent_id:str=None):
+        """ Move an album (with its sub albums) under `parent_id`
+            :param album_id: [required] album_id
+            :param parent_id: new parent album_id, `None` is the root album
+        """
+        node = self._nodes.get(album_id)
+        if node is None:
+            return
+        self._unlink(album_id)
+        node["parent_id"] = parent_id
+        self._children.setdefault(parent_id, {}).setdefault(node["title"], []).append(album_id)
+
+    def find(self, path_titles:list):
+        """ Find all albums matching the title path, Lychee allows albums with the same title
+            :param path_titles: [required] titles from the root album, eg. `["depth_1", "depth_2"]`
+            :return: `list`, matching album_ids
+        """
+        cur_ids = [None]
+        for title in path_titles:
+            next_ids = []
+            for cur_id in cur_ids:
+                next_ids += self._children.get(cur_id, {}).get(title, [])
+            if len(next_ids) == 0:
+                return []
+            cur_ids = next_ids
+        return [album_id for album_id in cur_ids if album_id]
+
+    def path(self, album_id:str):
+        """ Get the album path of `album_id`
+            :param album_id: [required] album_id
+            :return: `str`, album_path, empty if the album is unknown
+        """
+        if album_id not in self._nodes:
+            return ""
+        path = []
+        cur_id = album_id
+        while cur_id is not None:
+            album = self._nodes[cur_id]
+            path.insert(0, album["title"])
+            cur_id = album["parent_id"]
+        return "/"+"/".join(path)
+
+    def _unlink(self, album_id):
+        node = self._nodes[album_id]
+        titles = self._children.get(node["parent_id"], {})
+        ids = titles.get(node["title"], [])
+        if album_id in ids:
+            ids.remove(album_id)
+        if len(ids) == 0:
+            titles.pop(node["title"], None)
+
+def file_sha1(file_name:str):
+    """ SHA-1 of a file, the same as the `checksum` of a Lychee photo. The file is read in blocks, it can run in a process pool
+        :param file_name: [required] file path
+        :return: `str`, hex digest
+    """
+    with open(file_name, "rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest()
+
+def new_process_pool():
+    """ A `ProcessPoolExecutor` whose workers are not forked: it is started while the threads of the client are running,
+    a forked child can inherit a lock one of them holds. forkserver where it exists, spawn otherwise
+        :return: `ProcessPoolExecutor`
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return ProcessPoolExecutor(mp_context=multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn"))
+
+def import_rm_title_des():
+    """ `rm_title_des` is imported when it is used, it needs pyexiv2. **:raise ImportError:** if pyexiv2 is not installed
+    """
+    if __package__:
+        from . import rm_title_des
+    else:   # src/ is on sys.path, eg. in the benchmarks
+        import rm_title_des
+    return rm_title_des
+
+def is_case_insensitive(path:str):
+    """ Whether the file system of `path` ignores the case of file names, eg. by default on Windows and macOS
+        :param path: [required] existing directory
+        :return: `bool`
+    """
+    with tempfile.NamedTemporaryFile(prefix=".pychee6_Case_", dir=path) as f:
+        return os.path.exists(os.path.join(path, os.path.basename(f.name).swapcase()))
+
+class NameRegistry():
+    """ Names taken in a directory while it is downloaded, lookups are O(1) and thread safe.
+    Lychee allows the same title more than once, a taken name gets the id appended:
+    157_modify.webp -> 157_modify.[vrnzJDV5TXFCxlJ4UABQzu6G].webp
+    """
+    def __init__(self, case_insensitive:bool=False):
+        """
+            :param case_insensitive: names differing only in case are the same, see `is_case_insensitive`
+        """
+        self._case_insensitive = case_insensitive
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def _key(self, name:str):
+        return name.casefold() if self._case_insensitive else name
+
+    def __contains__(self, name:str):
+        with self._lock:
+            return self._key(name) in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def claim(self, name:str, tag:str, keep_extension:bool=True):
+        """ Take a free name
+            :param name: [required] wanted name
+            :param tag: [required] added as `[tag]` if `name` is taken, eg. the photo id
+            :param keep_extension: `[tag]` is inserted before the extension, otherwise appended like `title.[tag]`
+            :return: `str`, `name` itself if it was free
+        """
+        with self._lock:
+            candidate = name
+            count = 0
+            while self._key(candidate) in self._names:
+                count += 1
+                label = f"[{tag}]" if count == 1 else f"[{tag}.{count}]"
+                if keep_extension:
+                    tmp = name.split(".")
+                    tmp.insert(-1, label)
+                    candidate = ".".join(tmp)
+                else:
+                    candidate = f"{name}.{label}"
+            self._names.add(self._key(candidate))
+            return candidate
+
+class ChecksumCache():
+    """ Persistent SHA-1 cache of local files keyed by `(path, size, mtime)`, only new or changed files are hashed again
+    """
+    def __init__(self, cache_file:str=":memory:"):
+        """
+            :param cache_file: sqlite file, default is an in-memory cache
+        """
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS checksums (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, checksum TEXT)")
+            self._conn.commit()
+
+    def get(self, path:str, size:int, mtime:float):
+        """ :return: `str`, cached checksum, `None` if the file is unknown or has changed
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT checksum FROM checksums WHERE path=? AND size=? AND mtime=?", (path, size, mtime)).fetchone()
+        return row[0] if row else None
+
+    def update(self, rows:list):
+        """ :param rows: [required] list of `(path, size, mtime, checksum)`
+        """
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class MetadataCache():
+    """ Persistent cache of the album responses of `LycheeSession`, kept in a sqlite file so that it is shared by every run.
+    The entries are keyed by host, user, endpoint and parameters
+    """
+    def __init__(self, cache_file:str=None, ttl:float=300):
+        """
+            :param cache_file: sqlite file, default is `pychee6/metadata.db` under `$XDG_CACHE_HOME` (`~/.cache`).
+            It holds the responses of private albums, only the user can read it (mode 0600, the default directory 0700)
+            :param ttl: Seconds an entry is used without asking the server, then it is revalidated or fetched again
+        """
+        if cache_file is None:
+            cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "pychee6")
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            os.chmod(cache_dir, 0o700)
+            cache_file = os.path.join(cache_dir, "metadata.db")
+        os.close(os.open(cache_file, os.O_WRONLY | os.O_CREAT, 0o600))
+        os.chmod(cache_file, 0o600)
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False, timeout=10)
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, scope TEXT, etag TEXT, last_modified TEXT, "
+                               "fetched REAL, url TEXT, body BLOB)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope)")
+            self._conn.commit()
+
+    def get(self, key:str):
+        """ :return: `dict`, eg. {'response': Response, 'fresh': True, 'etag': ..., 'last_modified': ...}, `None` if not cached
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT etag, last_modified, fetched, url, body FROM responses WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, fetched, url, body = row
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = "utf-8"
+        response.headers["Content-Type"] = "application/json"
+        response._content = body
+        response._content_consumed = True
+        return {"response": response, "fresh": time.time() - fetched < self._ttl, "etag": etag, "last_modified": last_modified}
+
+    def set(self, key:str, scope:str, response):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)", (key, scope, response.headers.get("ETag"),
+                               response.headers.get("Last-Modified"), time.time(), response.url, response.content))
+            self._conn.commit()
+
+    def touch(self, key:str):
+        """ The server confirmed the entry is still valid
+        """
+        with self._lock:
+            self._conn.execute("UPDATE responses SET fetched=? WHERE key=?", (time.time(), key))
+            self._conn.commit()
+
+    def invalidate(self, scope:str=None):
+        """ Drop the entries of `scope` (host and user), or all of them
+        """
+        with self._lock:
+            if scope is None:
+                self._conn.execute("DELETE FROM responses")
+            else:
+                self._conn.execute("DELETE FROM responses WHERE scope=?", (scope,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class SyncState():
+    """ Local state of `LycheeClient.sync`: which local directory/file is linked to which album/photo, with checksum, size and mtime.
+    Paths are relative to the synced directory and use `/`, the synced directory itself is `""`.
+    Transfers still updating it call `retain`, the connection is closed by the last `close`
+    """
+    def __init__(self, state_file:str):
+        """
+            :param state_file: [required] sqlite file, created if it does not exist
+        """
+        self._lock = threading.Lock()
+        self._users = 1
+        self._conn = sqlite3.connect(state_file, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS albums (parent TEXT, name TEXT, album_id TEXT, PRIMARY KEY (parent, name))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS photos (dir TEXT, name TEXT, photo_id TEXT, checksum TEXT, size INTEGER, mtime REAL, PRIMARY KEY (dir, name))")
+            self._conn.commit()
+
+    def get_albums(self, parent_dir:str):
+        """ :return: `dict`, `{name: album_id}` of the sub directories of `parent_dir`
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT name, album_id FROM albums WHERE parent=?", (parent_dir,)).fetchall()
+        return dict(rows)
+
+    def set_album(self, parent_dir:str, name:str, album_id:str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO albums VALUES (?, ?, ?)", (parent_dir, name, album_id))
+            self._conn.commit()
+
+    def remove_album(self, parent_dir:str, name:str):
+        """ Forget a directory, its sub directories and files
+        """
+        rel_dir = f"{parent_dir}/{name}" if parent_dir else name
+        prefix = f"{rel_dir}/"
+        with self._lock:
+            self._conn.execute("DELETE FROM albums WHERE (parent=? AND name=?) OR parent=? OR substr(parent, 1, ?)=?",
+                               (parent_dir, name, rel_dir, len(prefix), prefix))
+            self._conn.execute("DELETE FROM photos WHERE dir=? OR substr(dir, 1, ?)=?", (rel_dir, len(prefix), prefix))
+            self._conn.commit()
+
+    def get_photos(self, rel_dir:str):
+        """ :return: `dict`, `{name: {"photo_id", "checksum", "size", "mtime"}}` of the files in `rel_dir`
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT name, photo_id, checksum, size, mtime FROM photos WHERE dir=?", (rel_dir,)).fetchall()
+        return {name: {"photo_id": photo_id, "checksum": checksum, "size": size, "mtime": mtime} for name, photo_id, checksum, size, mtime in rows}
+
+    def set_photo(self, rel_dir:str, name:str, photo_id:str, checksum:str, size:int, mtime:float):
+        """ :param photo_id: `None` means uploaded but not linked to a photo yet, it is linked by checksum on the next run
+        """
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?)", (rel_dir, name, photo_id, checksum, size, mtime))
+            self._conn.commit()
+
+    def remove_photo(self, rel_dir:str, name:str):
+        with self._lock:
+            self._conn.execute("DELETE FROM photos WHERE dir=? AND name=?", (rel_dir, name))
+            self._conn.commit()
+
+    def retain(self):
+        """ Keep the state open until one more `close`
+        """
+        with self._lock:
+            self._users += 1
+
+    def close(self):
+        with self._lock:
+            self._users -= 1
+            if self._users == 0:
+                self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class UploadJournal():
+    """ On-disk journal of unfinished chunked uploads: `file -> (uuid_name, last acknowledged chunk)`.
+    An interrupted upload continues from the next chunk instead of sending the whole file again
+    """
+    def __init__(self, journal_file:str):
+        """
+            :param journal_file: [required] json file, created if it does not exist
+        """
+        self._journal_file = journal_file
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.isfile(journal_file):
+            with open(journal_file, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def get(self, upload_filename:str):
+        """ :return: `dict`, eg. {'album_id': ..., 'uuid_name': ..., 'extension': ..., 'chunk': 3, 'size': ..., 'mtime': ..., 'chunk_size': ...}, `None` if not found
+        """
+        with self._lock:
+            return self._entries.get(os.path.abspath(upload_filename))
+
+    def update(self, upload_filename:str, entry:dict):
+        with self._lock:
+            self._entries[os.path.abspath(upload_filename)] = entry
+            self._save()
+
+    def remove(self, upload_filename:str):
+        with self._lock:
+            if self._entries.pop(os.path.abspath(upload_filename), None) is not None:
+                self._save()
+
+    def _save(self):
+        tmp_file = f"{self._journal_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp_file, self._journal_file)
+
+class AlbumRef():
+    """ A resolved album returned by `LycheeClient.resolve`. Every `album` parameter of `LycheeClient` accepts it, the path lookup is skipped
+    + `id`: album_id, `None` means the root album
+    + `path`: the album_path or album_id it was resolved from
+    """
+    __slots__ = ("id", "path")
+
+    def __init__(self, album_id:str, path:str=None):
+        self.id = album_id
+        self.path = path
+
+    def __repr__(self):
+        return f"AlbumRef({self.id!r}, {self.path!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, AlbumRef) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class Model():
+    """ Base of the records returned by `LycheeClient(use_models=True)`. The fields in `_fields` are attributes,
+    the other keys are kept encoded and only decoded when they are read, eg. `photo.preformatted`.
+    A field missing in the response raises `AttributeError` like an unknown one
+    """
+    __slots__ = ("_extra",)
+    _fields = ()
+
+    def __init__(self, data:dict):
+        for name in self._fields:
+            if name in data:
+                setattr(self, name, data[name])
+        self._set_extra({key: value for key, value in data.items() if key not in self._fields})
+
+    def _set_extra(self, extra:dict):
+        # not `orjson.dumps`, its result keeps the whole output buffer allocated
+        self._extra = json.dumps(extra, ensure_ascii=False, separators=(",", ":")).encode() if extra else b""
+
+    def _get_extra(self):
+        return get_json_backend()(self._extra) if self._extra else {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        extra = self._get_extra()
+        if name not in extra:
+            raise AttributeError(f"{type(self).__name__} has no field {name}")
+        return extra[name]
+
+    def to_dict(self):
+        """ :return: `dict`, as returned by the api
+        """
+        return {**{name: getattr(self, name) for name in self._fields if hasattr(self, name)}, **self._get_extra()}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.id!r}, {self.title!r})"
+
+class SizeVariant(Model):
+    """ + `filesize`: `int`, bytes
+    """
+    __slots__ = ("type", "locale", "filesize", "width", "height", "url")
+    _fields = __slots__
+
+    def __init__(self, data:dict):
+        super().__init__(data)
+        if isinstance(getattr(self, "locale", None), str):
+            self.locale = sys.intern(self.locale)   # the same few strings for every photo
+        if getattr(self, "filesize", None) is not None:
+            self.filesize = parse_filesize(self.filesize)[0]
+
+    def to_dict(self):
+        data = super().to_dict()
+        if data.get("filesize") is not None:
+            data["filesize"] = format_filesize(self.filesize)
+        return data
+
+    def __repr__(self):
+        return f"SizeVariant({getattr(self, "width", None)}x{getattr(self, "height", None)}, {getattr(self, "filesize", None)}, {getattr(self, "url", None)!r})"
+
+class Photo(Model):
+    """ A photo of `get_album`, `size_variant(name)` returns its `SizeVariant`.
+    The variants not in `SIZE_VARIANTS` (eg. the base64 `placeholder`) are kept with the other rarely used keys
+    """
+    __slots__ = ("id", "album_id", "title", "type", "checksum", "created_at", "is_starred", "_variants")
+    _fields = ("id", "album_id", "title", "type", "checksum", "created_at", "is_starred")
+
+    def __init__(self, data:dict):
+        size_variants = data.get("size_variants") or {}
+        self._variants = tuple(SizeVariant(size_variants[name]) if size_variants.get(name) else None for name in SIZE_VARIANTS)
+        others = {name: value for name, value in size_variants.items() if name not in SIZE_VARIANTS}
+        super().__init__({**data, "size_variants": others} if others else {key: value for key, value in data.items() if key != "size_variants"})
+
+    def size_variant(self, name:str):
+        """ :return: `SizeVariant`, `None` if the photo does not have it
+        """
+        return self._variants[SIZE_VARIANTS.index(name)]
+
+    @property
+    def size_variants(self):
+        return {name: variant for name, variant in zip(SIZE_VARIANTS, self._variants)}
+
+    @property
+    def filesize(self):
+        """ `int`, bytes of the original
+        """
+        return getattr(self._variants[0], "filesize", None)
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["size_variants"] = {**{name: variant.to_dict() if variant else None for name, variant in self.size_variants.items()},
+                                 **data.get("size_variants", {})}
+        return data
+
+class Album(Model):
+    """ An album of `get_album`, the sub albums listed in `albums` have no `albums` and `photos`
+    """
+    __slots__ = ("id", "title", "parent_id", "created_at", "albums", "photos")
+    _fields = __slots__
+
+    def __init__(self, data:dict):
+        super().__init__(data)
+        if getattr(self, "albums", None) is not None:
+            self.albums = [Album(album) for album in self.albums]
+        if getattr(self, "photos", None) is not None:
+            self.photos = [Photo(photo) for photo in self.photos]
+
+    def to_dict(self):
+        data = super().to_dict()
+        for key in ["albums", "photos"]:
+            if data.get(key) is not None:
+                data[key] = [item.to_dict() for item in data[key]]
+        return data
+
 class LycheeClient():
     """ 
     + `album_id`: The album id must be a string of 24 bytes in length. for example: `1NIXGEcGdYzLKgxxlNS8CdReX`
     + `album_path`: The album path must start with `/`. If there is only `/`, it means the root album
+    + `AlbumRef`: returned by `resolve`, use it when the same album is passed many times
     """
-    def __init__(self, base_url:str, verbose:bool=False, max_workers:int=5):
+    def __init__(self, base_url:str, verbose:bool=False, max_workers:int=5, album_index_ttl:float=60,
+                 chunk_size:int=1024*1024*25, retries:int=3, retry_backoff:float=1, upload_journal:str=None,
+                 checksum_cache:str=None, download_buffer_size:int=1024*256, meta_workers:int=None,
+                 max_pending:int=None, json_backend=None, use_models:bool=False, metadata_cache=None, metadata_cache_ttl:float=300,
+                 metrics:bool=False, adaptive_concurrency=False, strip_metadata:bool=False):
         """ 
             :param base_url: Lychee API address 如 `http://127.0.0.1:5000/`
             :param max_workers: Maximum number of download threads
+            :param album_index_ttl: Seconds the cached album tree stays valid, `0` means always fetch `fullTree` again
+            :param chunk_size: Upload chunk size in bytes, default is 25M
+            :param retries: How many times a failed request (connection error or 5xx) is sent again
+            :param retry_backoff: Seconds to wait before the first retry, doubled after each retry
+            :param upload_journal: Json file recording unfinished uploads, so they can be resumed. Disabled by default
+            :param checksum_cache: Sqlite file caching the SHA-1 of local files, default is only kept in memory
+            :param download_buffer_size: Bytes read from the response at a time when downloading, default is 256K
+            :param meta_workers: Maximum number of album requests (`get_album`/`create_album`) in flight while `download_album`/`upload_album` walk the tree, default is `max_workers`
+            :param max_pending: Maximum number of uploads/downloads submitted but not finished, walking the tree waits while it is reached. Default is `max_workers * 4`
+            :param json_backend: Decoder of the album responses, see `get_json_backend`. Default is `orjson` or `ujson` if installed
+            :param use_models: `get_album`, `iter_album`, `iter_albums` and `iter_photos` return `Album`/`Photo` instead of `dict`, they take much less memory
+            :param metadata_cache: Keep the album responses on disk across runs, see `MetadataCache`. `True` for the default file, or a sqlite file. Disabled by default
+            :param metadata_cache_ttl: Seconds a cached response is used without asking the server
+            :param metrics: Record latency, status codes, bytes and retries of every request and transfer, see `get_metrics`/`export_metrics`
+            :param adaptive_concurrency: Adjust the number of uploads, downloads and album requests running at the same time to the errors and
+            latency of the server, see `AdaptiveLimiter` and `get_concurrency`. `True`, or a dict of upper bounds eg. {'upload': 2, 'download': 8, 'metadata': 4}.
+            Uploads/downloads never exceed `max_workers`, default bounds are `max_workers` and `meta_workers`
+            :param strip_metadata: Remove the title and description of the photos while uploading them, see `upload_photo`. Needs pyexiv2.
+            `skip_same_checksum` and `sync` compare the files as they are on disk, they do not find the stripped photos
         """
-        self._sess = LycheeSession(base_url)
+        if metadata_cache:
+            metadata_cache = MetadataCache(None if metadata_cache is True else metadata_cache, metadata_cache_ttl)
+        self._meta_workers = meta_workers or max_workers
+        # transfers and album requests run at the same time, each thread keeps its connection alive
+        self._sess = LycheeSession(base_url, max_workers + self._meta_workers, metadata_cache or None)
         self._verbose = verbose
+        self._json_loads = get_json_backend(json_backend)
+        self._use_models = use_models
+        self._strip_metadata = strip_metadata
+        if strip_metadata:
+            import_rm_title_des()
+        self._metrics = None
+        if metrics:
+            self._metrics = RequestMetrics()
+            self._sess.add_hook(self._metrics)
 
         self._tasks_pool = ThreadPoolExecutor(max_workers=max_workers)
-        self._futures = []
-        self._file_name_list = []
+        self._meta_pool = ThreadPoolExecutor(max_workers=self._meta_workers)
+        self._limiters = {}
+        if adaptive_concurrency:
+            bounds = adaptive_concurrency if isinstance(adaptive_concurrency, dict) else {}
+            self._limiters = {
+                "upload": AdaptiveLimiter(min(bounds.get("upload", max_workers), max_workers)),
+                "download": AdaptiveLimiter(min(bounds.get("download", max_workers), max_workers)),
+                "metadata": AdaptiveLimiter(bounds.get("metadata", self._meta_workers)),
+            }
+            self._sess.limiter = self._limiters["metadata"]
+        self._task_slots = threading.BoundedSemaphore(max_pending or max_workers * 4)
+        self._futures = set()   # unfinished
+        self._futures_lock = threading.Lock()
+        self._pending = 0
+        self._results = queue.Queue()
+        self._cancelled = threading.Event()
+
+        self._album_index = None
+        self._album_index_time = None
+        self._album_index_ttl = album_index_ttl
+        self._album_index_lock = threading.RLock()
+
+        self._chunk_size = chunk_size
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._upload_journal = UploadJournal(upload_journal) if upload_journal else None
+
+        self._checksum_cache = ChecksumCache(checksum_cache) if checksum_cache else ChecksumCache()
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+
+        self._download_buffer_size = download_buffer_size
+        self._download_stats = {"photos": 0, "bytes": 0, "original_bytes": 0}
+        self._download_stats_lock = threading.Lock()
     
     def wait_tasks(self):
-        wait(self._futures)
-        self._futures = []
+        """ Wait until all submitted tasks are finished, their results are dropped
+        """
+        for _ in self.iter_results():
+            pass
+
+    def iter_results(self):
+        """ Results of the submitted tasks in the order they finish, eg. of `upload_photo`/`download_photo` and of the album tasks.
+        The generator ends when no task is left. Consume it while `download_album`/`upload_album` are walking the tree, the results are kept until then
+            :return: generator of `dict`
+        """
+        while True:
+            with self._futures_lock:
+                if self._pending == 0 and self._results.empty():
+                    return
+            result = self._results.get()
+            if result is not _TASKS_DONE:
+                yield result
+
+    def cancel_tasks(self):
+        """ Cancel the tasks not started yet and stop walking album trees, running transfers finish.
+        The next `download_album`/`upload_album`/`sync` accepts tasks again
+        """
+        self._cancelled.set()
+        with self._futures_lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
     
     def threadpool_shutdown(self, wait:bool=True):
+        self._meta_pool.shutdown(wait)
         self._tasks_pool.shutdown(wait)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait)
     
     def threadpool_get_futures(self):
-        return self._futures
+        """ Futures of the unfinished tasks, use `iter_results` to get the results
+        """
+        with self._futures_lock:
+            return list(self._futures)
+
+    def _submit(self, pool, fn, *args, on_done=None, **kwargs):
+        """ Submit a task whose result goes to `iter_results`. A transfer waits for a free slot of the `max_pending` window first
+            :param on_done: called with the future before its result is published, also if it was cancelled
+            :return: `Future`, **:raise CancelledError:** after `cancel_tasks`
+        """
+        bounded = pool is self._tasks_pool
+        if bounded:
+            self._task_slots.acquire()
+        if self._cancelled.is_set():
+            if bounded:
+                self._task_slots.release()
+            raise CancelledError("tasks were cancelled")
+        with self._futures_lock:
+            self._pending += 1
+        try:
+            if bounded and (self._sess._hooks or self._limiters):
+                future = pool.submit(self._run_transfer, fn, *args, **kwargs)
+            else:
+                future = pool.submit(fn, *args, **kwargs)
+        except Exception as e:
+            with self._futures_lock:
+                self._pending -= 1
+            if bounded:
+                self._task_slots.release()
+            raise e
+        with self._futures_lock:
+            self._futures.add(future)
+        future.add_done_callback(lambda future: self._task_done(future, bounded, on_done))
+        return future
+
+    def _run_transfer(self, fn, *args, **kwargs):
+        """ Run an upload/download in a slot of its `AdaptiveLimiter` and report it to the session hooks as a 'transfer' event
+        """
+        kind = fn.__name__.strip("_")
+        limiter = self._limiters.get("upload" if kind.startswith("upload") else "download")
+        if limiter is not None:
+            limiter.acquire()
+        self._sess._transfer.bytes = 0
+        self._sess._transfer.errors = 0
+        start = time.perf_counter()
+        result = None
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            transferred = self._sess._transfer.bytes
+            self._sess._transfer.bytes = None
+            # upload_photo returns the message of the server without "Error" when it could not create the photo, eg. ModelDBException
+            failed = not isinstance(result, dict) or "message" in result
+            if limiter is not None:
+                if self._sess._transfer.errors:     # retried chunks, the task may still have succeeded
+                    limiter.release(start, False)
+                elif transferred and not failed:
+                    # seconds per 256K, a longer time for the same amount of data means the server or the network is saturated
+                    limiter.release(start, True, seconds / max(transferred / 2**18, 1))
+                else:   # a skipped file says nothing about the load
+                    limiter.release(start if failed else None, not failed)
+            self._sess.emit("transfer", {"kind": kind, "seconds": seconds, "bytes": transferred, "ok": not failed})
+
+    def get_concurrency(self):
+        """ Needs `LycheeClient(adaptive_concurrency=True)`
+            :return: `dict`, current limits eg. {'upload': 3, 'download': 5, 'metadata': 4}
+        """
+        return {kind: limiter.limit for kind, limiter in self._limiters.items()}
+
+    def add_request_hook(self, hook):
+        """ Call `hook(event, record)` around every request and transfer, see `LycheeSession.add_hook`
+        """
+        self._sess.add_hook(hook)
+
+    def get_metrics(self):
+        """ Needs `LycheeClient(metrics=True)`
+            :return: `dict`, see `RequestMetrics.snapshot`
+        """
+        if self._metrics is None:
+            raise RuntimeError("metrics are disabled, use LycheeClient(metrics=True)")
+        return self._metrics.snapshot()
+
+    def export_metrics(self, fmt:str="prometheus"):
+        """ Needs `LycheeClient(metrics=True)`
+            :param fmt: `prometheus` text exposition format or `json`
+            :return: `str`
+        """
+        if self._metrics is None:
+            raise RuntimeError("metrics are disabled, use LycheeClient(metrics=True)")
+        if fmt == "json":
+            return self._metrics.to_json()
+        if fmt == "prometheus":
+            return self._metrics.to_prometheus()
+        raise ValueError(f"unknown metrics format {fmt}")
+
+    def _task_done(self, future, bounded:bool, on_done):
+        if bounded:
+            self._task_slots.release()
+        result = None
+        try:
+            if on_done is not None:
+                on_done(future)
+            if not future.cancelled():
+                result = future.result()
+        except Exception as e:
+            result = {"message": f"Error {e}"}
+        with self._futures_lock:
+            self._futures.discard(future)
+            if result is not None:
+                self._results.put(result)
+            self._pending -= 1
+            if self._pending == 0:  # wakes up `iter_results`
+                self._results.put(_TASKS_DONE)
+
+    def _album_task(self, fn, *args):
+        """ Run a step of `download_album`/`upload_album` on the metadata pool, an error is returned like the transfer tasks do
+            :return: `dict`, eg. {'album': ..., 'file_name': ...}, `None` if cancelled
+        """
+        album, path = args[0], args[1]
+        try:
+            fn(*args)
+            return {"album": f"{album}", "file_name": f"{path}"}
+        except CancelledError:
+            return None
+        except Exception as e:
+            return {"message": f"Error {fn.__name__} {e}", "album": f"{album}", "file_name": f"{path}"}
+
+    def invalidate_album_index(self):
+        """ Drop the cached album tree, the next path lookup fetches `fullTree` again. Use it if albums were modified by others
+        """
+        with self._album_index_lock:
+            self._album_index = None
+            self._album_index_time = None
+
+    def _load_album_index(self):
+        """ Get the cached `AlbumIndex`, fetch `fullTree` if it has expired. Must be called with `_album_index_lock` held
+            :return: `AlbumIndex`, `None` if the current user is not allowed to get `fullTree`
+        """
+        if self._album_index_time is not None and time.monotonic() - self._album_index_time < self._album_index_ttl:
+            return self._album_index
+
+        tree_data = self.get_full_tree()
+        if isinstance(tree_data, dict): # may be {'message': 'Insufficient privileges', 'exception': 'UnauthorizedException'}
+            if tree_data.get('message') != "Insufficient privileges":
+                raise RuntimeError(f"{str(tree_data)}")
+            self._album_index = None
+        else:
+            self._album_index = AlbumIndex(tree_data)
+        self._album_index_time = time.monotonic()
+        return self._album_index
+
+    def _update_album_index(self, update):
+        """ Apply a change made by this client to the cached album tree instead of fetching it again
+            :param update: [required] callable, receives the `AlbumIndex`
+        """
+        with self._album_index_lock:
+            if self._album_index is not None:
+                update(self._album_index)
+
+    def _request_with_retry(self, method:str, url:str, **kwargs):
+        """ Send a request through the session, retry with exponential backoff on connection errors and 5xx
+            :return: `Response`, the last response if all retries failed. **:raise RequestException:** if the last attempt could not connect
+        """
+        for attempt in range(self._retries + 1):
+            try:
+                r = self._sess.request(method, url, **kwargs)
+                if r.status_code < 500 or attempt == self._retries:
+                    return r
+            except requests.RequestException as e:
+                if attempt == self._retries:
+                    raise e
+            if self._sess._hooks:
+                self._sess.emit("retry", {"method": method.upper(), "endpoint": url, "attempt": attempt + 1})
+            time.sleep(self._retry_backoff * 2 ** attempt)
 
     def login_by_passwd(self, username:str, password:str):
         """ Log in with your account and password
@@ -87,6 +1475,7 @@ class LycheeClient():
         })
 
         if r.status_code == 204:
+            self._sess._cache_user = username
             return True, {}
         return False, r.json()
     
@@ -95,6 +1484,7 @@ class LycheeClient():
         :param token: [required] token
         """
         self._sess._header["Authorization"] = token
+        self._sess._cache_user = hashlib.sha1(token.encode()).hexdigest()
         return True
 
     def get_all_user(self):
@@ -106,19 +1496,85 @@ class LycheeClient():
     def get_album(self, album:str):
         """ Get album properties and content (including detailed album information and picture information)
             :param album: [required] album_id/album_path
-            :return: `dict`, see `./api_demo/get_album.json`
+            :return: `dict`, see `./api_demo/get_album.json`. With `use_models` the `Album` of `resource`, errors are still returned as `dict`
         """
+        res = self._get_album(album)
+        if self._use_models and "resource" in res:
+            return Album(res["resource"])
+        return res
+
+    def _get_album(self, album:str):
         album_id = self.album_path2id_assert(album)
         json_info = {
             "album_id": album_id
         }
-        return self._sess.get("Album", json=json_info).json()
+        return self._json_loads(self._sess.get("Album", json=json_info).content)
     
     def get_albums(self):
         """ Get all albums, smart albums and unclassified pictures in the root directory
             :return: `dict`, see `./api_demo/get_albums.json`
         """
-        return self._sess.get("Albums").json()
+        return self._json_loads(self._sess.get("Albums").content)
+
+    def _model(self, key:str, item:dict):
+        if not self._use_models:
+            return item
+        return Album(item) if key == "albums" else Photo(item)
+
+    def iter_album(self, album:str):
+        """ Like `get_album`, but the sub albums and photos are parsed from the response while it is read.
+            The `Album` api has no pagination, this keeps a large album out of memory. The response stays open until the generator is exhausted or closed
+            :param album: [required] album_id/album_path
+            :return: generator of `(key, dict)`, key is 'albums' for the sub albums, which come first, and 'photos' for the photos.
+                **:raise RuntimeError:** album not accessible
+        """
+        for key, item in self._iter_album(album):
+            yield key, self._model(key, item)
+
+    def _iter_album(self, album:str):
+        album_id = self.album_path2id_assert(album)
+        with self._sess.get("Album", json={"album_id": album_id}, stream=True) as r:
+            if not r.ok:
+                raise RuntimeError(f"{album_id} {r.text}")
+            yield from iter_json_arrays(r.iter_content(self._download_buffer_size), ["albums", "photos"])
+
+    def iter_albums(self, album:str="/", recursive:bool=True):
+        """ Sub albums of `album`, depth first. The children of an album are only fetched when the iteration gets there
+            :param album: album_id/album_path, '/' for the root albums
+            :return: generator of album `dict`, see `albums` in `./api_demo/get_album.json`
+        """
+        if album == "/":
+            res = self.get_albums()
+            children = res["albums"] + res["shared_albums"]  # 有时相册会出现在这里
+        else:
+            children = []
+            for key, item in self._iter_album(album):
+                if key != "albums":
+                    break
+                children.append(item)
+        for child in children:
+            yield self._model("albums", child)
+            if recursive:
+                yield from self.iter_albums(child["id"])
+
+    def iter_photos(self, album:str="/", recursive:bool=True):
+        """ Photos of `album` streamed with `iter_album`, followed by those of the sub albums if `recursive`
+            :param album: album_id/album_path, '/' for the unsorted photos and, if `recursive`, every album
+            :return: generator of photo `dict`, see `photos` in `./api_demo/get_album.json`
+        """
+        children = []
+        for key, item in self._iter_album("unsorted" if album == "/" else album):
+            if key == "albums":
+                children.append(item["id"])
+            else:
+                yield self._model(key, item)
+        if not recursive:
+            return
+        if album == "/":
+            res = self.get_albums()
+            children = [child["id"] for child in res["albums"] + res["shared_albums"]]
+        for child in children:
+            yield from self.iter_photos(child)
 
     def create_album(self, parent_album:str, album_name:str):
         """ create an album, and return `album_id`
@@ -127,10 +1583,13 @@ class LycheeClient():
             :return: `str`, album_id
         """
         album_id = self.album_path2id_assert(parent_album)
-        return self._sess.post("Album", json={
+        r = self._sess.post("Album", json={
             "parent_id": album_id,
             "title": album_name
-        }).text
+        })
+        if r.ok:
+            self._update_album_index(lambda index: index.add(r.text, album_name, album_id))
+        return r.text
 
     def delete_albums(self, albums:list):
         """ delete albums
@@ -139,13 +1598,20 @@ class LycheeClient():
         """
         id_list = []
         for album in albums:
-            if album in ["/", None]:
+            album_id = self.album_path2id_assert(album)
+            if album_id is None:
                 continue
-            id_list.append(self.album_path2id_assert(album))
+            id_list.append(album_id)
 
-        return self._sess.delete("Album", json={
+        r = self._sess.delete("Album", json={
             "album_ids": id_list
-        }).status_code
+        })
+        if r.ok:
+            def update(index):
+                for album_id in id_list:
+                    index.remove(album_id)
+            self._update_album_index(update)
+        return r.status_code
 
     def search(self, album:str, terms:str):
         """ Search keywords, you can specify the album
@@ -155,10 +1621,10 @@ class LycheeClient():
         """
         album_id = self.album_path2id_assert(album)
         terms = base64.b64encode(terms.encode(encoding="utf-8"))
-        return self._sess.get("Search", json={
+        return self._json_loads(self._sess.get("Search", json={
             "terms": terms.decode(),
             "album_id": album_id
-        }).json()
+        }).content)
     
     def get_target_list_albums(self, album_ids:list=[]):
         """ Get the list of albums that can be moved to
@@ -168,49 +1634,88 @@ class LycheeClient():
         data = {}
         if len(album_ids) > 0:
             data["album_ids"] = album_ids
-        return self._sess.get("Album::getTargetListAlbums", json=data).json()
+        return self._json_loads(self._sess.get("Album::getTargetListAlbums", json=data).content)
 
-    def upload_photo(self, album, upload_filename):
-        """ upload to specify the album
+    def upload_photo(self, album, upload_filename, chunk_size:int=None, strip_metadata:bool=None):
+        """ upload to specify the album, chunks are sliced from a memory map of the file and retried on failure. The file is not read
+        into memory at once, but requests copies each chunk into the `bytes` body of the multipart request, so peak memory grows with `chunk_size`.
+        If `upload_journal` is set, an interrupted upload continues from the last acknowledged chunk
             :param album: default is root album
             :param upload_filename: [required] file path
+            :param chunk_size: chunk size in bytes, default is the `chunk_size` of the client
+            :param strip_metadata: remove the title and description (see `rm_title_des`) in a worker process, the other uploads go on meanwhile.
+            The stripped photo is only kept in memory, files without them are sent as they are. Default is the `strip_metadata` of the client
             :return: `dict`, eg. {'file_name': '4.jpg', 'extension': '.jpg', 'uuid_name': 'gAA7GDjP-ru1FRsm.jpg', 'stage': 'uploading', 'chunk_number': 1, 'total_chunks': 7}
         """
         album_id = self.album_path2id_assert(album)
         if album_id == None:
             album_id = "unsorted"
-        chunk_size = 1024 * 1024 * 25    # 25M
+        if chunk_size is None:
+            chunk_size = self._chunk_size
 
         file_name = os.path.basename(upload_filename)
-        file_size = os.path.getsize(upload_filename)
-        chunk_count = math.ceil(file_size / chunk_size)
+        file_stat = os.stat(upload_filename)
+        content = None
+        if self._strip_metadata if strip_metadata is None else strip_metadata:
+            try:
+                content = self._get_process_pool().submit(import_rm_title_des().read_without_title, upload_filename).result()
+            except Exception as e:
+                return {"message": f"Error upload {e}", "upload_filename": f"{upload_filename}", "album": f"{album}", "raw": ""}
+        file_size = file_stat.st_size if content is None else len(content)
+        chunk_count = max(1, math.ceil(file_size / chunk_size))
 
         uuid_name = ''
         extension = ''
+        start_chunk = 0
+        journal = self._upload_journal
+        if journal is not None:
+            entry = journal.get(upload_filename)
+            if entry and (entry["album_id"], entry["size"], entry["mtime"], entry["chunk_size"]) == (album_id, file_size, file_stat.st_mtime, chunk_size):
+                uuid_name = entry["uuid_name"]
+                extension = entry["extension"]
+                start_chunk = entry["chunk"]
+
+        r = None
         try:
             with open(upload_filename, "rb") as f:
-                for i in range(chunk_count):
-                    chunk_data = f.read(chunk_size)
-                    r = self._sess.post("Photo", 
-                                delete_headers=[
-                                    "Content-Type"  # requests won't add a boundary if this header is set when you pass files
-                                ],
-                                files={
-                                    'album_id': (None, album_id),
-                                    'file': ('chunk', chunk_data, 'application/octet-stream'),
-                                    'file_name': (None, file_name),
-                                    'uuid_name': (None, uuid_name),
-                                    'extension': (None, extension),
-                                    'chunk_number': (None, f'{i+1}'),
-                                    'total_chunks': (None, f'{chunk_count}'),
-                                })
-                    uuid_name = r.json()['uuid_name']
-                    extension = r.json()['extension']
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if content is None and file_size else None
+                data = memoryview(content if content is not None else mm if mm is not None else b"")
+                try:
+                    for i in range(start_chunk, chunk_count):
+                        with data[i*chunk_size:(i+1)*chunk_size] as chunk_data:
+                            r = self._request_with_retry("POST", "Photo", 
+                                        delete_headers=[
+                                            "Content-Type"  # requests won't add a boundary if this header is set when you pass files
+                                        ],
+                                        files={
+                                            'album_id': (None, album_id),
+                                            'file': ('chunk', chunk_data, 'application/octet-stream'),
+                                            'file_name': (None, file_name),
+                                            'uuid_name': (None, uuid_name),
+                                            'extension': (None, extension),
+                                            'chunk_number': (None, f'{i+1}'),
+                                            'total_chunks': (None, f'{chunk_count}'),
+                                        })
+                        if r.status_code >= 500:
+                            raise RuntimeError(f"chunk {i+1}/{chunk_count} failed with status {r.status_code}")
+                        res = r.json()
+                        uuid_name = res['uuid_name']
+                        extension = res['extension']
+                        if journal is not None and i+1 < chunk_count:
+                            journal.update(upload_filename, {"album_id": album_id, "uuid_name": uuid_name, "extension": extension, "chunk": i+1,
+                                                             "size": file_size, "mtime": file_stat.st_mtime, "chunk_size": chunk_size})
+                finally:
+                    data.release()
+                    if mm is not None:
+                        mm.close()
         except KeyError as e:
+            if journal is not None:
+                journal.remove(upload_filename)
             return {"message": f"upload_filename: {upload_filename}, album: {album}","raw": r.json()}
-        except Exception as e:  # 交给上层处理
-            print (f"album: {album}, upload_filename: {upload_filename}, full response: {r.text}")
-            raise e
+        except Exception as e:  # 失败的分块已经重试过，保留日志以便下次续传
+            return {"message": f"Error upload {e}", "upload_filename": f"{upload_filename}", "album": f"{album}", "raw": r.text if r is not None else ""}
+        if journal is not None:
+            journal.remove(upload_filename)
         return r.json()
     
     def move_album(self, target_album:str, albums=[]):
@@ -228,6 +1733,11 @@ class LycheeClient():
                             "album_id": target_album_id,
                             "album_ids": album_ids
                         })
+        if r.ok:
+            def update(index):
+                for album_id in album_ids:
+                    index.move(album_id, target_album_id)
+            self._update_album_index(update)
         return r.json() if len(r.text) else {}
 
     def move_photo(self, target_album:str, photo_ids=[]):
@@ -295,18 +1805,183 @@ class LycheeClient():
             })
         return r.json() if len(r.text) else {}
 
+    def _bulk(self, items, batch_size:int, send, max_concurrency:int=None):
+        """ Send `items` in batches, `max_concurrency` batches at a time on the metadata pool
+            :param items: [required] iterable of photo_ids, or of `(photo_id, value)`
+            :param batch_size: [required] items per request
+            :param send: [required] callable sending a batch `list`, returns the `Response`
+            :param max_concurrency: batches in flight, default is `meta_workers`. The batches run on the metadata pool, it can not be more than `meta_workers`
+            :return: `dict`, eg. {'succeeded': [photo_id, ...], 'failed': {photo_id: 'message'}}. **:raise ValueError:** if `max_concurrency` is more than `meta_workers`
+        """
+        if max_concurrency is not None and max_concurrency > self._meta_workers:
+            raise ValueError(f"max_concurrency {max_concurrency} is more than meta_workers {self._meta_workers}, use LycheeClient(meta_workers=...)")
+        report = {"succeeded": [], "failed": {}}
+        def collect(done):
+            for future in done:
+                succeeded, failed = future.result()
+                report["succeeded"] += succeeded
+                report["failed"].update(failed)
+
+        in_flight = set()
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) < batch_size:
+                continue
+            if len(in_flight) >= (max_concurrency or self._meta_workers):
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(self._meta_pool.submit(self._send_batch, batch, send))
+            batch = []
+        if len(batch) > 0:
+            in_flight.add(self._meta_pool.submit(self._send_batch, batch, send))
+        collect(wait(in_flight).done)
+        return report
+
+    def _send_batch(self, batch:list, send):
+        """ A batch rejected because of some of its ids (404/422) is split until they are found
+            :return: `tuple`, `(succeeded, failed)`
+        """
+        ids = [item[0] if isinstance(item, tuple) else item for item in batch]
+        try:
+            r = send(batch)
+        except requests.RequestException as e:
+            return [], dict.fromkeys(ids, f"Error {e}")
+        if r.ok:
+            return ids, {}
+        if r.status_code in [404, 422] and len(batch) > 1:
+            half = len(batch) // 2
+            succeeded, failed = self._send_batch(batch[:half], send)
+            succeeded_2, failed_2 = self._send_batch(batch[half:], send)
+            return succeeded + succeeded_2, {**failed, **failed_2}
+        return [], dict.fromkeys(ids, f"{r.status_code} {r.text}")
+
+    def bulk_move_photos(self, target_album:str, photo_ids, batch_size:int=500, max_concurrency:int=None):
+        """ `move_photo` for any number of photos, see `_bulk`
+            :param target_album: target album, if is void, will move to root album
+            :param photo_ids: [required] iterable of photo_ids
+            :return: `dict`, eg. {'succeeded': [photo_id, ...], 'failed': {photo_id: 'message'}}
+        """
+        target_album_id = self.album_path2id_assert(target_album)
+        return self._bulk(photo_ids, batch_size, lambda batch: self._request_with_retry("POST", "Photo::move",
+                          json={"album_id": target_album_id, "photo_ids": batch}), max_concurrency)
+
+    def bulk_copy_photos(self, target_album:str, photo_ids, batch_size:int=500, max_concurrency:int=None):
+        """ `copy_photo` for any number of photos. A failed batch is not sent again, the server may have copied a part of it
+            :param target_album: target album, if is void, will copy to root album
+            :param photo_ids: [required] iterable of photo_ids
+            :return: `dict`, eg. {'succeeded': [photo_id, ...], 'failed': {photo_id: 'message'}}
+        """
+        target_album_id = self.album_path2id_assert(target_album)
+        return self._bulk(photo_ids, batch_size, lambda batch: self._sess.post("Photo::copy",
+                          json={"album_id": target_album_id, "photo_ids": batch}), max_concurrency)
+
+    def bulk_star_photos(self, photo_ids, is_star:bool, batch_size:int=500, max_concurrency:int=None):
+        """ `star_photo` for any number of photos
+            :return: `dict`, eg. {'succeeded': [photo_id, ...], 'failed': {photo_id: 'message'}}
+        """
+        return self._bulk(photo_ids, batch_size, lambda batch: self._request_with_retry("POST", "Photo::star",
+                          json={"is_starred": is_star, "photo_ids": batch}), max_concurrency)
+
+    def bulk_delete_photos(self, photo_ids, batch_size:int=500, max_concurrency:int=None):
+        """ `delete_photo` for any number of photos
+            :return: `dict`, eg. {'succeeded': [photo_id, ...], 'failed': {photo_id: 'message'}}
+        """
+        return self._bulk(photo_ids, batch_size, lambda batch: self._request_with_retry("DELETE", "Photo",
+                          json={"photo_ids": batch}), max_concurrency)
+
+    def bulk_rename_photos(self, titles, max_concurrency:int=None):
+        """ `rename_photo` for any number of photos, the api takes one photo per request so they are sent concurrently
+            :param titles: [required] iterable of `(photo_id, title)`, or a `dict`
+            :return: `dict`, eg. {'succeeded': [photo_id, ...], 'failed': {photo_id: 'message'}}
+        """
+        if isinstance(titles, dict):
+            titles = titles.items()
+        return self._bulk(((photo_id, title) for photo_id, title in titles), 1, lambda batch: self._request_with_retry("PATCH", "Photo::rename",
+                          json={"photo_id": batch[0][0], "title": batch[0][1]}), max_concurrency)
+
     def get_full_tree(self):
         """ Get the complete album tree structure, only the root user can access it
             :return: `dict`, see `./api_demo/get_full_tree.json`
         """
         r = self._sess.get("Maintenance::fullTree")
-        return r.json()
+        return self._json_loads(r.content)
+
+    def _is_downloaded(self, file_name:str, checksum:str=None, filesize=None):
+        """ Whether `file_name` already holds the photo, see `download_photo`
+        """
+        if not (checksum or filesize) or not os.path.isfile(file_name):
+            return False
+        if filesize is not None:
+            try:
+                size, tolerance = parse_filesize(filesize)
+                if abs(os.path.getsize(file_name) - size) > tolerance:
+                    return False
+            except ValueError:
+                if checksum is None:
+                    return False
+        if checksum:
+            return self._file_checksum(file_name) == checksum
+        return True
+
+    def _file_checksum(self, file_name:str):
+        """ SHA-1 of one file from the checksum cache, or hashed in the calling thread instead of a round trip through the process pool
+            :return: `str`, see `checksum_files`
+        """
+        file_stat = os.stat(file_name)
+        path = os.path.abspath(file_name)
+        checksum = self._checksum_cache.get(path, file_stat.st_size, file_stat.st_mtime)
+        if checksum is None:
+            checksum = file_sha1(file_name)
+            self._checksum_cache.update([(path, file_stat.st_size, file_stat.st_mtime, checksum)])
+        return checksum
 
-    def download_photo(self, url:str, save_full_name:str):
-        """ download an photo to specify path
-            :param url: [required] photo url
+    def select_size_variant(self, photo:dict, variant="original"):
+        """ see `select_size_variant`
+        """
+        return select_size_variant(photo, variant)
+
+    def get_download_stats(self):
+        """ Sizes of the variants selected by `download_album` since the last `reset_download_stats`, skipped photos included
+            :return: `dict`, eg. {'photos': 10, 'bytes': 1096765, 'original_bytes': 3612160, 'saved_bytes': 2515395}
+        """
+        with self._download_stats_lock:
+            stats = dict(self._download_stats)
+        stats["saved_bytes"] = stats["original_bytes"] - stats["bytes"]
+        return stats
+
+    def reset_download_stats(self):
+        with self._download_stats_lock:
+            self._download_stats = {"photos": 0, "bytes": 0, "original_bytes": 0}
+
+    def _count_download(self, photo:dict, size_variant:dict):
+        try:
+            size = parse_filesize(size_variant["filesize"])[0]
+            original_size = parse_filesize(photo["size_variants"]["original"]["filesize"])[0]
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._download_stats_lock:
+            self._download_stats["photos"] += 1
+            self._download_stats["bytes"] += size
+            self._download_stats["original_bytes"] += original_size
+
+    def download_photo(self, url, save_full_name:str, checksum:str=None, filesize=None, variant="original"):
+        """ download an photo to specify path. The data is written to `<name>.part` first and renamed when finished,
+        an existing `.part` file is resumed with a Range request
+            :param url: [required] photo url, or the photo `dict`/`Photo` returned by `get_album`, then `checksum` and `filesize` are taken from it
             :param save_full_name: [required] photo name, If there is no extension, it will be automatically appended to ensure that it can be opened as a picture
+            :param checksum: SHA-1 of the photo, an existing file with the same checksum is skipped
+            :param filesize: size of the photo, `int` or formatted like `352.75 KB`. An existing file of a different size is downloaded again, if only `filesize` is given, an existing file of the same size is skipped
+            :param variant: size variant used if `url` is a photo, see `select_size_variant`
+            :return: `dict`, eg. {'url': ..., 'file_name': ..., 'skipped': False}
         """
+        if isinstance(url, Photo):
+            url = url.to_dict()
+        if isinstance(url, dict):
+            variant, size_variant = self.select_size_variant(url, variant)
+            # the checksum is the one of the original
+            checksum = url["checksum"] if variant == "original" else None
+            url, filesize = size_variant["url"], size_variant["filesize"]
 
         save_ext = save_full_name.split('.')[-1]
         url_ext = url.split('.')[-1]
@@ -314,65 +1989,189 @@ class LycheeClient():
             save_full_name = f"{save_full_name}.{url_ext}"
 
         try:
-            r = requests.get(url, stream=True)
-            count = 0
-            with open(save_full_name, "wb") as f:
-                for item in r.iter_content(10240):
-                    count += len(item)
-                    f.write(item)
-            return {"url":f"{url}", "file_name":f"{save_full_name}"}
+            if self._is_downloaded(save_full_name, checksum, filesize):
+                return {"url":f"{url}", "file_name":f"{save_full_name}", "skipped": True}
+
+            part_name = f"{save_full_name}.part"
+            offset = os.path.getsize(part_name) if os.path.isfile(part_name) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            r = self._sess.download(url, stream=True, headers=headers)
+            if r.status_code == 416 and self._is_downloaded(part_name, checksum, filesize):
+                r.close()   # the part file is already complete
+            else:
+                if r.status_code == 416:    # the part file is not the photo, eg. it was replaced on the server, start again
+                    r.close()
+                    r = self._sess.download(url, stream=True)
+                r.raise_for_status()
+                with open(part_name, "ab" if r.status_code == 206 else "wb") as f:
+                    for item in r.iter_content(self._download_buffer_size):
+                        f.write(item)
+            os.replace(part_name, save_full_name)
+            return {"url":f"{url}", "file_name":f"{save_full_name}", "skipped": False}
         except Exception as e:
             return {"message":f"Error download {e}", "url":f"{url}", "file_name":f"{save_full_name}"}
             
 
-    def download_album(self, album:str, save_path="./"):
-        """ Recursively download an album
+    def _download_zip(self, photos:list, save_path:str, variant:str, names:NameRegistry):
+        """ Download photos with one request to the `Zip` api, the archive is unpacked while it is received
+            :param photos: [required] list of `(photo, file_name)`, titles must be unique within the batch, see `_zip_keys`
+            :param save_path: [required] target path
+            :param variant: [required] size variant, eg. `original`, it must not be null for any of the photos
+            :param names: [required] names taken in `save_path`, an entry not matching any photo is renamed if its name is taken
+            :return: `dict`, eg. {'url': ..., 'file_name': save_path, 'files': 10, 'skipped': 2}
+        """
+        todo = []
+        for photo, file_name in photos:
+            size_variant = photo["size_variants"][variant]
+            full_name = os.path.join(save_path, file_name)
+            url_ext = size_variant["url"].split('.')[-1]
+            if file_name.split('.')[-1] != url_ext:
+                full_name = f"{full_name}.{url_ext}"
+            if self._is_downloaded(full_name, photo["checksum"] if variant == "original" else None, size_variant["filesize"]):
+                continue
+            todo.append((photo, file_name))
+
+        url = f"Zip?photo_ids={','.join(photo['id'] for photo, _ in todo)}&variant={variant.upper()}"
+        if len(todo) == 0:
+            return {"url": url, "file_name": save_path, "files": 0, "skipped": len(photos)}
+        if len(todo) == 1:  # Lychee returns a single photo as it is
+            photo, file_name = todo[0]
+            return self.download_photo(photo, os.path.join(save_path, file_name), variant=variant)
+
+        keys = {}
+        for item in todo:
+            for key in self._zip_keys(item[0]["title"]):
+                keys[key] = item
+        count = 0
+        try:
+            with self._sess.get("Zip", params={"photo_ids": ",".join(photo["id"] for photo, _ in todo), "variant": variant.upper()},
+                                stream=True, headers={"Accept": "*/*"}) as r:
+                r.raise_for_status()
+                for name, chunks in iter_zip_stream(r.iter_content(self._download_buffer_size), self._download_buffer_size):
+                    entry_name = name.split("/")[-1]
+                    item = next((keys[key] for key in self._zip_keys(entry_name, True) if key in keys), None)
+                    if item is None:
+                        full_name = os.path.join(save_path, names.claim(entry_name, count))
+                    else:
+                        for key in self._zip_keys(item[0]["title"]):
+                            keys.pop(key, None)
+                        full_name = os.path.join(save_path, item[1])
+                        entry_ext = item[0]["size_variants"][variant]["url"].split('.')[-1]
+                        if item[1].split('.')[-1] != entry_ext:
+                            full_name = f"{full_name}.{entry_ext}"
+                    part_name = f"{full_name}.part"
+                    with open(part_name, "wb") as f:
+                        for data in chunks:
+                            f.write(data)
+                    os.replace(part_name, full_name)
+                    count += 1
+        except Exception as e:
+            return {"message": f"Error download {e}", "url": url, "file_name": save_path, "files": count}
+        res = {"url": url, "file_name": save_path, "files": count, "skipped": len(photos) - len(todo)}
+        if count < len(todo):
+            res["message"] = f"{len(todo) - count} photos are missing in the archive"
+        return res
+
+    def _zip_keys(self, name:str, is_entry:bool=False):
+        """ Keys used to match the entries of a `Zip` archive to photos. An entry is named after the photo title plus the extension of the size variant
+            :return: `list`
+        """
+        name = name.casefold()
+        keys = [name]
+        for _ in range(2 if is_entry else 1):
+            if "." not in name:
+                break
+            name = name.rsplit(".", 1)[0]
+            keys.append(name)
+        return keys
+
+    def download_album(self, album:str, save_path="./", zip_batch_size:int=0, variant:str="original"):
+        """ Recursively download an album. The albums are walked on the metadata pool and this method returns at once,
+        use `iter_results` or `wait_tasks` to wait for the whole tree. At most `max_pending` photos are scheduled ahead of the downloads
             :param album: [required] album_id/album_path
             :param save_path: [required] target path
+            :param zip_batch_size: if greater than 1, photos are downloaded in batches of this size through the `Zip` api, which is faster for many small photos
+            :param variant: size variant to download: original/medium2x/medium/small2x/small/thumb2x/thumb, or a list tried in order, see `select_size_variant`.
+            The sizes are summed up in `get_download_stats`
         """
-        # print (f"{album_id}:{save_path}")
         album_id = self.album_path2id_assert(album)
         os.makedirs(save_path, exist_ok=True)
+        self._cancelled.clear()
+        self._submit(self._meta_pool, self._album_task, self._download_album, album_id, save_path, zip_batch_size, variant,
+                     is_case_insensitive(save_path))
+
+    def _download_album(self, album_id:str, save_path:str, zip_batch_size:int, variant, case_insensitive:bool):
+        # print (f"{album_id}:{save_path}")
+        os.makedirs(save_path, exist_ok=True)
         
-        album_info = self.get_album(album_id)
+        album_info = self._get_album(album_id)
+        # sub albums and photos of this album, dropped when it is done
+        names = NameRegistry(case_insensitive)
         if "albums" in album_info["resource"].keys():
-            downloaded_title = []
             for album in album_info["resource"]["albums"]:
-                album_id = album["id"]
-                album_title = album["title"]
-                if album_title in downloaded_title:
-                    album_title += f".[{album["id"]}]"
-                else:
-                    downloaded_title.append(album_title)
-                self.download_album(album_id, os.path.join(save_path, album_title))
+                album_title = names.claim(album["title"], album["id"], keep_extension=False)
+                self._submit(self._meta_pool, self._album_task, self._download_album, album["id"], os.path.join(save_path, album_title),
+                             zip_batch_size, variant, case_insensitive)
         
+        zip_batches = []
+        zip_variant = variant if isinstance(variant, str) else variant[0]
         for photo in album_info["resource"]["photos"]:
-            photo_id = photo["id"]
-            file_name = photo["title"]
-            photo_url = photo["size_variants"]["original"]["url"]
-            # file_size = photo["size_variants"]["original"]["filesize"]
+            variant_name, size_variant = self.select_size_variant(photo, variant)
+            self._count_download(photo, size_variant)
 
             """
                 The problem of Lychee allowing the same name can be solved by appending the id. If it is solved in download_photo, there will be thread insecurity issues.
                 157_modify.webp -> 157_modify.[vrnzJDV5TXFCxlJ4UABQzu6G].webp
             """
-            full_name = os.path.join(save_path, file_name)
-            if full_name in self._file_name_list:
-                tmp = file_name.split(".")
-                tmp.insert(-1, f"[{photo_id}]")
-                file_name = ".".join(tmp)
-            else:
-                self._file_name_list.append(full_name)
-            self._futures.append(self._tasks_pool.submit(self.download_photo, photo_url, os.path.join(save_path, file_name)))
+            file_name = names.claim(photo["title"], photo["id"])
 
-    def upload_album(self, album:str, path:str, skip_exist_photo=False):
-        """ Used to upload folders to the specified directory
+            # the `Zip` api takes a single variant, photos falling back to another one are downloaded alone
+            if zip_batch_size > 1 and variant_name == zip_variant:
+                # titles in a batch must be unique so the entries can be matched to the photos
+                keys = set(self._zip_keys(photo["title"]))
+                for batch, batch_keys in zip_batches:
+                    if len(batch) < zip_batch_size and batch_keys.isdisjoint(keys):
+                        break
+                else:
+                    batch, batch_keys = [], set()
+                    zip_batches.append((batch, batch_keys))
+                batch.append((photo, file_name))
+                batch_keys.update(keys)
+                if len(batch) == zip_batch_size:
+                    zip_batches.remove((batch, batch_keys))
+                    self._submit(self._tasks_pool, self._download_zip, batch, save_path, zip_variant, names)
+                continue
+            self._submit(self._tasks_pool, self.download_photo, photo, os.path.join(save_path, file_name), variant=variant_name)
+
+        for batch, _ in zip_batches:
+            self._submit(self._tasks_pool, self._download_zip, batch, save_path, zip_variant, names)
+
+    def upload_album(self, album:str, path:str, skip_exist_photo=False, skip_same_checksum=False):
+        """ Used to upload folders to the specified directory. The directories are walked on the metadata pool and this method returns at once,
+        use `iter_results` or `wait_tasks` to wait for the whole tree. At most `max_pending` files are scheduled ahead of the uploads
             :param album: album
             :param path: [required] directory to upload
-            :param skip_exist_photo: skip exist photo, default is False
+            :param skip_exist_photo: skip photos with the same title, default is False
+            :param skip_same_checksum: skip files whose SHA-1 matches a photo in the album, default is False
         """
-        album_id = self.album_path2id_assert(album)
-        res = self.get_album(album_id)
+        album_ref = self.resolve(album)
+        self._cancelled.clear()
+        self._submit(self._meta_pool, self._album_task, self._upload_album, album_ref, path, skip_exist_photo, skip_same_checksum)
+
+    def upload_photos(self, album:str, upload_filenames:list):
+        """ `upload_photo` on the worker pool, returns once the files are scheduled. Use `iter_results` or `wait_tasks` for the results
+            :param album: album
+            :param upload_filenames: [required] files to upload
+        """
+        album_ref = self.resolve(album)
+        self._cancelled.clear()
+        for upload_filename in upload_filenames:
+            self._submit(self._tasks_pool, self.upload_photo, album_ref, upload_filename)
+
+    def _upload_album(self, album_ref:AlbumRef, path:str, skip_exist_photo:bool, skip_same_checksum:bool):
+        album = album_ref.path
+        album_id = album_ref.id
+        res = self._get_album(album_ref)
         # cur_title = res["resource"]["title"]
         if self._verbose:
             print (f"album_id: {album_id}, album: {album}")
@@ -385,31 +2184,375 @@ class LycheeClient():
                 continue
             title_id_map[album["title"]] = album["id"]
         
-        photo_title_list = []
+        photo_title_list = set()
         if skip_exist_photo:
             for photo in res["resource"]["photos"]:
-                photo_title_list.append(photo["title"])
+                photo_title_list.add(photo["title"])
             # print (photo_title_list)
+
+        photo_checksums = set()
+        if skip_same_checksum:
+            for photo in res["resource"]["photos"]:
+                photo_checksums.add(photo["checksum"])
+                photo_checksums.add(photo.get("original_checksum"))
+            photo_checksums.discard(None)
         
-        for entry_name in os.listdir(path):
+        entry_names = os.listdir(path)
+        file_checksums = {}
+        if skip_same_checksum and len(photo_checksums) > 0:
+            file_checksums = self.checksum_files([os.path.join(path, entry_name) for entry_name in entry_names
+                                                  if os.path.isfile(os.path.join(path, entry_name))])
+
+        for entry_name in entry_names:
             tmp_name = os.path.join(path, entry_name)
             if os.path.isdir(tmp_name):
-                id = title_id_map.get(entry_name)
-                if not id:
-                    id = self.create_album(album_id, entry_name)
-                self.upload_album(id, tmp_name)
+                self._submit(self._meta_pool, self._album_task, self._upload_sub_album, album_ref, tmp_name,
+                             title_id_map.get(entry_name), skip_exist_photo, skip_same_checksum)
             elif os.path.isfile(tmp_name):
                 # 这里不判断文件是否能够上传 交由api判断 Test: 上传非图片文件、上传视频
                 if skip_exist_photo and (os.path.basename(entry_name) in photo_title_list):
                     # print (f"{entry_name} is exist")
                     continue
-                self._futures.append(self._tasks_pool.submit(self.upload_photo, album_id, tmp_name))
+                if file_checksums.get(tmp_name) in photo_checksums:
+                    continue
+                self._submit(self._tasks_pool, self.upload_photo, album_ref, tmp_name)
     
+    def _upload_sub_album(self, parent_album:AlbumRef, path:str, album_id:str, skip_exist_photo:bool, skip_same_checksum:bool):
+        """ Create the album of a sub directory if `album_id` is None, then upload the directory into it
+        """
+        if not album_id:
+            album_id = self.create_album(parent_album, os.path.basename(path))
+        self._upload_album(AlbumRef(album_id, album_id), path, skip_exist_photo, skip_same_checksum)
+
+    def _get_process_pool(self):
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                self._process_pool = new_process_pool()
+            return self._process_pool
+
+    def checksum_files(self, file_names:list):
+        """ Get the SHA-1 of local files, unchanged files are read from the checksum cache, the others are hashed in a process pool
+            :param file_names: [required] file path list
+            :return: `dict`, `{file_name: checksum}`
+        """
+        res = {}
+        missing = []
+        for file_name in file_names:
+            file_stat = os.stat(file_name)
+            checksum = self._checksum_cache.get(os.path.abspath(file_name), file_stat.st_size, file_stat.st_mtime)
+            if checksum is None:
+                missing.append((file_name, file_stat))
+            else:
+                res[file_name] = checksum
+
+        if len(missing) > 0:
+            names = [file_name for file_name, _ in missing]
+            checksums = self._get_process_pool().map(file_sha1, names, chunksize=max(1, len(names) // 64))
+            rows = []
+            for (file_name, file_stat), checksum in zip(missing, checksums):
+                res[file_name] = checksum
+                rows.append((os.path.abspath(file_name), file_stat.st_size, file_stat.st_mtime, checksum))
+            self._checksum_cache.update(rows)
+        return res
+
+    def sync(self, album:str, path:str, state_file:str=None, mirror_deletes:bool=False):
+        """ Two-way incremental sync between an album and a local directory, only the difference since the last run is transferred:
+        new local files are uploaded, new remote photos are downloaded, deletions are mirrored if `mirror_deletes`.
+        Transfers run in the thread pool, the state is updated when each of them finishes and closed after the last one, call `wait_tasks` before exiting.
+        A renamed or moved file is linked to its photo by the checksum instead of being uploaded again
+            :param album: [required] album_id/album_path, `/` means the root albums and unsorted photos
+            :param path: [required] local directory
+            :param state_file: sqlite file keeping the sync state, default is `.pychee6_sync.db` in `path`
+            :param mirror_deletes: delete remote photos/albums deleted locally, and local files/directories deleted remotely, default is False.
+            Only what was synced and has not changed since is deleted: a modified file, a file or photo added since the last run and the directory
+            or album holding them are kept and reported in `conflicts`
+            :return: `dict`, scheduled operations, eg. {'uploaded': 3, 'downloaded': 1, 'linked': 0, 'deleted_remote': 0, 'deleted_local': 0, 'conflicts': ['album/a.jpg']}
+        """
+        album_id = self.album_path2id_assert(album)
+        os.makedirs(path, exist_ok=True)
+        self._cancelled.clear()
+        if state_file is None:
+            state_file = os.path.join(path, SYNC_STATE_NAME)
+        summary = dict.fromkeys(["uploaded", "downloaded", "linked", "deleted_remote", "deleted_local"], 0)
+        summary["conflicts"] = []
+        with SyncState(state_file) as state:
+            self._sync_album(album_id, path, "", state, mirror_deletes, summary)
+        return summary
+
+    def _submit_synced(self, state:SyncState, fn, *args, on_done, **kwargs):
+        """ Submit a transfer of `sync`, the state is kept open until `on_done` closes it
+        """
+        state.retain()
+        try:
+            return self._submit(self._tasks_pool, fn, *args, on_done=on_done, **kwargs)
+        except Exception as e:
+            state.close()
+            raise e
+
+    def _sync_album(self, album_id, local_dir, rel_dir, state, mirror_deletes, summary):
+        if album_id is None:
+            res = self.get_albums()
+            remote_albums = res["albums"] + res["shared_albums"]
+            remote_photos = self._get_album("unsorted")["resource"]["photos"]
+        else:
+            res = self._get_album(album_id)
+            if "resource" not in res:
+                raise RuntimeError(f"{album_id} {str(res)}")
+            remote_albums = res["resource"]["albums"]
+            remote_photos = res["resource"]["photos"]
+        album_ref = AlbumRef(album_id)
+
+        local_dirs = {}
+        local_files = {}
+        with os.scandir(local_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(SYNC_STATE_NAME) or entry.name.endswith(".part"):
+                    continue
+                if entry.is_dir():
+                    local_dirs[entry.name] = entry.path
+                elif entry.is_file():
+                    local_files[entry.name] = entry.stat()
+
+        # photos: link by the state first, then by checksum
+        remote_photo_ids = {photo["id"] for photo in remote_photos}
+        known_photos = state.get_photos(rel_dir)
+        claimed = {row["photo_id"] for row in known_photos.values()}
+        unclaimed = {}  # checksum -> [photo]
+        for photo in remote_photos:
+            if photo["id"] not in claimed:
+                unclaimed.setdefault(photo["checksum"], []).append(photo)
+
+        def pop_unclaimed(checksum):
+            photos = unclaimed.get(checksum)
+            return photos.pop() if photos else None
+
+        changed_names = []
+        missing = {}    # name -> photo_id of the files deleted locally, unless they were renamed
+        for name, row in known_photos.items():
+            local_stat = local_files.get(name)
+            photo_id = row["photo_id"]
+            if photo_id is None:    # uploaded last time, the photo id is unknown
+                photo = pop_unclaimed(row["checksum"])
+                if photo is not None:
+                    photo_id = photo["id"]
+                    state.set_photo(rel_dir, name, photo_id, row["checksum"], row["size"], row["mtime"])
+            remote_exists = photo_id in remote_photo_ids
+            if local_stat is None and not remote_exists:
+                state.remove_photo(rel_dir, name)
+            elif local_stat is None:    # deleted locally or renamed
+                missing[name] = photo_id
+            elif photo_id is not None and not remote_exists:    # deleted remotely
+                if not mirror_deletes:
+                    continue
+                if (local_stat.st_size, local_stat.st_mtime) == (row["size"], row["mtime"]):
+                    os.remove(os.path.join(local_dir, name))
+                    state.remove_photo(rel_dir, name)
+                    summary["deleted_local"] += 1
+                else:   # modified since the last sync
+                    summary["conflicts"].append(f"{rel_dir}/{name}" if rel_dir else name)
+            elif (local_stat.st_size, local_stat.st_mtime) != (row["size"], row["mtime"]):
+                changed_names.append(name)
+
+        new_names = [name for name in local_files if name not in known_photos]
+        checksums = self.checksum_files([os.path.join(local_dir, name) for name in changed_names + new_names])
+        renamed = {}    # checksum -> [name] of the missing files
+        for name in missing:
+            renamed.setdefault(known_photos[name]["checksum"], []).append(name)
+        upload_names = []
+        for name in changed_names + new_names:
+            local_stat = local_files[name]
+            checksum = checksums[os.path.join(local_dir, name)]
+            row = known_photos.get(name)
+            if row is not None and row["checksum"] == checksum:     # only touched
+                state.set_photo(rel_dir, name, row["photo_id"], checksum, local_stat.st_size, local_stat.st_mtime)
+                continue
+            if row is None and renamed.get(checksum):
+                old_name = renamed[checksum].pop()
+                state.remove_photo(rel_dir, old_name)
+                state.set_photo(rel_dir, name, missing.pop(old_name), checksum, local_stat.st_size, local_stat.st_mtime)
+                summary["linked"] += 1
+                continue
+            photo = pop_unclaimed(checksum)
+            if photo is not None:
+                state.set_photo(rel_dir, name, photo["id"], checksum, local_stat.st_size, local_stat.st_mtime)
+                summary["linked"] += 1
+                continue
+            replaced_id = row["photo_id"] if row is not None and row["photo_id"] in remote_photo_ids else None
+            upload_names.append((name, checksum, local_stat, replaced_id))
+
+        if mirror_deletes and len(missing) > 0:
+            self.delete_photo(list(missing.values()))
+            for name in missing:
+                state.remove_photo(rel_dir, name)
+            summary["deleted_remote"] += len(missing)
+
+        for name, checksum, local_stat, replaced_id in upload_names:
+            def uploaded(future, name=name, checksum=checksum, local_stat=local_stat, replaced_id=replaced_id):
+                try:
+                    if future.cancelled() or future.exception() is not None:
+                        return
+                    if future.result().get("message") is None:
+                        state.set_photo(rel_dir, name, None, checksum, local_stat.st_size, local_stat.st_mtime)
+                        if replaced_id is not None:     # the local file was modified, the old photo is replaced
+                            self.delete_photo([replaced_id])
+                finally:
+                    state.close()
+            self._submit_synced(state, self.upload_photo, album_ref, os.path.join(local_dir, name), on_done=uploaded)
+            summary["uploaded"] += 1
+
+        taken_names = set(local_files) | set(known_photos)
+        for photos in unclaimed.values():
+            for photo in photos:
+                photo_url = photo["size_variants"]["original"]["url"]
+                file_name = photo["title"]
+                url_ext = photo_url.split('.')[-1]
+                if file_name.split('.')[-1] != url_ext:
+                    file_name = f"{file_name}.{url_ext}"
+                if file_name in taken_names:
+                    tmp = file_name.split(".")
+                    tmp.insert(-1, f"[{photo["id"]}]")
+                    file_name = ".".join(tmp)
+                taken_names.add(file_name)
+
+                def downloaded(future, file_name=file_name, photo=photo):
+                    try:
+                        if future.cancelled() or future.exception() is not None:
+                            return
+                        if future.result().get("message") is None:
+                            local_stat = os.stat(os.path.join(local_dir, file_name))
+                            state.set_photo(rel_dir, file_name, photo["id"], photo["checksum"], local_stat.st_size, local_stat.st_mtime)
+                    finally:
+                        state.close()
+                self._submit_synced(state, self.download_photo, photo_url, os.path.join(local_dir, file_name), photo["checksum"],
+                             photo["size_variants"]["original"]["filesize"], on_done=downloaded)
+                summary["downloaded"] += 1
+
+        # albums
+        remote_album_ids = {album["id"] for album in remote_albums}
+        known_albums = state.get_albums(rel_dir)
+        linked_ids = set(known_albums.values())
+        for name, sub_dir in local_dirs.items():
+            sub_id = known_albums.get(name)
+            if sub_id is not None and sub_id not in remote_album_ids:   # deleted remotely
+                if mirror_deletes and self._delete_synced_dir(sub_dir, f"{rel_dir}/{name}" if rel_dir else name, state, summary):
+                    state.remove_album(rel_dir, name)
+                    summary["deleted_local"] += 1
+                continue
+            if sub_id is None:
+                for album in remote_albums:
+                    if album["title"] == name and album["id"] not in linked_ids:
+                        sub_id = album["id"]
+                        break
+                else:
+                    sub_id = self.create_album(album_ref, name)
+                linked_ids.add(sub_id)
+                state.set_album(rel_dir, name, sub_id)
+            self._sync_album(sub_id, sub_dir, f"{rel_dir}/{name}" if rel_dir else name, state, mirror_deletes, summary)
+
+        for name, sub_id in known_albums.items():
+            if name in local_dirs:
+                continue
+            if sub_id not in remote_album_ids:
+                state.remove_album(rel_dir, name)
+            elif mirror_deletes:    # deleted locally
+                if self._delete_synced_album(sub_id, f"{rel_dir}/{name}" if rel_dir else name, state, summary):
+                    state.remove_album(rel_dir, name)
+                    summary["deleted_remote"] += 1
+
+        taken_names = set(local_dirs) | set(local_files) | set(known_albums)
+        for album in remote_albums:
+            if album["id"] in linked_ids:
+                continue
+            name = album["title"]
+            if name in taken_names:
+                name += f".[{album["id"]}]"
+            taken_names.add(name)
+            sub_dir = os.path.join(local_dir, name)
+            os.makedirs(sub_dir, exist_ok=True)
+            state.set_album(rel_dir, name, album["id"])
+            self._sync_album(album["id"], sub_dir, f"{rel_dir}/{name}" if rel_dir else name, state, mirror_deletes, summary)
+
+    def _delete_synced_dir(self, local_dir:str, rel_dir:str, state:SyncState, summary:dict):
+        """ Mirror the deletion of an album to its directory: the files recorded in the state and unchanged since the last sync are deleted,
+        the others are reported in `conflicts` and the directory is only removed if nothing is left
+            :return: `bool`, whether the directory was removed
+        """
+        for name, row in state.get_photos(rel_dir).items():
+            file_name = os.path.join(local_dir, name)
+            try:
+                local_stat = os.stat(file_name)
+            except FileNotFoundError:
+                state.remove_photo(rel_dir, name)
+                continue
+            if (local_stat.st_size, local_stat.st_mtime) == (row["size"], row["mtime"]):
+                os.remove(file_name)
+                state.remove_photo(rel_dir, name)
+        for name in state.get_albums(rel_dir):
+            sub_dir = os.path.join(local_dir, name)
+            if not os.path.isdir(sub_dir) or self._delete_synced_dir(sub_dir, f"{rel_dir}/{name}", state, summary):
+                state.remove_album(rel_dir, name)
+
+        left = []
+        with os.scandir(local_dir) as entries:
+            for entry in entries:
+                left.append(entry.name)
+                if entry.is_file() or entry.name not in state.get_albums(rel_dir):  # the kept sub directories report their own files
+                    summary["conflicts"].append(f"{rel_dir}/{entry.name}")
+        if len(left) > 0:
+            return False
+        os.rmdir(local_dir)
+        return True
+
+    def _delete_synced_album(self, album_id:str, rel_dir:str, state:SyncState, summary:dict):
+        """ Mirror the deletion of a directory to its album: the photos recorded in the state are deleted, photos and albums added
+        on the server since the last sync are reported in `conflicts` and the album is only deleted if nothing is left
+            :return: `bool`, whether the album was deleted
+        """
+        res = self._get_album(album_id)
+        if "resource" not in res:
+            raise RuntimeError(f"{album_id} {str(res)}")
+        rows = state.get_photos(rel_dir)
+        known_photos = {row["photo_id"]: name for name, row in rows.items() if row["photo_id"] is not None}
+        # uploaded by the last run, the photo id is unknown
+        unlinked = {row["checksum"]: name for name, row in rows.items() if row["photo_id"] is None}
+        delete_photo_ids = []
+        kept = False
+        for photo in res["resource"]["photos"]:
+            if photo["id"] not in known_photos and photo["checksum"] in unlinked:
+                known_photos[photo["id"]] = unlinked.pop(photo["checksum"])
+            if photo["id"] in known_photos:
+                delete_photo_ids.append(photo["id"])
+            else:
+                summary["conflicts"].append(f"{rel_dir}/{photo['title']}")
+                kept = True
+        if len(delete_photo_ids) > 0:
+            self.delete_photo(delete_photo_ids)
+            for photo_id in delete_photo_ids:
+                state.remove_photo(rel_dir, known_photos[photo_id])
+
+        known_albums = {sub_id: name for name, sub_id in state.get_albums(rel_dir).items()}
+        for sub_album in res["resource"]["albums"]:
+            name = known_albums.get(sub_album["id"])
+            if name is None:
+                summary["conflicts"].append(f"{rel_dir}/{sub_album['title']}")
+                kept = True
+            elif self._delete_synced_album(sub_album["id"], f"{rel_dir}/{name}", state, summary):
+                state.remove_album(rel_dir, name)
+            else:
+                kept = True
+        if kept:
+            return False
+        self.delete_albums([album_id])
+        return True
+
     def album_path2id(self, album_path: str):
         """ Get `album_id` based on `album_path` may return multiple matching results. if you are not root user, will use get_album to get album_id, which requires multiple requests.
             :param album_path: [required] If the album path does not start with `/`, it returns `[album_path]` itself. If it starts with `/`, it returns `[None]`
             :return: Returns a `list` containing all matching `album_id`
         """
+        if isinstance(album_path, AlbumRef):
+            return [album_path.id]
+
         if album_path in ["/", None, ""]:
             return [None]
 
@@ -419,46 +2562,27 @@ class LycheeClient():
         path_titles = album_path.strip('/').split('/')
         res_list = []
 
-        tree_data = self.get_full_tree()
-        if isinstance(tree_data, dict): # may be {'message': 'Insufficient privileges', 'exception': 'UnauthorizedException'}
-            if tree_data['message']=="Insufficient privileges":
-                # print (f"无权限 尝试通过get_album获取album_id")
-                def find_id(album_id, path_titles_part):
-                    if len(path_titles_part) == 0:
-                        return [album_id]
-                    albums = self.get_album(album_id)["resource"]["albums"]
-                    if len(albums) == 0:
-                        return []
-                    for album in albums:
-                        if album['title'] == path_titles_part[0]:
-                            return find_id(album['id'], path_titles_part[1:])
-                    return []
-                        
-                albums = self.get_albums()["albums"]
-                for album in albums:
-                    if album['title'] == path_titles[0]:
-                        res_list += find_id(album['id'], path_titles[1:])
-                return res_list
-            else:
-                raise RuntimeError(f"{str(tree_data)}")
-
-        id_album_dict = {album['id']: album for album in tree_data}
-
-        def find_paths(path_titles, cur_id):
-            if len(path_titles) == 0:
-                if cur_id:
-                    res_list.append(cur_id)
-                return 
-
-            cur_name = path_titles.pop(0)
-            cur_name_album_list = [album for album in id_album_dict.values() if album["title"]==cur_name]
-
-            for cur_name_album in cur_name_album_list:
-                if cur_name_album["parent_id"] == cur_id:
-                    find_paths(path_titles.copy(), cur_name_album["id"])
-
-        find_paths(path_titles.copy(), None)
+        with self._album_index_lock:
+            index = self._load_album_index()
+            if index is not None:
+                return index.find(path_titles)
 
+        # print (f"无权限 尝试通过get_album获取album_id")
+        def find_id(album_id, path_titles_part):
+            if len(path_titles_part) == 0:
+                return [album_id]
+            albums = self._get_album(album_id)["resource"]["albums"]
+            if len(albums) == 0:
+                return []
+            for album in albums:
+                if album['title'] == path_titles_part[0]:
+                    return find_id(album['id'], path_titles_part[1:])
+            return []
+                
+        albums = self.get_albums()["albums"]
+        for album in albums:
+            if album['title'] == path_titles[0]:
+                res_list += find_id(album['id'], path_titles[1:])
         return res_list
     
     def album_path2id_assert(self, title_path:str):
@@ -471,43 +2595,40 @@ class LycheeClient():
             raise RuntimeError(f"{title_path} There are multiple matching results or no matching results {str(res)}If multiple matches are allowed, use album_path2id")
         return res[0]
 
+    def resolve(self, album):
+        """ Resolve an album once, the result can be passed to every method instead of album_id/album_path
+            :param album: [required] album_id/album_path/`AlbumRef`
+            :return: `AlbumRef`, **:raise RuntimeError:** If there is no unique result
+        """
+        if isinstance(album, AlbumRef):
+            return album
+        return AlbumRef(self.album_path2id_assert(album), album)
+
     def album_id2path(self, album_id):
         """ Get `album_path` based on `album_id`. if you are not root user, will use get_album to get album_id, which requires multiple requests.
         :param album_id: [required] album_id
         :return: album_path
         """
+        if isinstance(album_id, AlbumRef):
+            if album_id.id is None:
+                return "/"
+            album_id = album_id.id
         if album_id[0] == '/':
             return album_id
-        tree_data = self.get_full_tree()
-        path = []
 
-        if isinstance(tree_data, dict): # may be {'message': 'Insufficient privileges', 'exception': 'UnauthorizedException'}
-            if tree_data['message']=="Insufficient privileges":
-                # print ("无权限，通过get_album获取album_path")
-                path = []
-                while True:
-                    album_info = self.get_album(album_id)
-                    path.insert(0, album_info["resource"]["title"])
-                    if album_info["resource"]["parent_id"] == None:
-                        break
-                    album_id = album_info["resource"]["parent_id"]
-                return "/"+"/".join(path)
-            else:
-                raise RuntimeError(f"{str(tree_data)}")
-        
-        id_album_dict = {album['id']: album for album in tree_data}
-        
-        if album_id not in id_album_dict:
-            return ""
-        
-        cur_id = album_id
+        with self._album_index_lock:
+            index = self._load_album_index()
+            if index is not None:
+                return index.path(album_id)
+
+        # print ("无权限，通过get_album获取album_path")
+        path = []
         while True:
-            album = id_album_dict.get(cur_id, None)
-            path.insert(0, album["title"])
-            cur_id = album['parent_id']
-            if cur_id == None:
+            album_info = self._get_album(album_id)
+            path.insert(0, album_info["resource"]["title"])
+            if album_info["resource"]["parent_id"] == None:
                 break
-
+            album_id = album_info["resource"]["parent_id"]
         return "/"+"/".join(path)
     
     def get_album_tree(self):
@@ -538,7 +2659,7 @@ class LycheeClient():
             if album_id in get_album_cache:
                 return get_album_cache[album_id]
             try:
-                album_info = self.get_album(album_id)
+                album_info = self._get_album(album_id)
                 parent_id = album_info["resource"].get("parent_id")
                 get_album_cache[album_id] = parent_id
                 return parent_id
@@ -602,8 +2723,6 @@ if __name__ == "__main__":
  下载链接
  http://127.0.0.1:8802/api/v2/Zip?photo_ids=woCJEEe3PIRBNjrfxqBZtPho&variant=ORIGINAL
 
- - 下载图片接口放到Session中
- - 下载图片的接口没有设置header，可能对于加密的图片不能直接访问
  - 线程池中的任务异常不会传递出来
  - 实现分块上传
  - 跳过同名图片